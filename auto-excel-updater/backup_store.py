@@ -0,0 +1,239 @@
+"""Deduplicating backup store for workbooks.
+
+A backup is a small JSON manifest listing the zip members of the workbook.
+Each member is split into chunks (worksheet XML is cut every few hundred
+rows, so a changed cell only touches one chunk) and every chunk is stored
+once under its SHA-256 in objects/. Backing up an unchanged file is a no-op,
+and a retention policy thins out old snapshots before unreferenced chunks
+are garbage-collected.
+
+latest.json points at the newest snapshot together with the (mtime, size)
+the file had when it was taken, so backing up an untouched file reads
+nothing else. A changed file is compared member by member against that
+snapshot using the CRCs in the zip directory, and only members whose CRC
+changed are decompressed and chunked.
+"""
+import hashlib
+import json
+import os
+import re
+import tempfile
+import zipfile
+import zlib
+from datetime import datetime, timedelta
+
+ROWS_PER_CHUNK = 256
+ROW_END = re.compile(rb'</row>')
+
+
+def split_chunks(data):
+    """Cut worksheet XML after every ROWS_PER_CHUNK rows; other data stays whole"""
+    chunks = []
+    start = 0
+    for count, match in enumerate(ROW_END.finditer(data), start=1):
+        if count % ROWS_PER_CHUNK == 0:
+            chunks.append(data[start:match.end()])
+            start = match.end()
+    chunks.append(data[start:])
+    return chunks
+
+
+def write_atomic(path, data):
+    fd, temp_path = tempfile.mkstemp(dir=os.path.dirname(path))
+    try:
+        with os.fdopen(fd, 'wb') as f:
+            f.write(data)
+        os.replace(temp_path, path)
+    except BaseException:
+        if os.path.exists(temp_path):
+            os.remove(temp_path)
+        raise
+
+
+class BackupStore:
+    # Retention: keep everything for a day, the newest per hour for a week,
+    # then the newest per day
+    KEEP_ALL = timedelta(days=1)
+    KEEP_HOURLY = timedelta(days=7)
+
+    def __init__(self, root_dir):
+        self.root_dir = root_dir
+        self.objects_dir = os.path.join(root_dir, 'objects')
+        self.snapshots_dir = os.path.join(root_dir, 'snapshots')
+        self.latest_path = os.path.join(root_dir, 'latest.json')
+
+    def _object_path(self, digest):
+        return os.path.join(self.objects_dir, digest[:2], digest)
+
+    def _put(self, data):
+        """Store a chunk once, returning its hash"""
+        digest = hashlib.sha256(data).hexdigest()
+        path = self._object_path(digest)
+        if not os.path.exists(path):
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+            write_atomic(path, zlib.compress(data, 6))
+        return digest
+
+    def _get(self, digest):
+        with open(self._object_path(digest), 'rb') as f:
+            return zlib.decompress(f.read())
+
+    def _manifest(self, snapshot_id):
+        manifest_path = os.path.join(self.snapshots_dir, snapshot_id + '.json')
+        if not os.path.exists(manifest_path):
+            raise ValueError(f"Backup '{snapshot_id}' not found")
+        with open(manifest_path, 'r', encoding='utf-8') as f:
+            return json.load(f)
+
+    def _latest(self):
+        """(file identity recorded with it, manifest) of the newest snapshot; (None, None) for an empty store"""
+        try:
+            with open(self.latest_path, 'r', encoding='utf-8') as f:
+                pointer = json.load(f)
+            return pointer['identity'], self._manifest(pointer['id'])
+        except (OSError, ValueError, KeyError):
+            # Stores written before the pointer existed
+            existing = self.snapshots()
+            return None, existing[-1] if existing else None
+
+    def _point_at(self, snapshot_id, identity):
+        write_atomic(self.latest_path, json.dumps({'id': snapshot_id, 'identity': identity}).encode('utf-8'))
+
+    def snapshots(self):
+        """All snapshot manifests, oldest first"""
+        if not os.path.isdir(self.snapshots_dir):
+            return []
+        manifests = []
+        for name in os.listdir(self.snapshots_dir):
+            if name.endswith('.json'):
+                with open(os.path.join(self.snapshots_dir, name), 'r', encoding='utf-8') as f:
+                    manifests.append(json.load(f))
+        return sorted(manifests, key=lambda manifest: manifest['created'])
+
+    def backup(self, file_path):
+        """Snapshot file_path unless it matches the latest snapshot.
+
+        Returns (snapshot id, created) where created is False when the
+        content was unchanged and the existing snapshot is reused.
+        """
+        stat = os.stat(file_path)
+        identity = [stat.st_mtime_ns, stat.st_size]
+        latest_identity, latest = self._latest()
+        if latest is not None and latest_identity == identity:
+            return latest['id'], False
+
+        previous = {}
+        if latest is not None and not latest['raw']:
+            previous = {member['name']: member for member in latest['members']}
+        members = []
+        try:
+            with zipfile.ZipFile(file_path) as zf:
+                for info in zf.infolist():
+                    old = previous.get(info.filename)
+                    if old is not None and (old.get('crc'), old.get('file_size')) == (info.CRC, info.file_size):
+                        # Unchanged member: its chunks are already stored
+                        chunks = old['chunks']
+                    else:
+                        chunks = [self._put(chunk) for chunk in split_chunks(zf.read(info))]
+                    members.append({
+                        'name': info.filename,
+                        'date_time': list(info.date_time),
+                        'compress_type': info.compress_type,
+                        'crc': info.CRC,
+                        'file_size': info.file_size,
+                        'chunks': chunks
+                    })
+            raw = False
+        except zipfile.BadZipFile:
+            with open(file_path, 'rb') as f:
+                members.append({'name': '', 'chunks': [self._put(f.read())]})
+            raw = True
+
+        if latest is not None and latest['raw'] == raw and (
+                [(member['name'], member['chunks']) for member in latest['members']]
+                == [(member['name'], member['chunks']) for member in members]):
+            # Saved again with the same content
+            self._point_at(latest['id'], identity)
+            return latest['id'], False
+
+        created = datetime.now()
+        snapshot_id = created.strftime("%Y%m%d_%H%M%S")
+        os.makedirs(self.snapshots_dir, exist_ok=True)
+        suffix = 1
+        while os.path.exists(os.path.join(self.snapshots_dir, snapshot_id + '.json')):
+            suffix += 1
+            snapshot_id = created.strftime("%Y%m%d_%H%M%S") + f"_{suffix}"
+
+        manifest = {
+            'id': snapshot_id,
+            'created': created.isoformat(),
+            'source': os.path.basename(file_path),
+            'size': stat.st_size,
+            'raw': raw,
+            'members': members
+        }
+        write_atomic(os.path.join(self.snapshots_dir, snapshot_id + '.json'),
+                     json.dumps(manifest).encode('utf-8'))
+        self._point_at(snapshot_id, identity)
+        return snapshot_id, True
+
+    def restore(self, snapshot_id, target_path):
+        """Write the workbook as it was at snapshot_id to target_path"""
+        manifest = self._manifest(snapshot_id)
+
+        directory = os.path.dirname(os.path.abspath(target_path))
+        fd, temp_path = tempfile.mkstemp(suffix='.xlsx', dir=directory)
+        os.close(fd)
+        try:
+            if manifest['raw']:
+                with open(temp_path, 'wb') as f:
+                    for digest in manifest['members'][0]['chunks']:
+                        f.write(self._get(digest))
+            else:
+                with zipfile.ZipFile(temp_path, 'w') as zf:
+                    for member in manifest['members']:
+                        info = zipfile.ZipInfo(member['name'], tuple(member['date_time']))
+                        info.compress_type = member['compress_type']
+                        zf.writestr(info, b''.join(self._get(digest) for digest in member['chunks']))
+            os.replace(temp_path, target_path)
+        except BaseException:
+            if os.path.exists(temp_path):
+                os.remove(temp_path)
+            raise
+
+    def apply_retention(self, now=None):
+        """Delete snapshots outside the retention policy and unreferenced chunks.
+
+        Returns the number of snapshots removed.
+        """
+        now = now or datetime.now()
+        manifests = self.snapshots()
+        kept = []
+        buckets = set()
+        for manifest in reversed(manifests):
+            created = datetime.fromisoformat(manifest['created'])
+            age = now - created
+            if age <= self.KEEP_ALL:
+                kept.append(manifest)
+                continue
+            bucket = created.strftime('%Y%m%d%H') if age <= self.KEEP_HOURLY else created.strftime('%Y%m%d')
+            if bucket not in buckets:
+                buckets.add(bucket)
+                kept.append(manifest)
+
+        kept_ids = {manifest['id'] for manifest in kept}
+        removed = 0
+        for manifest in manifests:
+            if manifest['id'] not in kept_ids:
+                os.remove(os.path.join(self.snapshots_dir, manifest['id'] + '.json'))
+                removed += 1
+
+        if removed:
+            referenced = {digest for manifest in kept
+                          for member in manifest['members'] for digest in member['chunks']}
+            for prefix in os.listdir(self.objects_dir):
+                prefix_dir = os.path.join(self.objects_dir, prefix)
+                for digest in os.listdir(prefix_dir):
+                    if digest not in referenced:
+                        os.remove(os.path.join(prefix_dir, digest))
+        return removed
@@ -0,0 +1,327 @@
+"""Benchmarks for the Excel updater hot paths.
+
+Generates synthetic "Master Sheet" workbooks with the real layout (trade
+column on row 3, merged header bands on row 3 with location sub-headers on
+row 4, data from row 5) and times each phase separately: workbook load,
+structure detection, trade/location lookups (cold and memoized),
+normalize_header, cell updates, save and the in-place XML patch. A second
+pass under tracemalloc records the peak memory of every phase.
+
+Results are written as JSON so runs can be compared over time.
+
+Usage:
+    python benchmark.py                          # small, medium and large
+    python benchmark.py --sizes xlarge --repeats 1
+    python benchmark.py --compare benchmark_results/bench_20250101_120000.json
+"""
+import argparse
+import json
+import os
+import platform
+import random
+import shutil
+import statistics
+import subprocess
+import tempfile
+import time
+import tracemalloc
+from datetime import datetime
+
+import openpyxl
+from openpyxl.utils import get_column_letter
+from openpyxl.worksheet.cell_range import CellRange
+
+from main import ExcelUpdater
+
+# (trades, header bands); every band has one column per location
+SIZES = {
+    'small': (100, 8),
+    'medium': (1000, 20),
+    'large': (5000, 35),
+    'xlarge': (20000, 56),
+}
+DEFAULT_SIZES = ['small', 'medium', 'large']
+
+LOCATIONS = ['Bhuv.', 'G/W', 'Raipur', 'Amber.', 'Ahmd.', 'Jaipur', 'G.Noida', 'Hapur', "B'glore"]
+HEADERS = ['Pending Demand ', ' Mimimum Kit to be Ready ', 'Ready Kits', 'Current offering',
+           'Inspected Kits', 'Dispatched Kits', 'Pending Dispatches', 'Barcodes Pending']
+DATA_TYPES_PER_RECORD = 3
+
+PHASES = ['load', 'detect', 'lookup_cold', 'lookup_warm', 'normalize_header', 'update', 'save', 'fast_patch']
+
+
+def header_names(bands):
+    """The real band headers first, then numbered stages to reach the requested width"""
+    names = list(HEADERS[:bands])
+    names += [f"Stage {index} Kits" for index in range(len(names) + 1, bands + 1)]
+    return names
+
+
+def trade_names(trades):
+    return [f"Trade {index:05d}" for index in range(1, trades + 1)]
+
+
+def generate_workbook(path, trades, bands, seed):
+    """Write a synthetic master sheet in write-only mode so large sizes stay cheap"""
+    rng = random.Random(seed)
+    headers = header_names(bands)
+    wb = openpyxl.Workbook(write_only=True)
+    sheet = wb.create_sheet("Master Sheet")
+
+    sheet.append([])
+    sheet.append([])
+    header_row = [None, 'S. No.', 'Trade Name']
+    location_row = [None, None, None]
+    for header in headers:
+        header_row += [header] + [None] * (len(LOCATIONS) - 1)
+        location_row += LOCATIONS
+    sheet.append(header_row)
+    sheet.append(location_row)
+
+    sheet.merged_cells.add(CellRange('B3:B4'))
+    sheet.merged_cells.add(CellRange('C3:C4'))
+    for band in range(bands):
+        start_col = 4 + band * len(LOCATIONS)
+        end_col = start_col + len(LOCATIONS) - 1
+        sheet.merged_cells.add(CellRange(f"{get_column_letter(start_col)}3:{get_column_letter(end_col)}3"))
+
+    width = bands * len(LOCATIONS)
+    for index, trade in enumerate(trade_names(trades), start=1):
+        sheet.append([None, index, trade] + [rng.randint(0, 5000) for _ in range(width)])
+    wb.save(path)
+
+
+def workbook_for(size, cache_dir, seed):
+    """Return the path of the synthetic workbook for a size, generating it once"""
+    trades, bands = SIZES[size]
+    os.makedirs(cache_dir, exist_ok=True)
+    path = os.path.join(cache_dir, f"master_{trades}x{bands}_{seed}.xlsx")
+    if not os.path.exists(path):
+        print(f"Generating {size} workbook ({trades} trades x {bands * len(LOCATIONS)} columns)...", flush=True)
+        generate_workbook(path + '.tmp', trades, bands, seed)
+        os.replace(path + '.tmp', path)
+    return path
+
+
+def make_queries(trades, bands, count, seed):
+    """Random (trade, location, data type) lookups spread over the whole sheet"""
+    rng = random.Random(seed)
+    names = trade_names(trades)
+    headers = [header.strip() for header in header_names(bands)]
+    return [(rng.choice(names), rng.choice(LOCATIONS), rng.choice(headers)) for _ in range(count)]
+
+
+def make_records(queries, count):
+    """Group queries into Keyword:Value records as parse_input would produce them"""
+    records = []
+    for start in range(0, min(count * DATA_TYPES_PER_RECORD, len(queries)), DATA_TYPES_PER_RECORD):
+        trade, location, _ = queries[start]
+        record = {'Trade': trade, 'Location': location}
+        for _, _, data_type in queries[start:start + DATA_TYPES_PER_RECORD]:
+            record[data_type] = '1'
+        records.append(record)
+    return records
+
+
+def run_phases(source_path, work_path, queries, records, normalize_rounds, measure):
+    """Run every phase once on a fresh copy of the workbook.
+
+    measure(phase, func) runs func and records its cost; phases run in order
+    so each one starts from the state the previous one left behind.
+    """
+    shutil.copyfile(source_path, work_path)
+    updater = ExcelUpdater()
+    state = {}
+
+    def load():
+        state['wb'] = openpyxl.load_workbook(work_path)
+        state['sheet'] = state['wb']["Master Sheet"]
+
+    def detect():
+        state['structure'] = updater.detect_excel_structure(state['sheet'])
+
+    def lookup():
+        for trade, location, data_type in queries:
+            updater.find_target_cell(state['sheet'], state['structure'], trade, location, data_type)
+
+    def normalize():
+        names = [info['original_name'] for info in state['structure']['headers'].values()]
+        for _ in range(normalize_rounds):
+            for name in names:
+                updater.normalize_header(name)
+
+    def update():
+        for data in records:
+            updater.apply_record(state['sheet'], state['structure'], data)
+
+    def save():
+        state['wb'].save(work_path)
+        state['wb'].close()
+        del state['wb'], state['sheet']
+
+    def fast_patch():
+        updater.patch_excel(work_path, state['structure'], records)
+
+    measure('load', load)
+    measure('detect', detect)
+    measure('lookup_cold', lookup)
+    measure('lookup_warm', lookup)
+    measure('normalize_header', normalize)
+    measure('update', update)
+    measure('save', save)
+    measure('fast_patch', fast_patch)
+
+
+def benchmark_size(size, args, work_dir):
+    trades, bands = SIZES[size]
+    source_path = workbook_for(size, args.cache_dir, args.seed)
+    work_path = os.path.join(work_dir, os.path.basename(source_path))
+    queries = make_queries(trades, bands, args.lookups, args.seed)
+    records = make_records(queries, args.records)
+    ops = {
+        'lookup_cold': len(queries),
+        'lookup_warm': len(queries),
+        'normalize_header': args.normalize_rounds * bands,
+        'update': len(records),
+        'fast_patch': len(records),
+    }
+
+    timings = {phase: [] for phase in PHASES}
+
+    def timed(phase, func):
+        start = time.perf_counter()
+        func()
+        timings[phase].append(time.perf_counter() - start)
+
+    for _ in range(args.repeats):
+        run_phases(source_path, work_path, queries, records, args.normalize_rounds, timed)
+
+    phases = {}
+    for phase in PHASES:
+        samples = timings[phase]
+        phases[phase] = {
+            'min_s': min(samples),
+            'median_s': statistics.median(samples),
+            'max_s': max(samples),
+        }
+        if phase in ops:
+            phases[phase]['ops'] = ops[phase]
+            phases[phase]['per_op_us'] = statistics.median(samples) / ops[phase] * 1e6
+
+    if args.memory:
+        # Separate pass: tracemalloc slows allocation-heavy code and would skew timings
+        def traced(phase, func):
+            tracemalloc.reset_peak()
+            before = tracemalloc.get_traced_memory()[0]
+            func()
+            current, peak = tracemalloc.get_traced_memory()
+            phases[phase]['peak_bytes'] = peak - before
+            phases[phase]['retained_bytes'] = current - before
+
+        tracemalloc.start()
+        try:
+            run_phases(source_path, work_path, queries, records, args.normalize_rounds, traced)
+        finally:
+            tracemalloc.stop()
+
+    return {
+        'size': size,
+        'trades': trades,
+        'columns': bands * len(LOCATIONS),
+        'file_bytes': os.path.getsize(source_path),
+        'phases': phases,
+    }
+
+
+def git_commit():
+    try:
+        return subprocess.run(['git', 'rev-parse', '--short', 'HEAD'], capture_output=True, text=True,
+                              cwd=os.path.dirname(os.path.abspath(__file__))).stdout.strip() or None
+    except OSError:
+        return None
+
+
+def print_result(result):
+    print(f"\n{result['size']}: {result['trades']} trades x {result['columns']} columns "
+          f"({result['file_bytes'] / 1024:.0f} KB)")
+    for phase, stats in result['phases'].items():
+        line = f"  {phase:<17} {stats['median_s'] * 1000:>10.2f} ms"
+        if 'per_op_us' in stats:
+            line += f"  ({stats['per_op_us']:.1f} us/op)"
+        if 'peak_bytes' in stats:
+            line += f"  peak {stats['peak_bytes'] / 1024 / 1024:.1f} MB"
+        print(line)
+
+
+def print_comparison(report, baseline_path):
+    """Show how median times changed against an earlier results file"""
+    with open(baseline_path, 'r', encoding='utf-8') as f:
+        baseline = json.load(f)
+    previous = {result['size']: result for result in baseline['results']}
+
+    print(f"\nCompared with {os.path.basename(baseline_path)} (commit {baseline.get('commit')}):")
+    for result in report['results']:
+        old = previous.get(result['size'])
+        if old is None or old['columns'] != result['columns']:
+            print(f"  {result['size']}: no matching baseline")
+            continue
+        for phase, stats in result['phases'].items():
+            old_stats = old['phases'].get(phase)
+            if not old_stats:
+                continue
+            ratio = stats['median_s'] / old_stats['median_s'] if old_stats['median_s'] else float('inf')
+            print(f"  {result['size']:<7} {phase:<17} {old_stats['median_s'] * 1000:>10.2f} ms -> "
+                  f"{stats['median_s'] * 1000:>10.2f} ms  x{ratio:.2f}")
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark the Excel updater on synthetic master sheets")
+    parser.add_argument('--sizes', nargs='+', choices=list(SIZES), default=DEFAULT_SIZES)
+    parser.add_argument('--repeats', type=int, default=3, help="Timed runs per size (median is reported)")
+    parser.add_argument('--lookups', type=int, default=1000, help="find_target_cell calls per run")
+    parser.add_argument('--records', type=int, default=50, help="Records written by the update phases")
+    parser.add_argument('--normalize-rounds', type=int, default=100,
+                        help="Passes of normalize_header over every header")
+    parser.add_argument('--seed', type=int, default=1)
+    parser.add_argument('--no-memory', dest='memory', action='store_false',
+                        help="Skip the tracemalloc pass that measures peak memory")
+    parser.add_argument('--cache-dir', default=os.path.join(tempfile.gettempdir(), 'excel_updater_bench'),
+                        help="Where generated workbooks are kept between runs")
+    parser.add_argument('--output-dir', default='benchmark_results')
+    parser.add_argument('--compare', help="Earlier results file to compare against")
+    args = parser.parse_args()
+
+    report = {
+        'created': datetime.now().isoformat(timespec='seconds'),
+        'commit': git_commit(),
+        'python': platform.python_version(),
+        'openpyxl': openpyxl.__version__,
+        'platform': platform.platform(),
+        'settings': {
+            'repeats': args.repeats,
+            'lookups': args.lookups,
+            'records': args.records,
+            'normalize_rounds': args.normalize_rounds,
+            'seed': args.seed,
+        },
+        'results': [],
+    }
+
+    with tempfile.TemporaryDirectory() as work_dir:
+        for size in args.sizes:
+            result = benchmark_size(size, args, work_dir)
+            report['results'].append(result)
+            print_result(result)
+
+    os.makedirs(args.output_dir, exist_ok=True)
+    output_path = os.path.join(args.output_dir, f"bench_{datetime.now().strftime('%Y%m%d_%H%M%S')}.json")
+    with open(output_path, 'w', encoding='utf-8') as f:
+        json.dump(report, f, indent=2)
+    print(f"\nResults written to {output_path}")
+
+    if args.compare:
+        print_comparison(report, args.compare)
+
+
+if __name__ == "__main__":
+    main()
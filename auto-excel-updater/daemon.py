@@ -0,0 +1,270 @@
+"""Headless ingestion daemon for the Auto Excel Updater.
+
+Takes Keyword:Value text or JSON records over a localhost HTTP API. Every
+record is checked against the sheet structure and appended to the
+workbook's update journal before the request is acknowledged, so an
+acknowledged record survives a crash. A flush thread applies everything
+journaled during each flush window to the workbook in one load/save.
+
+Endpoints:
+    POST /records      Keyword:Value blocks separated by blank lines
+                       (text/plain), or JSON: one object, a list of
+                       objects, or {"records": [...]}
+    GET  /records/<n>  whether journal entry n is queued, applied, or held
+                       (its cell couldn't be found; retried on later flushes)
+    GET  /status       pending entries, last applied entry, last flush
+    GET  /metrics      cumulative phase timings (p50/p95/max), cache hit rate
+    GET  /query        totals, e.g. /query?trade=SC-A&header=dispatched&by=location
+                       (also location=, and since= to sum journaled updates
+                       from an ISO date on)
+
+Usage:
+    python daemon.py Master.xlsx --port 8765 --flush-interval 5
+"""
+import argparse
+import json
+import signal
+import threading
+from datetime import datetime
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import parse_qs, urlsplit
+
+from main import ExcelUpdater
+from matching import load_aliases
+
+MAX_BODY_BYTES = 16 * 1024 * 1024
+
+
+class IngestionDaemon:
+    def __init__(self, file_path, flush_interval=5.0, create_backup=True, aliases=None):
+        self.file_path = file_path
+        self.flush_interval = flush_interval
+        self.create_backup = create_backup
+        self.updater = ExcelUpdater(log=self.log, aliases=aliases)
+        # ExcelUpdater and the journal are used from many request threads. A
+        # flush holds its own lock through the workbook load/save, so records
+        # keep being journaled meanwhile: the journal orders appends against
+        # the compaction's begin/commit markers itself.
+        self.lock = threading.Lock()
+        self.flush_lock = threading.Lock()
+        self.flush_requested = threading.Event()
+        self.stopping = threading.Event()
+        self.last_flush = None
+        with self.lock:
+            self.journal = self.updater.get_journal(file_path)
+
+    def log(self, message):
+        timestamp = datetime.now().strftime("%H:%M:%S")
+        print(f"[{timestamp}] {message}", flush=True)
+
+    def parse_body(self, body, content_type):
+        """Turn a request body into records shaped like parse_input's output"""
+        text = body.decode('utf-8')
+        if 'json' not in content_type and not text.lstrip().startswith(('{', '[')):
+            return self.updater.parse_batch_input(text)
+
+        payload = json.loads(text)
+        if isinstance(payload, dict):
+            payload = payload.get('records', [payload])
+        if not isinstance(payload, list) or not all(isinstance(item, dict) for item in payload):
+            raise ValueError("Expected a JSON object, a list of objects or {\"records\": [...]}")
+
+        records = []
+        for item in payload:
+            record = {}
+            for key, value in item.items():
+                # Accept "trade"/"location" in any case, like the text format's keywords
+                if key.lower() in ('trade', 'location'):
+                    key = key.capitalize()
+                record[key] = str(value)
+            records.append(record)
+        return records
+
+    def ingest(self, records):
+        """Journal records durably and return one result per record"""
+        with self.lock:
+            results = self.updater.submit_to_journal(
+                self.file_path, records, create_backup=self.create_backup, auto_compact=False
+            )
+            # Held entries wait for the workbook to be fixed, not for a flush
+            pending = self.journal.pending_count - len(self.journal.held)
+        if pending >= self.updater.JOURNAL_COMPACT_THRESHOLD:
+            self.flush_requested.set()
+        return [{
+            'index': result['index'],
+            'ok': result['ok'],
+            'seqs': result.get('seqs', []),
+            'errors': result['errors']
+        } for result in results]
+
+    def entry_state(self, seq):
+        with self.lock:
+            if seq < 1 or seq > self.journal.last_seq:
+                return None
+            applied_at = self.journal.applied_at(seq)
+            held = seq in self.journal.held
+        return {
+            'seq': seq,
+            'state': 'applied' if applied_at else 'held' if held else 'queued',
+            'applied_at': applied_at
+        }
+
+    def status(self):
+        with self.lock:
+            return {
+                'file': self.file_path,
+                'last_seq': self.journal.last_seq,
+                'applied_seq': self.journal.applied_seq,
+                'pending': self.journal.pending_count,
+                'last_flush': self.last_flush
+            }
+
+    def metrics(self):
+        with self.lock:
+            return self.updater.get_metrics(self.file_path).summary()
+
+    def query(self, params):
+        with self.lock:
+            return self.updater.query(self.file_path, params.get('by'), params.get('trade'),
+                                      params.get('header'), params.get('location'), params.get('since'))
+
+    def flush(self):
+        """Apply everything journaled so far in one workbook load/save"""
+        with self.flush_lock:
+            if not (self.journal.pending_count or self.journal.open_begin):
+                return 0
+            try:
+                applied = self.updater.compact_journal(self.file_path, self.create_backup)
+            except Exception as e:
+                self.log(f"Flush failed, will retry: {str(e)}")
+                return 0
+            self.last_flush = datetime.now().isoformat(timespec='seconds')
+            return applied
+
+    def flush_loop(self):
+        while not self.stopping.is_set():
+            self.flush_requested.wait(self.flush_interval)
+            self.flush_requested.clear()
+            self.flush()
+
+
+class IngestionHandler(BaseHTTPRequestHandler):
+    # Keep-alive connections let clients stream many small requests cheaply,
+    # as long as Nagle doesn't hold each reply back waiting for the client's ACK
+    protocol_version = 'HTTP/1.1'
+    disable_nagle_algorithm = True
+
+    def send_json(self, status, payload):
+        body = json.dumps(payload).encode('utf-8')
+        self.send_response(status)
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def do_POST(self):
+        ingestion = self.server.ingestion
+        if self.path.rstrip('/') != '/records':
+            self.send_json(404, {'error': 'Not found'})
+            return
+        length = int(self.headers.get('Content-Length', 0))
+        if length > MAX_BODY_BYTES:
+            self.send_json(413, {'error': 'Request body too large'})
+            return
+        body = self.rfile.read(length)
+        try:
+            records = ingestion.parse_body(body, self.headers.get('Content-Type', ''))
+        except ValueError as e:
+            self.send_json(400, {'error': str(e)})
+            return
+        if not records:
+            self.send_json(400, {'error': 'No records found'})
+            return
+
+        try:
+            results = ingestion.ingest(records)
+        except Exception as e:
+            self.send_json(500, {'error': str(e)})
+            return
+        self.send_json(200, {
+            'accepted': sum(1 for result in results if result['ok']),
+            'rejected': sum(1 for result in results if not result['ok']),
+            'results': results
+        })
+
+    def do_GET(self):
+        ingestion = self.server.ingestion
+        url = urlsplit(self.path)
+        path = url.path.rstrip('/')
+        if path == '/query':
+            params = {key: values[-1] for key, values in parse_qs(url.query).items()}
+            try:
+                rows = ingestion.query(params)
+            except ValueError as e:
+                self.send_json(400, {'error': str(e)})
+                return
+            self.send_json(200, {'rows': rows, 'total': sum(row['total'] for row in rows)})
+        elif path == '/status':
+            self.send_json(200, ingestion.status())
+        elif path == '/metrics':
+            self.send_json(200, ingestion.metrics())
+        elif path.startswith('/records/') and path[len('/records/'):].isdigit():
+            state = ingestion.entry_state(int(path[len('/records/'):]))
+            if state is None:
+                self.send_json(404, {'error': 'Unknown journal entry'})
+            else:
+                self.send_json(200, state)
+        else:
+            self.send_json(404, {'error': 'Not found'})
+
+    def log_message(self, format, *args):
+        # Request lines would drown out the update log
+        pass
+
+
+def stop_on_signal(signum, frame):
+    # Treat SIGTERM like Ctrl+C so the last window is still flushed
+    raise KeyboardInterrupt
+
+
+def serve(file_path, host='127.0.0.1', port=8765, flush_interval=5.0, create_backup=True, aliases=None):
+    ingestion = IngestionDaemon(file_path, flush_interval, create_backup, aliases)
+    server = ThreadingHTTPServer((host, port), IngestionHandler)
+    server.daemon_threads = True
+    server.ingestion = ingestion
+
+    flusher = threading.Thread(target=ingestion.flush_loop, daemon=True)
+    flusher.start()
+    signal.signal(signal.SIGTERM, stop_on_signal)
+    ingestion.log(f"Listening on http://{host}:{server.server_address[1]} for {file_path}")
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        server.server_close()
+        ingestion.stopping.set()
+        ingestion.flush_requested.set()
+        flusher.join()
+        # Apply whatever arrived in the last window before exiting
+        ingestion.flush()
+        ingestion.updater.save_metrics()
+        ingestion.log("Stopped")
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Headless ingestion daemon for the Auto Excel Updater")
+    parser.add_argument('file_path', help="Excel workbook to update")
+    parser.add_argument('--host', default='127.0.0.1', help="Address to listen on (default: localhost only)")
+    parser.add_argument('--port', type=int, default=8765)
+    parser.add_argument('--flush-interval', type=float, default=5.0,
+                        help="Seconds between applying journaled records to the workbook")
+    parser.add_argument('--no-backup', action='store_true', help="Don't back up the workbook before each flush")
+    parser.add_argument('--aliases', help="JSON file of trade, location and header aliases")
+    args = parser.parse_args()
+    aliases = load_aliases(args.aliases) if args.aliases else None
+    serve(args.file_path, args.host, args.port, args.flush_interval, not args.no_backup, aliases)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,329 @@
+"""Streaming bulk import of CSV, JSONL and xlsx files into a master workbook.
+
+Source rows are read one at a time (csv/json line by line, openpyxl in
+read-only mode) and mapped onto Trade, Location and data-type values. Values
+are summed per (trade, location, data type) while reading, so memory grows
+with the number of distinct target cells rather than with the file. The
+totals are then applied with a single update_excel_batch: one lock, one
+backup, one load and one save, and every cell resolved through the usual
+structure lookups.
+
+Two source layouts are understood:
+    wide  one row per trade/location, one column per data type
+          (Trade, Location, Dispatched, Inspection, ...)
+    long  one row per value, with data-type and value columns
+          (Trade, Location, Type, Value)
+
+Usage:
+    python importer.py Master.xlsx dispatches.csv
+    python importer.py Master.xlsx export.xlsx --sheet Data --map "Qty Sent=Dispatched Kits"
+    python importer.py Master.xlsx events.jsonl --type-column event --value-column qty
+"""
+import argparse
+import csv
+import json
+import os
+import re
+from collections import OrderedDict
+
+import openpyxl
+
+SOURCE_TYPES = ('.csv', '.jsonl', '.ndjson', '.xlsx', '.xlsm')
+PROGRESS_EVERY = 100000  # Rows between progress messages
+MAX_REPORTED_ERRORS = 20
+
+
+def iter_csv(path):
+    # utf-8-sig drops the byte order mark Excel puts on CSV exports
+    with open(path, 'r', newline='', encoding='utf-8-sig') as f:
+        yield from csv.DictReader(f)
+
+
+def iter_jsonl(path):
+    with open(path, 'r', encoding='utf-8') as f:
+        for line in f:
+            line = line.strip()
+            if not line:
+                continue
+            try:
+                item = json.loads(line)
+            except ValueError:
+                item = None
+            # Unreadable lines come through empty and are counted as skipped
+            yield item if isinstance(item, dict) else {}
+
+
+def iter_xlsx(path, sheet_name=None):
+    wb = openpyxl.load_workbook(path, read_only=True, data_only=True)
+    try:
+        sheet = wb[sheet_name] if sheet_name else wb.worksheets[0]
+        rows = sheet.iter_rows(values_only=True)
+        header = next(rows, None)
+        if header is None:
+            return
+        columns = ["" if name is None else str(name).strip() for name in header]
+        for row in rows:
+            yield dict(zip(columns, row))
+    finally:
+        wb.close()
+
+
+def read_source(path, sheet_name=None):
+    """Yield the rows of a source file as dicts keyed by column name"""
+    extension = os.path.splitext(path)[1].lower()
+    if extension == '.csv':
+        return iter_csv(path)
+    if extension in ('.jsonl', '.ndjson'):
+        return iter_jsonl(path)
+    if extension in ('.xlsx', '.xlsm'):
+        return iter_xlsx(path, sheet_name)
+    raise ValueError(f"Unsupported source type '{extension}', use one of: {', '.join(SOURCE_TYPES)}")
+
+
+class ColumnMapping:
+    """Which source columns hold the trade, the location and the values"""
+
+    def __init__(self, trade_column='Trade', location_column='Location', value_columns=None,
+                 type_column=None, value_column=None):
+        self.trade_column = trade_column
+        self.location_column = location_column
+        # Wide layout: source column -> data type; None takes every other column as is
+        self.value_columns = value_columns
+        # Long layout: the data type and the amount are in these two columns
+        self.type_column = type_column
+        self.value_column = value_column
+
+    @classmethod
+    def guess(cls, columns, **overrides):
+        """Pick columns by name: trade/location by keyword, long layout if type and value columns exist.
+
+        A keyword matches a column named exactly that, or else one holding
+        it as whole words ('Trade Name', 'qty_sent'), so 'loc' doesn't
+        pick 'Block' nor 'count' pick 'Account'.
+        """
+        def words(name):
+            return re.findall(r'[a-z0-9]+', name.lower())
+
+        def holds(column, keyword):
+            column_words, keyword_words = words(column), words(keyword)
+            return any(column_words[start:start + len(keyword_words)] == keyword_words
+                       for start in range(len(column_words) - len(keyword_words) + 1))
+
+        def find(*keywords):
+            for keyword in keywords:
+                for column in columns:
+                    if column and words(keyword) == words(column):
+                        return column
+            for keyword in keywords:
+                for column in columns:
+                    if column and holds(column, keyword):
+                        return column
+            return None
+
+        guessed = {
+            'trade_column': find('trade', 'trade name'),
+            'location_column': find('location', 'loc', 'site'),
+            'type_column': find('data type', 'type', 'key'),
+            'value_column': find('value', 'quantity', 'qty', 'amount', 'count'),
+        }
+        if not (guessed['type_column'] and guessed['value_column']):
+            guessed['type_column'] = guessed['value_column'] = None
+        guessed.update({key: value for key, value in overrides.items() if value is not None})
+        return cls(**guessed)
+
+    def describe(self):
+        if self.type_column:
+            layout = f"type '{self.type_column}', value '{self.value_column}'"
+        elif self.value_columns:
+            layout = ", ".join(f"{source}->{target}" for source, target in self.value_columns.items())
+        else:
+            layout = "every other column"
+        return f"trade '{self.trade_column}', location '{self.location_column}', {layout}"
+
+    def values(self, row):
+        """Yield (data type, raw value) pairs of one source row"""
+        if self.type_column:
+            yield row.get(self.type_column), row.get(self.value_column)
+        elif self.value_columns:
+            for source, target in self.value_columns.items():
+                yield target, row.get(source)
+        else:
+            for column, value in row.items():
+                if column not in (self.trade_column, self.location_column) and column:
+                    yield column, value
+
+
+def to_amount(value):
+    """Parse a source value; returns None for empty cells and raises ValueError for text"""
+    if value is None or isinstance(value, bool):
+        return None
+    if isinstance(value, (int, float)):
+        return value
+    text = str(value).strip().replace(',', '')
+    if not text:
+        return None
+    return float(text)
+
+
+class BulkImport:
+    """Sum source rows per (trade, location, data type)"""
+
+    def __init__(self, mapping, log=None):
+        self.mapping = mapping
+        self.log = log
+        self.totals = OrderedDict()
+        self.rows_read = 0
+        self.rows_skipped = 0
+        self.values_added = 0
+        self.bad_values = {}  # data type -> count of non-numeric values
+        self.errors = []
+
+    def note_error(self, message):
+        if len(self.errors) < MAX_REPORTED_ERRORS:
+            self.errors.append(message)
+
+    def add_rows(self, rows):
+        for row in rows:
+            self.rows_read += 1
+            if self.log is not None and self.rows_read % PROGRESS_EVERY == 0:
+                self.log(f"Import: read {self.rows_read} rows, {len(self.totals)} cells so far")
+
+            trade = row.get(self.mapping.trade_column)
+            location = row.get(self.mapping.location_column)
+            trade = "" if trade is None else str(trade).strip()
+            location = "" if location is None else str(location).strip()
+            if not trade or not location:
+                self.rows_skipped += 1
+                self.note_error(f"Row {self.rows_read}: missing trade or location")
+                continue
+
+            for data_type, raw in self.mapping.values(row):
+                if data_type is None or not str(data_type).strip():
+                    continue
+                data_type = str(data_type).strip()
+                try:
+                    amount = to_amount(raw)
+                except ValueError:
+                    self.bad_values[data_type] = self.bad_values.get(data_type, 0) + 1
+                    continue
+                if amount is None:
+                    continue
+                key = (trade, location, data_type)
+                self.totals[key] = self.totals.get(key, 0) + amount
+                self.values_added += 1
+
+    def records(self):
+        """Aggregated totals as update records, one per trade/location"""
+        grouped = OrderedDict()
+        for (trade, location, data_type), total in self.totals.items():
+            grouped.setdefault((trade, location), {})[data_type] = total
+        return [
+            dict({"Trade": trade, "Location": location},
+                 **{data_type: str(total) for data_type, total in values.items()})
+            for (trade, location), values in grouped.items()
+        ]
+
+    def summary(self):
+        text = (f"Read {self.rows_read} rows ({self.rows_skipped} skipped), "
+                f"{self.values_added} values summed into {len(self.totals)} cells")
+        if self.bad_values:
+            text += "; non-numeric values ignored: " + ", ".join(
+                f"{data_type} x{count}" for data_type, count in self.bad_values.items())
+        return text
+
+
+def aggregate_file(source_path, mapping=None, sheet_name=None, log=None):
+    """Stream source_path into a BulkImport, guessing columns from the first row without a mapping"""
+    rows = read_source(source_path, sheet_name)
+    first = next(rows, None)
+    if first is None:
+        raise ValueError(f"{os.path.basename(source_path)} has no rows")
+    if mapping is None:
+        mapping = ColumnMapping.guess(list(first.keys()))
+    if mapping.trade_column is None or mapping.location_column is None:
+        raise ValueError(f"Can't tell which columns hold the trade and location in {os.path.basename(source_path)}; "
+                         f"columns are: {', '.join(str(column) for column in first.keys())}")
+    if log is not None:
+        log(f"Importing {os.path.basename(source_path)}: {mapping.describe()}")
+
+    bulk = BulkImport(mapping, log)
+    bulk.add_rows([first])
+    bulk.add_rows(rows)
+    if log is not None:
+        log(f"Import: {bulk.summary()}")
+    return bulk
+
+
+def import_file(updater, workbook_path, source_path, mapping=None, sheet_name=None,
+                create_backup=True, abort_on_error=False):
+    """Stream source_path into workbook_path through updater (an ExcelUpdater).
+
+    Returns (bulk import, results, saved) where results/saved come from
+    update_excel_batch.
+    """
+    bulk = aggregate_file(source_path, mapping, sheet_name, updater.log_activity)
+    records = bulk.records()
+    if not records:
+        return bulk, [], False
+    results, saved = updater.update_excel_batch(workbook_path, records, create_backup, abort_on_error)
+    return bulk, results, saved
+
+
+def parse_map(items):
+    mapping = OrderedDict()
+    for item in items or []:
+        if '=' not in item:
+            raise argparse.ArgumentTypeError(f"--map expects SOURCE=DATATYPE, got '{item}'")
+        source, target = item.split('=', 1)
+        mapping[source.strip()] = target.strip()
+    return mapping or None
+
+
+def main():
+    from main import ExcelUpdater
+    from matching import load_aliases
+
+    parser = argparse.ArgumentParser(description="Bulk import CSV/JSONL/xlsx data into a master workbook")
+    parser.add_argument('workbook', help="Master workbook to update")
+    parser.add_argument('source', help="Source file (.csv, .jsonl, .xlsx)")
+    parser.add_argument('--sheet', help="Sheet to read from an xlsx source (default: first)")
+    parser.add_argument('--trade-column', help="Source column holding the trade")
+    parser.add_argument('--location-column', help="Source column holding the location")
+    parser.add_argument('--map', action='append', metavar='SOURCE=DATATYPE',
+                        help="Take a data type from a source column (repeatable); default: every other column")
+    parser.add_argument('--type-column', help="Long layout: column naming the data type")
+    parser.add_argument('--value-column', help="Long layout: column holding the amount")
+    parser.add_argument('--no-backup', action='store_true', help="Don't back up the workbook first")
+    parser.add_argument('--abort-on-error', action='store_true',
+                        help="Save nothing if any trade/location/data type can't be found")
+    parser.add_argument('--aliases', help="JSON file of trade, location and header aliases")
+    args = parser.parse_args()
+
+    updater = ExcelUpdater(log=print, aliases=load_aliases(args.aliases) if args.aliases else None)
+    overrides = {
+        'trade_column': args.trade_column,
+        'location_column': args.location_column,
+        'value_columns': parse_map(args.map),
+        'type_column': args.type_column,
+        'value_column': args.value_column,
+    }
+    first = next(read_source(args.source, args.sheet), {})
+    mapping = ColumnMapping.guess(list(first.keys()), **overrides)
+    if args.map and not args.type_column:
+        # Explicit wide columns win over a guessed long layout
+        mapping.type_column = mapping.value_column = None
+
+    bulk, results, saved = import_file(updater, args.workbook, args.source, mapping, args.sheet,
+                                       not args.no_backup, args.abort_on_error)
+    updater.save_metrics()
+    failed = [result for result in results if not result['ok']]
+    print(f"{'Saved' if saved else 'Nothing saved'}: {len(results) - len(failed)}/{len(results)} "
+          f"trade/location records applied")
+    for result in failed:
+        print(f"- {result['data'].get('Trade')}/{result['data'].get('Location')}: {'; '.join(result['errors'])}")
+    for error in bulk.errors:
+        print(f"- {error}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,289 @@
+"""Append-only journal of cell deltas for a master workbook.
+
+Each submitted value is written as one JSON line and fsynced, so recording
+an update is cheap and survives a crash. The app later compacts pending
+deltas into the workbook with a single load/save. Compaction is bracketed
+by "begin" and "commit" lines so an interrupted compaction can be detected
+and isn't applied twice: just before the new workbook replaces the old one,
+a "saving" line records the identity (mtime, size) the new file will have,
+and only a workbook with exactly that identity counts as saved after a crash.
+Deltas that can't be applied (their trade or column is gone) are listed as
+"held" in the commit and stay pending rather than being lost.
+
+Once the active file grows past ROTATE_BYTES, the lines of applied deltas
+are moved to an archive next to it (the "_applied" file) and the active
+file is rewritten starting with a "base" line carrying the counters. So
+appending and compacting cost what is pending, not the journal's whole
+life, while the archive keeps the full audit trail for queries and for
+replaying onto a backup.
+
+Several machines may share a journal next to a shared workbook. Callers
+hold the workbook lock while appending or compacting and call refresh()
+first, so counters pick up what other machines wrote. Within one process,
+appends and the compaction markers also take the journal's own lock, so
+records can be journaled while another thread saves the workbook.
+"""
+import json
+import os
+import threading
+from datetime import datetime
+
+
+def synchronized(method):
+    def locked_method(self, *args, **kwargs):
+        with self.lock:
+            return method(self, *args, **kwargs)
+    locked_method.__name__ = method.__name__
+    locked_method.__doc__ = method.__doc__
+    return locked_method
+
+
+class UpdateJournal:
+    ROTATE_BYTES = 1024 * 1024  # Active file size past which applied lines are archived
+    TAIL_BLOCK = 64 * 1024
+
+    def __init__(self, path):
+        self.path = path
+        self.archive_path = os.path.splitext(path)[0] + "_applied.jsonl"
+        self.last_seq = 0
+        self.applied_seq = 0
+        self.held = set()  # Seqs at or below applied_seq that failed to apply and are still pending
+        self.pending_count = 0
+        self.open_begin = None  # "begin" line of a compaction that never committed
+        self.commits = []  # (upto seq, timestamp, held seqs) of every compaction in the active file, oldest first
+        self.seen = None  # (size, mtime_ns) of the file when it was last read
+        self.lock = threading.RLock()
+        self._scan()
+
+    def _lines(self, path=None):
+        """Yield decoded journal lines, skipping any that can't be parsed"""
+        path = path or self.path
+        if not os.path.exists(path):
+            return
+        with open(path, 'r', encoding='utf-8') as f:
+            for line in f:
+                try:
+                    yield json.loads(line)
+                except ValueError:
+                    continue
+
+    def _history(self):
+        """Lines of the archive, then of the active file, without deltas repeated by an interrupted rotation"""
+        seen = set()
+        for path in (self.archive_path, self.path):
+            for entry in self._lines(path):
+                if entry['type'] == 'delta':
+                    if entry['seq'] in seen:
+                        continue
+                    seen.add(entry['seq'])
+                yield entry
+
+    def _stat(self):
+        try:
+            stat = os.stat(self.path)
+        except FileNotFoundError:
+            return None
+        return (stat.st_size, stat.st_mtime_ns)
+
+    def _scan(self):
+        """Rebuild sequence counters from the file"""
+        self.seen = self._stat()
+        for entry in self._lines():
+            if entry['type'] == 'delta':
+                self.last_seq = max(self.last_seq, entry['seq'])
+            elif entry['type'] == 'base':
+                self.last_seq = max(self.last_seq, entry['last_seq'])
+                self.applied_seq = max(self.applied_seq, entry['applied'])
+                self.held = set(entry.get('held', []))
+            elif entry['type'] == 'begin':
+                self.open_begin = entry
+            elif entry['type'] == 'saving':
+                if self.open_begin is not None:
+                    self.open_begin['saved_as'] = (entry['mtime_ns'], entry['size'])
+            elif entry['type'] == 'commit':
+                self.applied_seq = max(self.applied_seq, entry['upto'])
+                self.held = set(entry.get('held', []))
+                self.commits.append((entry['upto'], entry['ts'], self.held))
+                self.open_begin = None
+        self.pending_count = self._count_pending()
+
+    def _count_pending(self):
+        return sum(1 for entry in self.entries(self.applied_seq)) + len(self.held)
+
+    def _repair_tail(self):
+        """Cut off a partial last line left by a crash mid-append"""
+        if not os.path.exists(self.path):
+            return
+        with open(self.path, 'rb+') as f:
+            end = f.seek(0, os.SEEK_END)
+            if not end:
+                return
+            f.seek(-1, os.SEEK_END)
+            if f.read(1) == b'\n':
+                return
+            # Look back for the end of the last whole line
+            position = end
+            while position > 0:
+                start = max(position - self.TAIL_BLOCK, 0)
+                f.seek(start)
+                newline = f.read(position - start).rfind(b'\n')
+                if newline >= 0:
+                    f.truncate(start + newline + 1)
+                    return
+                position = start
+            f.truncate(0)
+
+    def _append(self, entries):
+        self._repair_tail()
+        with open(self.path, 'a', encoding='utf-8') as f:
+            for entry in entries:
+                f.write(json.dumps(entry) + '\n')
+            f.flush()
+            os.fsync(f.fileno())
+        self.seen = self._stat()
+
+    @synchronized
+    def refresh(self):
+        """Re-read counters if the file changed since we last read or wrote it"""
+        if self._stat() == self.seen:
+            return
+        self.last_seq = 0
+        self.applied_seq = 0
+        self.held = set()
+        self.open_begin = None
+        self.commits = []
+        self._scan()
+
+    @synchronized
+    def append(self, deltas):
+        """Durably record deltas (dicts with trade, location, data_type, delta).
+
+        Returns the sequence numbers assigned to them.
+        """
+        timestamp = datetime.now().isoformat(timespec='seconds')
+        entries = []
+        for delta in deltas:
+            self.last_seq += 1
+            entries.append(dict(delta, type='delta', seq=self.last_seq, ts=timestamp))
+        self._append(entries)
+        self.pending_count += len(entries)
+        return [entry['seq'] for entry in entries]
+
+    def entries(self, after_seq=0, upto_seq=None):
+        """Delta entries of the active file with after_seq < seq <= upto_seq, in journal order"""
+        for entry in self._lines():
+            if entry['type'] != 'delta' or entry['seq'] <= after_seq:
+                continue
+            if upto_seq is not None and entry['seq'] > upto_seq:
+                continue
+            yield entry
+
+    def history(self, after_seq=0, upto_seq=None):
+        """Like entries(), but including deltas already moved to the archive"""
+        for entry in self._history():
+            if entry['type'] != 'delta' or entry['seq'] <= after_seq:
+                continue
+            if upto_seq is not None and entry['seq'] > upto_seq:
+                continue
+            yield entry
+
+    @synchronized
+    def pending(self):
+        """Deltas not yet compacted into the workbook, held ones included"""
+        return [entry for entry in self.entries()
+                if entry['seq'] > self.applied_seq or entry['seq'] in self.held]
+
+    @synchronized
+    def begin(self, upto_seq, identity, backup_id=None):
+        """Mark the start of a compaction of deltas up to upto_seq.
+
+        identity is the workbook's (mtime_ns, size) before it is rewritten.
+        """
+        entry = {
+            'type': 'begin',
+            'from': self.applied_seq,
+            'upto': upto_seq,
+            'mtime_ns': identity[0],
+            'size': identity[1],
+            'backup': backup_id,
+            'held': sorted(self.held),
+            'ts': datetime.now().isoformat(timespec='seconds')
+        }
+        self._append([entry])
+        self.open_begin = entry
+
+    @synchronized
+    def saving(self, identity):
+        """Record the (mtime_ns, size) of the new workbook just before it replaces the old one"""
+        self._append([{'type': 'saving', 'mtime_ns': identity[0], 'size': identity[1]}])
+        if self.open_begin is not None:
+            self.open_begin['saved_as'] = tuple(identity)
+
+    @synchronized
+    def commit(self, upto_seq, held=()):
+        """Mark deltas up to upto_seq as applied to the workbook, except the held seqs"""
+        timestamp = datetime.now().isoformat(timespec='seconds')
+        entry = {'type': 'commit', 'upto': upto_seq, 'ts': timestamp}
+        if held:
+            entry['held'] = sorted(held)
+        self._append([entry])
+        self.applied_seq = max(self.applied_seq, upto_seq)
+        self.held = set(held)
+        self.commits.append((upto_seq, timestamp, self.held))
+        self.open_begin = None
+        if self.seen is not None and self.seen[0] > self.ROTATE_BYTES:
+            self.rotate()
+        self.pending_count = self._count_pending()
+
+    def rotate(self):
+        """Move applied deltas and settled markers to the archive, keeping what is pending"""
+        keep = []
+        archive = []
+        for line in self._lines():
+            if line['type'] == 'delta' and (line['seq'] > self.applied_seq or line['seq'] in self.held):
+                keep.append(line)
+            else:
+                archive.append(line)
+        # Archive first: a crash before the rewrite below only repeats lines, which reading skips
+        with open(self.archive_path, 'a', encoding='utf-8') as f:
+            for line in archive:
+                f.write(json.dumps(line) + '\n')
+            f.flush()
+            os.fsync(f.fileno())
+        base = {
+            'type': 'base',
+            'last_seq': self.last_seq,
+            'applied': self.applied_seq,
+            'held': sorted(self.held),
+            'ts': datetime.now().isoformat(timespec='seconds')
+        }
+        temp_path = self.path + '.tmp'
+        with open(temp_path, 'w', encoding='utf-8') as f:
+            for line in [base] + keep:
+                f.write(json.dumps(line) + '\n')
+            f.flush()
+            os.fsync(f.fileno())
+        os.replace(temp_path, self.path)
+        self.commits = []
+        self.seen = self._stat()
+
+    @synchronized
+    def applied_at(self, seq):
+        """Timestamp of the compaction that applied seq, or None while it is pending"""
+        if seq > self.applied_seq or seq in self.held:
+            return None
+        for upto_seq, timestamp, held in self.commits:
+            if seq <= upto_seq and seq not in held:
+                return timestamp
+        # Applied before the last rotation
+        for entry in self._lines(self.archive_path):
+            if entry['type'] == 'commit' and seq <= entry['upto'] and seq not in entry.get('held', ()):
+                return entry['ts']
+        return None
+
+    def backup_contents(self, backup_id):
+        """(last seq applied, seqs held back at that point) of a backup taken at compaction, or None"""
+        for entry in self._history():
+            if entry['type'] == 'begin' and entry.get('backup') == backup_id:
+                return entry['from'], set(entry.get('held', []))
+        return None
@@ -2,110 +2,161 @@ import tkinter as tk
 from tkinter import ttk, messagebox, filedialog, scrolledtext
 import openpyxl
 import os
+import json
+from collections import OrderedDict, deque
 from datetime import datetime
-import time
 import re
+import queue
+import threading
+import logging
+import logging.handlers
+import argparse
+import time
+import shutil
+import tempfile
+from contextlib import contextmanager
+import xlsx_patch
+from backup_store import BackupStore
+from journal import UpdateJournal
+from metrics import WorkbookMetrics
+from workbook_lock import LockLost, LockTimeout, WorkbookLock
+from query import SheetSnapshot
+from matching import Matcher, normalize_header, load_aliases
+import importer
 
-class ExcelUpdaterApp:
-    def __init__(self, root):
-        self.root = root
-        self.root.title("Auto Excel Updater V2.1")
-        self.root.geometry("800x700")
-        self.activity_log = []
-        
-        # Configure layout
-        main_frame = ttk.Frame(root, padding=15)
-        main_frame.pack(fill=tk.BOTH, expand=True)
-        
-        # Input section
-        input_frame = ttk.LabelFrame(main_frame, text="Input Data", padding=10)
-        input_frame.pack(fill=tk.X, pady=(0, 15))
-        
-        ttk.Label(input_frame, text="Input (Keyword:Value format):").grid(row=0, column=0, sticky="w")
-        self.input_text = tk.Text(input_frame, height=8, width=80)
-        self.input_text.grid(row=1, column=0, columnspan=2, pady=(0, 10), sticky="ew")
-        
-        # File path
-        ttk.Label(input_frame, text="Excel File Path:").grid(row=2, column=0, sticky="w")
-        self.file_path = ttk.Entry(input_frame, width=60)
-        self.file_path.grid(row=3, column=0, sticky="ew", pady=(0, 10))
-        
-        browse_btn = ttk.Button(input_frame, text="Browse", command=self.browse_file)
-        browse_btn.grid(row=3, column=1, padx=(10, 0))
-        
-        # Options
-        self.backup_var = tk.BooleanVar(value=True)
-        ttk.Checkbutton(input_frame, text="Create backup before updating", variable=self.backup_var
-                       ).grid(row=4, column=0, sticky="w", columnspan=2)
-        
-        # Process button
-        self.process_btn = ttk.Button(input_frame, text="Update Excel", command=self.process_input)
-        self.process_btn.grid(row=5, column=0, columnspan=2, pady=10)
+class ExcelUpdater:
+    """Workbook update logic shared by the GUI and the headless entry points"""
+    STRUCTURE_CACHE_SIZE = 8  # Workbooks whose structure is kept in memory
+    STRUCTURE_SIDECAR_VERSION = 2
+    FAST_PATCH_ENABLED = True  # Patch sheet XML directly when the structure is cached
+    JOURNAL_COMPACT_THRESHOLD = 200  # Pending journal entries that trigger an immediate apply
+    LOCK_TIMEOUT = 300  # Seconds to wait for another user's update to a shared workbook
+    METRICS_SAVE_SECONDS = 30  # Least time between writes of a workbook's metrics file
+    RELOAD_ATTEMPTS = 5  # Times to reload and re-apply when the file changes under an update
+    SHEET_NAME = "Master Sheet"
+    # The sheet has two Sculptor sets, so a bare "SC" would be ambiguous
+    TRADE_ABBREVIATIONS = {"SC-A": "Sculptor Set - A", "SC-B": "Sculptor Set - B"}
+    # Abbreviations that used to name one trade; entering one says what to use instead
+    AMBIGUOUS_ABBREVIATIONS = {"SC": ("SC-A", "SC-B")}
+
+    def __init__(self, log=None, sheet_name=None, trade_map=None, aliases=None):
+        self.log = log
         
-        # Activity Log
-        log_frame = ttk.LabelFrame(main_frame, text="Activity Log", padding=10)
-        log_frame.pack(fill=tk.BOTH, expand=True)
+        # Sheet updated in every workbook, and abbreviations accepted for trade names
+        self.sheet_name = sheet_name or self.SHEET_NAME
+        self.trade_map = dict(self.TRADE_ABBREVIATIONS if trade_map is None else trade_map)
         
-        self.log_text = scrolledtext.ScrolledText(
-            log_frame, height=15, state=tk.DISABLED, wrap=tk.WORD
-        )
-        self.log_text.pack(fill=tk.BOTH, expand=True)
+        # Trade, location and header matching, with optional aliases (see matching.load_aliases)
+        self.matcher = Matcher(aliases)
         
-        # Clear log button
-        clear_btn = ttk.Button(log_frame, text="Clear Log", command=self.clear_log)
-        clear_btn.pack(side=tk.RIGHT, pady=(10, 0))
+        # Initialize structure cache (LRU keyed on absolute path)
+        self.structure_cache = OrderedDict()
         
-        # Status bar
-        self.status_var = tk.StringVar(value="Ready")
-        status_bar = ttk.Label(main_frame, textvariable=self.status_var, relief=tk.SUNKEN, anchor=tk.W)
-        status_bar.pack(side=tk.BOTTOM, fill=tk.X)
+        # Update journals, one per workbook, opened on first use (or by open_journals)
+        self.journals = {}
+        # Workbook version held journal deltas last failed against, per workbook
+        self.held_identity = {}
         
-        # Set default file path
-        self.file_path.insert(0, "Master.xlsx")
+        # Phase timings of the update in progress (one per thread), and cumulative metrics per workbook
+        self.local = threading.local()
+        self.metrics = {}
         
-        # Sample input for testing
-        sample_input = """Trade: SC
-Location: Jaipur
-Dispatch: 5
-Inspection: 3"""
-        self.input_text.insert("1.0", sample_input)
+        # Workbook locks held by this updater, with how many users (nested or on other threads) hold each
+        self.held_locks = {}
+        self.held_locks_guard = threading.Lock()
         
-        # Initialize structure cache
-        self.structure_cache = {}
-        self.last_structure_load = 0
-        self.log_activity("Application started")
+        # Query snapshots per workbook, kept in step with our own writes
+        self.snapshots = {}
 
-    def browse_file(self):
-        filepath = filedialog.askopenfilename(
-            filetypes=[("Excel files", "*.xlsx"), ("All files", "*.*")]
-        )
-        if filepath:
-            self.file_path.delete(0, tk.END)
-            self.file_path.insert(0, filepath)
-            # Clear cache when file changes
-            self.structure_cache = {}
-            self.log_activity(f"Selected file: {os.path.basename(filepath)}")
+    @property
+    def timings(self):
+        return getattr(self.local, 'timings', None)
 
-    def clear_log(self):
-        self.log_text.config(state=tk.NORMAL)
-        self.log_text.delete(1.0, tk.END)
-        self.log_text.config(state=tk.DISABLED)
-        self.log_activity("Log cleared")
+    @timings.setter
+    def timings(self, value):
+        self.local.timings = value
 
     def log_activity(self, message):
-        """Add timestamped message to activity log"""
-        timestamp = datetime.now().strftime("%H:%M:%S")
-        log_entry = f"[{timestamp}] {message}"
-        self.activity_log.append(log_entry)
+        """Report progress; the GUI overrides this to write to its activity log"""
+        if self.log is not None:
+            self.log(message)
+
+    def record_phase(self, name, start):
+        """Add the time since start as one sample of a phase of the current update"""
+        if self.timings is not None:
+            self.timings.append((name, time.perf_counter() - start))
+
+    @contextmanager
+    def phase(self, name):
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.record_phase(name, start)
+
+    @contextmanager
+    def timed_submission(self, file_path):
+        """Time the phases of one update, then log a breakdown and export metrics.
         
-        # Update log display
-        self.log_text.config(state=tk.NORMAL)
-        self.log_text.insert(tk.END, log_entry + "\n")
-        self.log_text.see(tk.END)  # Scroll to bottom
-        self.log_text.config(state=tk.DISABLED)
+        A nested submission (a journal apply running a batch) is timed as
+        part of the outer one.
+        """
+        if self.timings is not None:
+            yield
+            return
+        
+        self.timings = []
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.record_phase('total', start)
+            timings, self.timings = self.timings, None
+            self.report_timings(file_path, timings)
+
+    def format_timings(self, timings):
+        """Compact per-phase breakdown, e.g. 'total 812 | load 301 | find_target_cell 0.12 x3'"""
+        totals = OrderedDict()
+        for name, seconds in timings:
+            total, count = totals.get(name, (0, 0))
+            totals[name] = (total + seconds, count + 1)
+        totals.move_to_end('total', last=False)
         
-        # Update status bar
-        self.status_var.set(message)
+        parts = []
+        for name, (total, count) in totals.items():
+            ms = total * 1000
+            text = f"{name} {ms:.0f}" if ms >= 100 else f"{name} {ms:.1f}" if ms >= 1 else f"{name} {ms:.2f}"
+            parts.append(text + (f" x{count}" if count > 1 else ""))
+        return " | ".join(parts)
+
+    def metrics_path(self, file_path):
+        return os.path.splitext(file_path)[0] + "_metrics.json"
+
+    def get_metrics(self, file_path):
+        """Cumulative timing metrics of a workbook, continued from its metrics file"""
+        key = os.path.abspath(file_path)
+        if key not in self.metrics:
+            self.metrics[key] = WorkbookMetrics(self.metrics_path(file_path))
+        return self.metrics[key]
+
+    def report_timings(self, file_path, timings):
+        self.log_activity(f"Timing (ms): {self.format_timings(timings)}")
+        try:
+            workbook_bytes = os.path.getsize(file_path)
+        except OSError:
+            workbook_bytes = None
+        metrics = self.get_metrics(file_path)
+        metrics.record_submission(timings, workbook_bytes)
+        if metrics.save_due(self.METRICS_SAVE_SECONDS):
+            self.save_metrics(metrics)
+
+    def save_metrics(self, metrics=None):
+        """Write one workbook's metrics file, or all of them (on exit)"""
+        for workbook_metrics in [metrics] if metrics else list(self.metrics.values()):
+            try:
+                workbook_metrics.save()
+            except (OSError, LockTimeout) as e:
+                self.log_activity(f"Could not write metrics file: {str(e)}")
 
     def parse_input(self, text):
         """Extract key-value pairs from input text with flexible parsing"""
@@ -118,16 +169,42 @@ Inspection: 3"""
                 data[key] = value
         return data
 
+    def parse_batch_input(self, text):
+        """Split input text into records separated by blank lines"""
+        records = []
+        block = []
+        for line in text.strip().split('\n'):
+            if line.strip():
+                block.append(line)
+            elif block:
+                records.append(self.parse_input('\n'.join(block)))
+                block = []
+        if block:
+            records.append(self.parse_input('\n'.join(block)))
+        # Drop blocks that contained no Keyword:Value lines
+        return [record for record in records if record]
+
+    def backup_store(self, file_path):
+        """Deduplicating backup store kept next to the workbook"""
+        return BackupStore(os.path.splitext(file_path)[0] + "_backups")
+
     def create_backup(self, file_path):
-        """Create timestamped backup of the Excel file"""
-        timestamp = datetime.now().strftime("%Y%m%d_%H%M%S")
-        backup_path = os.path.splitext(file_path)[0] + f"_backup_{timestamp}.xlsx"
+        """Snapshot the Excel file into its backup store, returning the backup id.
         
-        import shutil
-        shutil.copyfile(file_path, backup_path)
-        
-        self.log_activity(f"Created backup: {os.path.basename(backup_path)}")
-        return backup_path
+        Nothing is written when the file is unchanged since the last backup,
+        and old backups are thinned out by the store's retention policy.
+        """
+        with self.phase('backup'):
+            store = self.backup_store(file_path)
+            backup_id, created = store.backup(file_path)
+            if created:
+                self.log_activity(f"Created backup: {backup_id}")
+                removed = store.apply_retention()
+                if removed:
+                    self.log_activity(f"Removed {removed} old backups")
+            else:
+                self.log_activity(f"Backup skipped, unchanged since {backup_id}")
+        return backup_id
 
     def detect_excel_structure(self, sheet):
         """Automatically detect Excel structure including headers and merged cells"""
@@ -158,8 +235,11 @@ Inspection: 3"""
             if merged_range.min_row in [3, 4] and merged_range.min_row == merged_range.max_row:
                 main_header = sheet.cell(merged_range.min_row, merged_range.min_col).value
                 if main_header:
-                    # Normalize header name for matching
-                    normalized_header = self.normalize_header(main_header)
+                    # Keyed by its own name: bands that normalize alike (Dispatched Kits,
+                    # Pending Dispatches) must not overwrite each other
+                    header_key = str(main_header).strip()
+                    if header_key in structure['headers']:
+                        header_key = f"{header_key} ({merged_range.coord})"
                     
                     # Get sub-headers under the merged area
                     sub_headers = []
@@ -172,116 +252,246 @@ Inspection: 3"""
                             })
                     
                     # Store header structure
-                    structure['headers'][normalized_header] = {
+                    structure['headers'][header_key] = {
                         'original_name': main_header,
                         'start_col': merged_range.min_col,
                         'end_col': merged_range.max_col,
                         'sub_headers': sub_headers
                     }
-                    structure['merged_areas'][normalized_header] = merged_range
+                    structure['merged_areas'][header_key] = merged_range.coord
+        
+        # Build lookup indexes so per-key lookups don't rescan the sheet
+        self.build_lookup_index(sheet, structure)
         
         # Log detected headers for debugging
         detected_headers = [info['original_name'] for info in structure['headers'].values()]
         self.log_activity(f"Detected headers: {', '.join(detected_headers)}")
         return structure
 
-    def normalize_header(self, header):
-        """Normalize header names for flexible matching"""
-        header = str(header).lower().strip()
-        # Remove common prefixes/suffixes
-        header = re.sub(r'\b(kits?|quantity|total|count)\b', '', header)
-        # Remove special characters and extra spaces
-        header = re.sub(r'[^\w\s]', '', header)
-        header = re.sub(r'\s+', ' ', header).strip()
-        
-        # Apply special mappings
-        if 'inspect' in header:
-            return 'inspection'
-        if 'dispatch' in header:
-            return 'dispatch'
-        return header
-
-    def get_excel_structure(self, file_path):
-        """Get cached or fresh Excel structure"""
-        current_time = time.time()
-        if (file_path in self.structure_cache and 
-            current_time - self.last_structure_load < 300):  # 5 minute cache
-            return self.structure_cache[file_path]
+    def build_lookup_index(self, sheet, structure):
+        """Index trade rows and (header, location) columns for fast lookups.
         
-        try:
-            wb = openpyxl.load_workbook(file_path, data_only=True)
-            sheet = wb["Master Sheet"]
-            structure = self.detect_excel_structure(sheet)
-            wb.close()
-            
-            self.structure_cache[file_path] = structure
-            self.last_structure_load = current_time
-            return structure
-        except Exception as e:
-            self.log_activity(f"Structure detection error: {str(e)}")
-            raise
-
-    def find_target_cell(self, sheet, structure, trade, location, data_type):
-        """Find target cell using detected structure"""
-        # Find trade row
-        trade_row = None
+        Trade names are read from the sheet once; the matcher indexes them on
+        first use and lookups memoize their answer per query, so repeated
+        keys cost a single dict lookup.
+        """
+        trade_col = structure['trade_col']
+        trade_rows = []
         for row in range(structure['trade_start_row'], sheet.max_row + 1):
-            cell = sheet.cell(row, structure['trade_col'])
-            if cell.value and trade in str(cell.value):
-                trade_row = row
-                break
+            value = sheet.cell(row, trade_col).value
+            if value:
+                trade_rows.append((row, str(value)))
         
-        if not trade_row:
-            raise ValueError(f"Trade '{trade}' not found in column {structure['trade_col']}")
+        structure['trade_rows'] = trade_rows
+        structure['indexed_max_row'] = sheet.max_row
+        structure['trade_index'] = {}
+        structure['column_index'] = {}
+        structure['match_index'] = {}
+
+    def invalidate_lookup_index(self, structure):
+        """Drop the trade index so it is rebuilt on the next lookup"""
+        structure['indexed_max_row'] = None
+        structure['trade_index'] = {}
+        structure['match_index'] = {}
+
+    def lookup_trade_row(self, sheet, structure, trade):
+        """Return the row of the trade matching `trade`, or None.
+        
+        Raises matching.AmbiguousMatch when several trades match equally
+        well. Without a sheet the index is trusted as-is; the structure cache
+        is keyed on file identity so it can't be older than the file.
+        """
+        trade_index = structure['trade_index']
+        if trade in trade_index:
+            return trade_index[trade]
+        
+        row = self.matcher.trade_index(structure).find(trade)
+        if row is not None:
+            trade_index[trade] = row
+            return row
+        
+        # Only a miss checks for rows added since indexing: openpyxl computes
+        # max_row by scanning every cell, far too slow to do per lookup
+        if sheet is not None and structure.get('indexed_max_row') != sheet.max_row:
+            self.build_lookup_index(sheet, structure)
+            return self.lookup_trade_row(None, structure, trade)
+        return None
+
+    def lookup_location_col(self, structure, data_type, location):
+        """Return (header name, column) for a data type and location.
         
-        # Normalize data type for matching
-        normalized_type = self.normalize_header(data_type)
+        Raises ValueError listing the available choices when nothing matches,
+        and matching.AmbiguousMatch when several do.
+        """
+        key = (data_type, location.lower())
+        column_index = structure['column_index']
+        if key in column_index:
+            return column_index[key]
         
         # Find matching header for data type
-        matching_header = None
-        for header_name in structure['headers']:
-            if normalized_type in header_name:
-                matching_header = header_name
-                break
+        matching_header = self.matcher.header_index(structure).find(data_type)
         
         if not matching_header:
             available_headers = [k for k in structure['headers'].keys()]
             raise ValueError(f"No header found matching '{data_type}'. Available: {', '.join(available_headers)}")
         
         # Find location within header's sub-headers
-        location_col = None
-        for sub_header in structure['headers'][matching_header]['sub_headers']:
-            if location.lower() in sub_header['name'].lower():
-                location_col = sub_header['col']
-                break
+        location_col = self.matcher.location_index(structure, matching_header).find(location)
         
         if not location_col:
-            sub_header_names = [sh['name'] for sh in structure['headers'][matching_header]['sub_headers']]
+            sub_header_names = [str(sh['name']) for sh in structure['headers'][matching_header]['sub_headers']]
             raise ValueError(f"Location '{location}' not found under '{matching_header}'. Available: {', '.join(sub_header_names)}")
         
-        return trade_row, location_col
+        column_index[key] = (matching_header, location_col)
+        return matching_header, location_col
 
-    def update_excel(self, file_path, data, create_backup=True):
-        """Update Excel file with parsed data"""
-        # Create backup if requested
-        if create_backup:
-            self.create_backup(file_path)
+    def normalize_header(self, header):
+        """Normalize header names for flexible matching (memoized, see matching.normalize_header)"""
+        return normalize_header(header)
+
+    def file_identity(self, file_path):
+        """Identify a file version by absolute path, modification time and size"""
+        stat = os.stat(file_path)
+        return (os.path.abspath(file_path), stat.st_mtime_ns, stat.st_size)
+
+    def structure_sidecar_path(self, file_path):
+        base = os.path.splitext(file_path)[0]
+        if self.sheet_name != self.SHEET_NAME:
+            # Other sheets of the same workbook have their own layout
+            base += "_" + re.sub(r'\W+', '_', self.sheet_name)
+        return base + "_structure.json"
+
+    def load_structure_sidecar(self, file_path, identity):
+        """Return the persisted structure if it matches the file's identity"""
+        sidecar_path = self.structure_sidecar_path(file_path)
+        try:
+            with open(sidecar_path, 'r', encoding='utf-8') as f:
+                saved = json.load(f)
+        except (OSError, ValueError):
+            return None
         
-        # Load Excel structure
-        structure = self.get_excel_structure(file_path)
+        if (saved.get('version') != self.STRUCTURE_SIDECAR_VERSION or
+                saved.get('mtime_ns') != identity[1] or saved.get('size') != identity[2]):
+            return None
         
-        # Open workbook for updating
-        wb = openpyxl.load_workbook(file_path)
-        sheet = wb["Master Sheet"]
+        structure = saved['structure']
+        structure['trade_rows'] = [tuple(entry) for entry in structure['trade_rows']]
+        structure['trade_index'] = {}
+        structure['column_index'] = {}
+        structure['match_index'] = {}
+        return structure
+
+    def save_structure_sidecar(self, file_path, identity, structure):
+        """Persist structure and trade index so a cold start can skip detection"""
+        # Memoized lookups are cheap to rebuild and use tuple keys, so skip them
+        persisted = {k: v for k, v in structure.items() if k not in ('trade_index', 'column_index', 'match_index')}
+        saved = {
+            'version': self.STRUCTURE_SIDECAR_VERSION,
+            'mtime_ns': identity[1],
+            'size': identity[2],
+            'structure': persisted
+        }
+        sidecar_path = self.structure_sidecar_path(file_path)
+        try:
+            with open(sidecar_path, 'w', encoding='utf-8') as f:
+                json.dump(saved, f, default=str)
+        except OSError as e:
+            self.log_activity(f"Could not write structure cache file: {str(e)}")
+
+    def cache_structure(self, identity, structure):
+        """Put structure in the LRU cache, evicting the least recently used workbook"""
+        self.structure_cache[identity[0]] = (identity, structure)
+        self.structure_cache.move_to_end(identity[0])
+        while len(self.structure_cache) > self.STRUCTURE_CACHE_SIZE:
+            self.structure_cache.popitem(last=False)
+
+    def remember_structure(self, file_path, structure):
+        """Store structure for the file's current version in the cache and sidecar"""
+        identity = self.file_identity(file_path)
+        self.cache_structure(identity, structure)
+        self.save_structure_sidecar(file_path, identity, structure)
+
+    def cached_structure(self, file_path):
+        """Return structure for the file's current version from memory or sidecar, or None"""
+        identity = self.file_identity(file_path)
+        cached = self.structure_cache.get(identity[0])
+        if cached and cached[0] == identity:
+            self.structure_cache.move_to_end(identity[0])
+            return cached[1]
+        
+        structure = self.load_structure_sidecar(file_path, identity)
+        if structure is not None:
+            self.log_activity(f"Loaded cached structure for {os.path.basename(file_path)}")
+            self.cache_structure(identity, structure)
+        return structure
+
+    def get_excel_structure(self, file_path, sheet=None):
+        """Get cached or fresh Excel structure.
+        
+        The cache is keyed on path, modification time and size, so it stays
+        valid until the file changes and a sidecar file lets a cold start
+        skip structure detection. When the caller already has the sheet
+        loaded, a cache miss detects on it instead of parsing the file again.
+        """
+        start = time.perf_counter()
+        structure = self.cached_structure(file_path)
+        if structure is not None:
+            self.record_phase('structure_hit', start)
+            return structure
         
-        # Get required parameters from input
-        trade_map = {"SC": "Sculptor"}  # Trade abbreviation mapping
-        trade_abbr = data.get("Trade", "")
-        trade = trade_map.get(trade_abbr, trade_abbr)
+        try:
+            if sheet is not None:
+                structure = self.detect_excel_structure(sheet)
+            else:
+                with self.phase('load'):
+                    wb = openpyxl.load_workbook(file_path, data_only=True)
+                structure = self.detect_excel_structure(wb[self.sheet_name])
+                wb.close()
+        except Exception as e:
+            self.log_activity(f"Structure detection error: {str(e)}")
+            raise
+        
+        self.remember_structure(file_path, structure)
+        self.record_phase('structure_miss', start)
+        return structure
+
+    def find_target_cell(self, sheet, structure, trade, location, data_type):
+        """Find target cell using detected structure"""
+        with self.phase('find_target_cell'):
+            # Find trade row
+            trade_row = self.lookup_trade_row(sheet, structure, trade)
+            
+            if not trade_row:
+                raise ValueError(f"Trade '{trade}' not found in column {structure['trade_col']}")
+            
+            # Find location within the matching header's sub-headers
+            _, location_col = self.lookup_location_col(structure, data_type, location)
+        
+        return trade_row, location_col
+
+    def open_for_update(self, file_path):
+        """Load the workbook once for editing and get its structure from the same load"""
+        with self.phase('load'):
+            wb = openpyxl.load_workbook(file_path)
+        sheet = wb[self.sheet_name]
+        structure = self.get_excel_structure(file_path, sheet)
+        return wb, sheet, structure
+
+    def resolve_record(self, sheet, structure, data):
+        """Map each data type in a record to its target cell.
+        
+        Returns (trade, location, targets, errors) where targets holds
+        (data_type, row, col, value) tuples.
+        """
         location = data.get("Location", "")
+        try:
+            trade = self.expand_trade(data.get("Trade", ""))
+        except ValueError as e:
+            return data.get("Trade", ""), location, [], [str(e)]
         
         # Process all data types except Trade and Location
-        updated_cells = []
+        targets = []
+        errors = []
         for key, value in data.items():
             if key not in ["Trade", "Location"]:
                 data_type = key
@@ -291,42 +501,937 @@ Inspection: 3"""
                     
                     # Find target cell
                     row_idx, col_idx = self.find_target_cell(sheet, structure, trade, location, data_type)
-                    
-                    # Get current cell value
-                    cell = sheet.cell(row=row_idx, column=col_idx)
-                    current_value = cell.value
-                    
-                    # Handle value appending (FIXED: Now appends instead of overwriting)
-                    if current_value is None:
-                        new_value = value_num
-                    else:
-                        try:
-                            # Try to convert existing value to number
-                            current_num = float(current_value)
-                            new_value = current_num + value_num
-                        except (TypeError, ValueError):
-                            # If conversion fails, treat as 0 and add new value
-                            new_value = value_num
-                            self.log_activity(f"Warning: Existing value '{current_value}' was not numeric. Reset to {new_value}")
-                    
-                    # Update cell
-                    cell.value = new_value
-                    
-                    # Log and record update
-                    col_letter = openpyxl.utils.get_column_letter(col_idx)
-                    cell_ref = f"{col_letter}{row_idx}"
-                    updated_cells.append(f"{data_type} at {cell_ref} (New value: {new_value})")
-                    self.log_activity(f"Updated {data_type} for {trade}/{location}: {current_value} → {new_value}")
-                    
+                    targets.append((data_type, row_idx, col_idx, value_num))
                 except Exception as e:
-                    self.log_activity(f"Error updating {data_type}: {str(e)}")
+                    errors.append(f"{data_type}: {str(e)}")
+        
+        return trade, location, targets, errors
+
+    def expand_trade(self, trade):
+        """Trade name for an abbreviation; raises ValueError for one that no longer names a single trade"""
+        if trade in self.trade_map:
+            return self.trade_map[trade]
+        if trade in self.AMBIGUOUS_ABBREVIATIONS:
+            choices = self.AMBIGUOUS_ABBREVIATIONS[trade]
+            raise ValueError(f"Trade '{trade}' is ambiguous, use {' or '.join(choices)}")
+        return trade
+
+    def apply_record(self, sheet, structure, data, written=None):
+        """Add one record's values into the loaded sheet, returning updated cells and errors.
+        
+        (row, col, new value) of every cell written is appended to written if given.
+        """
+        trade, location, targets, errors = self.resolve_record(sheet, structure, data)
+        for error in errors:
+            self.log_activity(f"Error updating {error}")
+        
+        updated_cells = []
+        for data_type, row_idx, col_idx, value_num in targets:
+            with self.phase('write'):
+                # Get current cell value
+                cell = sheet.cell(row=row_idx, column=col_idx)
+                current_value = cell.value
+                
+                # Handle value appending (FIXED: Now appends instead of overwriting)
+                if current_value is None:
+                    new_value = value_num
+                else:
+                    try:
+                        # Try to convert existing value to number
+                        current_num = float(current_value)
+                        new_value = current_num + value_num
+                    except (TypeError, ValueError):
+                        # If conversion fails, treat as 0 and add new value
+                        new_value = value_num
+                        self.log_activity(f"Warning: Existing value '{current_value}' was not numeric. Reset to {new_value}")
+                
+                # Update cell
+                cell.value = new_value
+                if written is not None:
+                    written.append((row_idx, col_idx, new_value))
+            
+            # Log and record update
+            col_letter = openpyxl.utils.get_column_letter(col_idx)
+            cell_ref = f"{col_letter}{row_idx}"
+            updated_cells.append(f"{data_type} at {cell_ref} (New value: {new_value})")
+            self.log_activity(f"Updated {data_type} for {trade}/{location}: {current_value} → {new_value}")
+        
+        return updated_cells, errors
+
+    def record_result(self, index, data, updated_cells, errors):
+        """Build the per-record entry of a batch report"""
+        # A record with nothing written counts as failed too
+        if not updated_cells and not errors:
+            errors.append("No cells updated")
+        return {
+            'index': index,
+            'data': data,
+            'ok': not errors,
+            'updated_cells': updated_cells,
+            'errors': errors
+        }
+
+    def patch_excel(self, file_path, structure, records, abort_on_error=False, before_replace=None):
+        """Fast path: add records straight into the sheet XML without openpyxl.
+        
+        Returns (results, saved) like update_excel_batch. Raises
+        xlsx_patch.PatchNotSupported before anything is written when the
+        workbook needs the full openpyxl round-trip.
+        """
+        resolved = [self.resolve_record(None, structure, data) for data in records]
+        
+        if abort_on_error:
+            results = []
+            for index, (data, (_, _, targets, errors)) in enumerate(zip(records, resolved), start=1):
+                planned = [f"{data_type} at {xlsx_patch.column_letter(col_idx)}{row_idx}"
+                           for data_type, row_idx, col_idx, _ in targets]
+                result = self.record_result(index, data, planned, list(errors))
+                results.append(result)
+                if not result['ok']:
+                    for error in errors:
+                        self.log_activity(f"Error updating {error}")
+                    self.log_activity(f"Record {index} failed, aborting batch without saving")
+                    return results, False
+        
+        # Several keys may land on the same cell, so add their deltas up
+        deltas = {}
+        for _, _, targets, _ in resolved:
+            for _, row_idx, col_idx, value_num in targets:
+                deltas[(row_idx, col_idx)] = deltas.get((row_idx, col_idx), 0) + value_num
+        if not deltas:
+            results = []
+            for index, (data, (_, _, _, errors)) in enumerate(zip(records, resolved), start=1):
+                for error in errors:
+                    self.log_activity(f"Error updating {error}")
+                results.append(self.record_result(index, data, [], list(errors)))
+            self.log_activity("No record could be applied, nothing saved")
+            return results, False
+        before = self.file_identity(file_path)
+        with self.phase('patch'):
+            changes = xlsx_patch.patch_cells(file_path, self.sheet_name, deltas, before_replace)
+        
+        results = []
+        for index, (data, (trade, location, targets, errors)) in enumerate(zip(records, resolved), start=1):
+            for error in errors:
+                self.log_activity(f"Error updating {error}")
+            updated_cells = []
+            for data_type, row_idx, col_idx, _ in targets:
+                current_value, new_value = changes[(row_idx, col_idx)]
+                cell_ref = f"{xlsx_patch.column_letter(col_idx)}{row_idx}"
+                updated_cells.append(f"{data_type} at {cell_ref} (New value: {new_value})")
+                self.log_activity(f"Updated {data_type} for {trade}/{location}: {current_value} → {new_value}")
+            results.append(self.record_result(index, data, updated_cells, list(errors)))
+        
+        # Only cell values changed, so the structure is still valid for the new file
+        self.remember_structure(file_path, structure)
+        self.update_snapshot(file_path, before, [(row, col, new) for (row, col), (_, new) in changes.items()])
+        return results, True
+
+    def try_patch_excel(self, file_path, records, abort_on_error=False, before_replace=None):
+        """Run the fast path if possible, returning None when openpyxl must be used"""
+        if not self.FAST_PATCH_ENABLED:
+            return None
+        start = time.perf_counter()
+        structure = self.cached_structure(file_path)
+        if structure is None:
+            # The full save path looks the structure up again and counts the miss
+            return None
+        self.record_phase('structure_hit', start)
+        try:
+            return self.patch_excel(file_path, structure, records, abort_on_error, before_replace)
+        except xlsx_patch.PatchNotSupported as e:
+            self.log_activity(f"Fast save not possible ({str(e)}), using full save")
+            return None
+
+    def lock_path(self, file_path):
+        return file_path + ".lock"
+
+    @contextmanager
+    def locked(self, file_path):
+        """Hold the workbook's advisory lock, waiting while another user updates it.
+        
+        Re-entrant, so a journal apply can run a batch under the same lock,
+        and shared by this updater's threads: the lock keeps other machines
+        out, while the journal keeps this process's own threads in order.
+        """
+        key = os.path.abspath(file_path)
+        with self.held_locks_guard:
+            if key in self.held_locks:
+                lock, users = self.held_locks[key]
+                self.held_locks[key] = (lock, users + 1)
+            else:
+                lock = WorkbookLock(self.lock_path(file_path))
+                with self.phase('lock_wait'):
+                    lock.acquire(self.LOCK_TIMEOUT, on_wait=lambda holder: self.log_activity(
+                        f"Waiting for {os.path.basename(file_path)}: being updated by {holder}"))
+                self.held_locks[key] = (lock, 1)
+        try:
+            yield
+        finally:
+            with self.held_locks_guard:
+                lock, users = self.held_locks[key]
+                if users > 1:
+                    self.held_locks[key] = (lock, users - 1)
+                else:
+                    del self.held_locks[key]
+                    lock.release()
+
+    def confirm_lock(self, file_path):
+        """Raise LockLost unless the workbook lock this updater holds on file_path is still ours"""
+        with self.held_locks_guard:
+            held = self.held_locks.get(os.path.abspath(file_path))
+        if held is not None and not held[0].still_held():
+            raise LockLost(f"Lost the lock on {os.path.basename(file_path)} (broken as stale), "
+                           f"nothing was saved")
+
+    def save_workbook(self, wb, file_path, before_replace=None):
+        """Save through a temp file so other users never open a half-written workbook.
+        
+        before_replace(stat) gets the new file's os.stat just before it takes
+        the workbook's place; the rename keeps its mtime and size.
+        """
+        directory = os.path.dirname(os.path.abspath(file_path))
+        fd, temp_path = tempfile.mkstemp(suffix='.xlsx', dir=directory)
+        os.close(fd)
+        try:
+            wb.save(temp_path)
+            shutil.copymode(file_path, temp_path)
+            if before_replace is not None:
+                before_replace(os.stat(temp_path))
+            os.replace(temp_path, file_path)
+        except BaseException:
+            if os.path.exists(temp_path):
+                os.remove(temp_path)
+            raise
+
+    def update_excel(self, file_path, data, create_backup=True):
+        """Update Excel file with parsed data"""
+        results, _ = self.update_excel_batch(file_path, [data], create_backup)
+        return results[0]['updated_cells']
+
+    def update_excel_batch(self, file_path, records, create_backup=True, abort_on_error=False,
+                           before_replace=None):
+        """Apply many records with a single workbook load and a single save.
+        
+        Returns (results, saved) where results holds one dict per record with
+        its updated cells and errors. With abort_on_error, nothing is saved if
+        any record fails, and nothing is saved when every record fails. The
+        backup is only taken when something is saved. The workbook lock is
+        held throughout, and if the file still changes between load and save
+        (someone saving from Excel), it is reloaded and the records, being
+        additive, are applied again. before_replace is passed on to
+        save_workbook.
+        """
+        with self.locked(file_path), self.timed_submission(file_path):
+            def replacing(stat):
+                # A stall past the stale timeout may have handed the workbook to someone else
+                self.confirm_lock(file_path)
+                # Backed up only once something is about to be saved over it
+                if create_backup:
+                    self.create_backup(file_path)
+                if before_replace is not None:
+                    before_replace(stat)
+            
+            patched = self.try_patch_excel(file_path, records, abort_on_error, replacing)
+            if patched is not None:
+                return patched
+            
+            for attempt in range(1, self.RELOAD_ATTEMPTS + 1):
+                loaded_identity = self.file_identity(file_path)
+                wb, sheet, structure = self.open_for_update(file_path)
+                
+                results = []
+                written = []
+                failed = False
+                for index, data in enumerate(records, start=1):
+                    if len(records) > 1:
+                        self.log_activity(f"Record {index}/{len(records)}: {', '.join(f'{k}={v}' for k, v in data.items())}")
+                    updated_cells, errors = self.apply_record(sheet, structure, data, written)
+                    result = self.record_result(index, data, updated_cells, errors)
+                    results.append(result)
+                    if not result['ok']:
+                        failed = True
+                        if abort_on_error:
+                            self.log_activity(f"Record {index} failed, aborting batch without saving")
+                            break
+                
+                if failed and abort_on_error:
+                    wb.close()
+                    return results, False
+                
+                if not written:
+                    wb.close()
+                    self.log_activity("No record could be applied, nothing saved")
+                    return results, False
+                
+                if self.file_identity(file_path) != loaded_identity:
+                    wb.close()
+                    self.log_activity(f"{os.path.basename(file_path)} was changed by someone else while updating, "
+                                      f"reloading and re-applying (attempt {attempt}/{self.RELOAD_ATTEMPTS})")
                     continue
+                
+                with self.phase('save'):
+                    self.save_workbook(wb, file_path, replacing)
+                wb.close()
+                # Only cell values changed, so the structure is still valid for the new file
+                self.remember_structure(file_path, structure)
+                self.update_snapshot(file_path, loaded_identity, written)
+                return results, True
+            
+            raise RuntimeError(f"{os.path.basename(file_path)} kept changing during the update, nothing was saved")
+
+    def get_snapshot(self, file_path):
+        """Query snapshot of the workbook's current version, streamed in on first use"""
+        key = os.path.abspath(file_path)
+        identity = self.file_identity(file_path)
+        snapshot = self.snapshots.get(key)
+        if snapshot is not None and snapshot.identity == identity and not snapshot.stale:
+            return snapshot
         
-        # Save changes
-        wb.save(file_path)
-        wb.close()
+        start = time.perf_counter()
+        structure = self.get_excel_structure(file_path)
+        snapshot = SheetSnapshot(structure, self.matcher)
+        snapshot.load(file_path, self.sheet_name, structure['trade_start_row'])
+        snapshot.identity = identity
+        self.snapshots[key] = snapshot
+        self.log_activity(f"Loaded query snapshot of {os.path.basename(file_path)}: {len(snapshot.trades)} trades x "
+                          f"{len(snapshot.columns)} columns in {(time.perf_counter() - start) * 1000:.0f} ms")
+        return snapshot
+
+    def update_snapshot(self, file_path, previous_identity, written):
+        """Apply cells we just saved to a warm snapshot of the version they were written over"""
+        key = os.path.abspath(file_path)
+        snapshot = self.snapshots.get(key)
+        if snapshot is None:
+            return
+        if snapshot.identity != previous_identity:
+            # The snapshot was already out of date; rebuild it on the next query
+            del self.snapshots[key]
+            return
+        for row, col, value in written:
+            snapshot.set_cell(row, col, value)
+        snapshot.identity = self.file_identity(file_path)
+
+    def query(self, file_path, by=None, trade=None, header=None, location=None, since=None):
+        """Totals over the workbook, see SheetSnapshot.query.
         
-        return updated_cells
+        With since (an ISO date or timestamp), sums the journaled updates made
+        from then on instead of the cell values. Trade abbreviations are
+        expanded as in updates.
+        """
+        if trade:
+            trade = self.expand_trade(trade)
+        snapshot = self.get_snapshot(file_path)
+        if since is None:
+            return snapshot.query(by, trade, header, location)
+        journal = self.get_journal(file_path)
+        journal.refresh()
+        entries = [entry for entry in journal.history() if entry['ts'] >= since]
+        return snapshot.query_deltas(entries, by, trade, header, location)
+
+    def journal_path(self, file_path):
+        return os.path.splitext(file_path)[0] + "_journal.jsonl"
+
+    def get_journal(self, file_path):
+        """Open (once) the update journal belonging to a workbook"""
+        key = os.path.abspath(file_path)
+        if key not in self.journals:
+            journal = UpdateJournal(self.journal_path(file_path))
+            self.journals[key] = (file_path, journal)
+        return self.journals[key][1]
+
+    def open_journals(self, file_path):
+        """Open the journal of file_path and of every other workbook next to it that has one.
+        
+        Journals are otherwise opened on first use, so deltas left pending by
+        an earlier session would never be applied.
+        """
+        directory = os.path.dirname(os.path.abspath(file_path))
+        suffix = "_journal.jsonl"
+        try:
+            names = os.listdir(directory)
+        except OSError:
+            return
+        for name in names:
+            if not name.endswith(suffix):
+                continue
+            base = os.path.join(directory, name[:-len(suffix)])
+            for extension in ('.xlsx', '.xlsm'):
+                if os.path.exists(base + extension):
+                    self.get_journal(base + extension)
+                    break
+
+    def recover_journal(self, file_path, journal):
+        """Settle a compaction that was interrupted between its begin and commit"""
+        begin = journal.open_begin
+        if begin is None:
+            return
+        identity = tuple(self.file_identity(file_path)[1:])
+        saved_as = begin.get('saved_as')
+        # Only the very file the compaction saved shows its deltas went in
+        if saved_as is not None and identity == tuple(saved_as):
+            entries = [entry for entry in journal.pending() if entry['seq'] <= begin['upto']]
+            held = self.unapplied_seqs(file_path, self.journal_groups(entries))
+            journal.commit(begin['upto'], held)
+            self.log_activity(f"Journal: interrupted apply up to #{begin['upto']} was saved, marked as applied")
+        elif identity == (begin['mtime_ns'], begin['size']):
+            self.log_activity(f"Journal: interrupted apply up to #{begin['upto']} was not saved, will retry")
+        else:
+            self.log_activity(f"Journal: {os.path.basename(file_path)} was changed by someone else after an "
+                              f"interrupted apply up to #{begin['upto']}; applying those updates again. Check the "
+                              f"totals against backup {begin.get('backup')} if that apply had already saved")
+
+    def journal_groups(self, entries):
+        """Group journal deltas back into records, summing repeats of the same cell.
+        
+        Returns (record, entries) pairs, the entries being the deltas summed into the record.
+        """
+        groups = OrderedDict()
+        for entry in entries:
+            record, members = groups.setdefault((entry['trade'], entry['location']), ({}, []))
+            record[entry['data_type']] = record.get(entry['data_type'], 0) + entry['delta']
+            members.append(entry)
+        return [
+            (dict({"Trade": trade, "Location": location},
+                  **{data_type: str(delta) for data_type, delta in values.items()}), members)
+            for (trade, location), (values, members) in groups.items()
+        ]
+
+    def journal_records(self, entries):
+        return [record for record, _ in self.journal_groups(entries)]
+
+    def unapplied_seqs(self, file_path, groups):
+        """Seqs of grouped deltas whose cell can't be found in the workbook's current structure"""
+        structure = self.get_excel_structure(file_path)
+        seqs = []
+        for record, entries in groups:
+            _, _, targets, _ = self.resolve_record(None, structure, record)
+            applied = {target[0] for target in targets}
+            seqs.extend(entry['seq'] for entry in entries if entry['data_type'] not in applied)
+        return seqs
+
+    def submit_to_journal(self, file_path, records, abort_on_error=False, create_backup=True,
+                          auto_compact=True):
+        """Validate records against the sheet structure and append them to the journal.
+        
+        Returns batch-style results, each with the journal sequence numbers
+        of its queued cells; cells are only written when the journal is
+        compacted. With abort_on_error, nothing is journaled if any record
+        fails. auto_compact applies the journal once it passes
+        JOURNAL_COMPACT_THRESHOLD entries.
+        """
+        with self.locked(file_path), self.timed_submission(file_path):
+            structure = self.get_excel_structure(file_path)
+            journal = self.get_journal(file_path)
+            # Pick up entries other users appended since we last looked
+            journal.refresh()
+            
+            deltas = []
+            results = []
+            for index, data in enumerate(records, start=1):
+                trade, location, targets, errors = self.resolve_record(None, structure, data)
+                for error in errors:
+                    self.log_activity(f"Error updating {error}")
+                queued = []
+                for data_type, row_idx, col_idx, value_num in targets:
+                    deltas.append({
+                        'trade': data.get("Trade", ""),
+                        'location': location,
+                        'data_type': data_type,
+                        'delta': value_num,
+                        'cell': [row_idx, col_idx]
+                    })
+                    cell_ref = f"{xlsx_patch.column_letter(col_idx)}{row_idx}"
+                    queued.append(f"{data_type} at {cell_ref} (+{value_num}, queued)")
+                results.append(self.record_result(index, data, queued, errors))
+            
+            if abort_on_error and not all(result['ok'] for result in results):
+                self.log_activity("A record failed, nothing was journaled")
+                return results
+            
+            if deltas:
+                with self.phase('journal_append'):
+                    seqs = journal.append(deltas)
+                self.log_activity(f"Journaled {len(seqs)} updates (#{seqs[0]}-#{seqs[-1]}), {journal.pending_count} pending")
+                # Deltas were appended in record order, so hand each record its own slice
+                position = 0
+                for result in results:
+                    result['seqs'] = seqs[position:position + len(result['updated_cells'])]
+                    position += len(result['updated_cells'])
+            
+            # Held deltas keep failing until the workbook is fixed, so they don't count towards an apply
+            if auto_compact and journal.pending_count - len(journal.held) >= self.JOURNAL_COMPACT_THRESHOLD:
+                self.compact_journal(file_path, create_backup)
+            return results
+
+    def compact_journal(self, file_path, create_backup=True):
+        """Apply all pending journal deltas to the workbook in one load/save"""
+        journal = self.get_journal(file_path)
+        journal.refresh()
+        if not (journal.pending_count or journal.open_begin):
+            return 0
+        
+        with self.locked(file_path):
+            # Another user may have applied the journal while we waited for the lock
+            journal.refresh()
+            self.recover_journal(file_path, journal)
+            pending = journal.pending()
+            if not pending:
+                return 0
+            if (all(entry['seq'] in journal.held for entry in pending)
+                    and self.held_identity.get(os.path.abspath(file_path)) == self.file_identity(file_path)):
+                # Only deltas that failed against this very version of the workbook
+                return 0
+            return self.apply_journal_entries(file_path, journal, pending, create_backup)
+
+    def apply_journal_entries(self, file_path, journal, pending, create_backup):
+        with self.timed_submission(file_path):
+            backup_id = None
+            if create_backup:
+                backup_id = self.create_backup(file_path)
+            
+            upto_seq = max(entry['seq'] for entry in pending)
+            journal.begin(upto_seq, self.file_identity(file_path)[1:], backup_id)
+            groups = self.journal_groups(pending)
+            _, saved = self.update_excel_batch(
+                file_path, [record for record, _ in groups], create_backup=False,
+                before_replace=lambda stat: journal.saving((stat.st_mtime_ns, stat.st_size)))
+            # Deltas that found no cell stay pending for the next apply instead of being lost
+            held = self.unapplied_seqs(file_path, groups) if saved else [entry['seq'] for entry in pending]
+            journal.commit(upto_seq, held)
+            self.held_identity[os.path.abspath(file_path)] = self.file_identity(file_path) if held else None
+            
+            applied = len(pending) - len(held)
+            self.log_activity(f"Journal applied: {applied} updates to {os.path.basename(file_path)}"
+                              + (f", {len(held)} could not be applied and stay pending" if held else ""))
+            return applied
+
+    def compact_all_journals(self, create_backup=True, file_path=None):
+        """Apply every open journal, first opening those next to file_path"""
+        if file_path:
+            self.open_journals(file_path)
+        for file_path, _ in list(self.journals.values()):
+            try:
+                self.compact_journal(file_path, create_backup)
+            except Exception as e:
+                self.log_activity(f"Journal apply failed for {os.path.basename(file_path)}: {str(e)}")
+
+    def rebuild_from_backup(self, file_path, backup_id, target_path):
+        """Recreate the workbook at target_path from a compaction backup plus the journal"""
+        journal = self.get_journal(file_path)
+        journal.refresh()
+        contents = journal.backup_contents(backup_id)
+        if contents is None:
+            raise ValueError(f"Backup {backup_id} is not recorded in the journal")
+        start_seq, held_then = contents
+        
+        self.backup_store(file_path).restore(backup_id, target_path)
+        # Applied since the backup: later seqs, and ones held back then that went in afterwards
+        entries = [entry for entry in journal.history(0, journal.applied_seq)
+                   if (entry['seq'] > start_seq or entry['seq'] in held_then) and entry['seq'] not in journal.held]
+        if entries:
+            self.update_excel_batch(target_path, self.journal_records(entries), create_backup=False)
+        self.log_activity(f"Rebuilt {os.path.basename(target_path)} from backup with {len(entries)} journaled updates")
+        return len(entries)
+
+class ExcelUpdaterApp(ExcelUpdater):
+    JOURNAL_COMPACT_INTERVAL_MS = 60 * 1000  # How often queued journal updates are applied
+    UI_POLL_MS = 100  # How often the Tk loop picks up results from the worker thread
+    LOG_MAX_LINES = 2000  # Activity log entries kept in memory and lines kept in the widget
+    LOG_FLUSH_MS = 200  # How often queued log messages are written to the widget
+    LOG_FILE_MAX_BYTES = 1024 * 1024
+    LOG_FILE_BACKUPS = 3
+    CLOSE_NOTICE_SECONDS = 2  # How long closing waits before telling the user what holds it up
+
+    def __init__(self, root, log_file=None, aliases=None):
+        super().__init__(aliases=aliases)
+        self.root = root
+        self.root.title("Auto Excel Updater V2.1")
+        self.root.geometry("800x700")
+        
+        # Log messages from any thread are queued and written to the widget in batches
+        self.activity_log = deque(maxlen=self.LOG_MAX_LINES)
+        self.log_queue = queue.Queue()
+        self.file_logger = None
+        if log_file:
+            self.file_logger = logging.getLogger("auto_excel_updater")
+            self.file_logger.setLevel(logging.INFO)
+            self.file_logger.propagate = False
+            handler = logging.handlers.RotatingFileHandler(
+                log_file, maxBytes=self.LOG_FILE_MAX_BYTES, backupCount=self.LOG_FILE_BACKUPS, encoding='utf-8'
+            )
+            handler.setFormatter(logging.Formatter("%(asctime)s %(message)s"))
+            self.file_logger.addHandler(handler)
+        
+        # Configure layout
+        main_frame = ttk.Frame(root, padding=15)
+        main_frame.pack(fill=tk.BOTH, expand=True)
+        
+        # Input section
+        input_frame = ttk.LabelFrame(main_frame, text="Input Data", padding=10)
+        input_frame.pack(fill=tk.X, pady=(0, 15))
+        
+        ttk.Label(input_frame, text="Input (Keyword:Value format):").grid(row=0, column=0, sticky="w")
+        self.input_text = tk.Text(input_frame, height=8, width=80)
+        self.input_text.grid(row=1, column=0, columnspan=2, pady=(0, 10), sticky="ew")
+        
+        # File path
+        ttk.Label(input_frame, text="Excel File Path:").grid(row=2, column=0, sticky="w")
+        self.file_path = ttk.Entry(input_frame, width=60)
+        self.file_path.grid(row=3, column=0, sticky="ew", pady=(0, 10))
+        
+        browse_btn = ttk.Button(input_frame, text="Browse", command=self.browse_file)
+        browse_btn.grid(row=3, column=1, padx=(10, 0))
+        
+        # Options
+        self.backup_var = tk.BooleanVar(value=True)
+        ttk.Checkbutton(input_frame, text="Create backup before updating", variable=self.backup_var
+                       ).grid(row=4, column=0, sticky="w", columnspan=2)
+        self.abort_batch_var = tk.BooleanVar(value=False)
+        ttk.Checkbutton(input_frame, text="Abort whole batch if any record fails", variable=self.abort_batch_var
+                       ).grid(row=5, column=0, sticky="w", columnspan=2)
+        self.journal_var = tk.BooleanVar(value=False)
+        ttk.Checkbutton(input_frame, text="Journal mode (queue updates, apply to Excel periodically)",
+                        variable=self.journal_var).grid(row=6, column=0, sticky="w", columnspan=2)
+        
+        # Process buttons
+        button_frame = ttk.Frame(input_frame)
+        button_frame.grid(row=7, column=0, columnspan=2, pady=10)
+        self.process_btn = ttk.Button(button_frame, text="Update Excel", command=self.process_input)
+        self.process_btn.pack(side=tk.LEFT, padx=5)
+        load_batch_btn = ttk.Button(button_frame, text="Load Batch File", command=self.load_batch_file)
+        load_batch_btn.pack(side=tk.LEFT, padx=5)
+        import_btn = ttk.Button(button_frame, text="Import Data File", command=self.import_data_file)
+        import_btn.pack(side=tk.LEFT, padx=5)
+        apply_journal_btn = ttk.Button(button_frame, text="Apply Journal Now", command=self.apply_journal_now)
+        apply_journal_btn.pack(side=tk.LEFT, padx=5)
+        restore_btn = ttk.Button(button_frame, text="Restore Backup", command=self.restore_backup_dialog)
+        restore_btn.pack(side=tk.LEFT, padx=5)
+        
+        # Activity Log
+        log_frame = ttk.LabelFrame(main_frame, text="Activity Log", padding=10)
+        log_frame.pack(fill=tk.BOTH, expand=True)
+        
+        self.log_text = scrolledtext.ScrolledText(
+            log_frame, height=15, state=tk.DISABLED, wrap=tk.WORD
+        )
+        self.log_text.pack(fill=tk.BOTH, expand=True)
+        
+        # Clear log button
+        clear_btn = ttk.Button(log_frame, text="Clear Log", command=self.clear_log)
+        clear_btn.pack(side=tk.RIGHT, pady=(10, 0))
+        
+        # Status bar with a busy indicator while the worker has jobs
+        status_frame = ttk.Frame(main_frame)
+        status_frame.pack(side=tk.BOTTOM, fill=tk.X)
+        self.status_var = tk.StringVar(value="Ready")
+        status_bar = ttk.Label(status_frame, textvariable=self.status_var, relief=tk.SUNKEN, anchor=tk.W)
+        status_bar.pack(side=tk.LEFT, fill=tk.X, expand=True)
+        self.worker_state_var = tk.StringVar(value="Idle")
+        ttk.Label(status_frame, textvariable=self.worker_state_var, width=22, anchor=tk.E).pack(side=tk.LEFT, padx=5)
+        self.busy_bar = ttk.Progressbar(status_frame, mode='indeterminate', length=120)
+        self.busy_bar.pack(side=tk.LEFT)
+        
+        # Set default file path
+        self.file_path.insert(0, "Master.xlsx")
+        
+        # Sample input for testing
+        sample_input = """Trade: SC-A
+Location: Jaipur
+Dispatched: 5
+Inspection: 3"""
+        self.input_text.insert("1.0", sample_input)
+        
+        # All workbook access runs on one worker thread fed by a job queue
+        self.jobs = deque()
+        self.jobs_ready = threading.Condition()
+        self.pending_jobs = 0
+        self.inflight_inputs = {}
+        # Results come back through a queue the Tk loop polls, so the worker never blocks on Tk
+        self.ui_calls = queue.Queue()
+        self.root.after(self.UI_POLL_MS, self.drain_ui_calls)
+        self.root.after(self.LOG_FLUSH_MS, self.flush_log)
+        self.worker = threading.Thread(target=self.worker_loop, daemon=True)
+        self.worker.start()
+        self.closing = False
+        self.closing_since = None
+        
+        # Apply what earlier sessions left in the journals of this workbook and its neighbours
+        self.submit_job('compact', self.file_path.get().strip(), options={'create_backup': self.backup_var.get()})
+        self.root.after(self.JOURNAL_COMPACT_INTERVAL_MS, self.periodic_compaction)
+        self.root.protocol("WM_DELETE_WINDOW", self.on_closing)
+        self.log_activity("Application started")
+
+    def browse_file(self):
+        filepath = filedialog.askopenfilename(
+            filetypes=[("Excel files", "*.xlsx"), ("All files", "*.*")]
+        )
+        if filepath:
+            self.file_path.delete(0, tk.END)
+            self.file_path.insert(0, filepath)
+            self.log_activity(f"Selected file: {os.path.basename(filepath)}")
+
+    def load_batch_file(self):
+        """Load blank-line separated records from a text file into the input box"""
+        filepath = filedialog.askopenfilename(
+            filetypes=[("Text files", "*.txt"), ("All files", "*.*")]
+        )
+        if filepath:
+            with open(filepath, 'r', encoding='utf-8') as f:
+                text = f.read()
+            self.input_text.delete("1.0", tk.END)
+            self.input_text.insert("1.0", text)
+            records = self.parse_batch_input(text)
+            self.log_activity(f"Loaded {len(records)} records from {os.path.basename(filepath)}")
+
+    def import_data_file(self):
+        """Sum a CSV/JSONL/xlsx export into the selected workbook on the worker thread"""
+        file_path = self.file_path.get().strip()
+        if not file_path or not os.path.exists(file_path):
+            self.log_activity("Error: Please select an Excel file to import into")
+            return
+        source_path = filedialog.askopenfilename(
+            filetypes=[("Data files", "*.csv *.jsonl *.ndjson *.xlsx *.xlsm"), ("All files", "*.*")]
+        )
+        if not source_path:
+            return
+        if os.path.abspath(source_path) == os.path.abspath(file_path):
+            self.log_activity("Error: Can't import a workbook into itself")
+            return
+        options = {
+            'source_path': source_path,
+            'create_backup': self.backup_var.get(),
+            'abort_on_error': self.abort_batch_var.get()
+        }
+        self.submit_job('import', file_path, options=options, on_done=self.report_import,
+                        input_key=(os.path.abspath(file_path), os.path.abspath(source_path)))
+
+    def clear_log(self):
+        self.flush_log(reschedule=False)
+        self.activity_log.clear()
+        self.log_text.config(state=tk.NORMAL)
+        self.log_text.delete(1.0, tk.END)
+        self.log_text.config(state=tk.DISABLED)
+        self.log_activity("Log cleared")
+
+    def log_activity(self, message):
+        """Add timestamped message to activity log; safe to call from any thread"""
+        timestamp = datetime.now().strftime("%H:%M:%S")
+        self.log_queue.put((f"[{timestamp}] {message}", message))
+        if self.file_logger is not None:
+            self.file_logger.info(message)
+
+    def flush_log(self, reschedule=True):
+        """Write queued log messages to the widget in one insert and trim old lines"""
+        entries = []
+        while True:
+            try:
+                entries.append(self.log_queue.get_nowait())
+            except queue.Empty:
+                break
+        
+        if entries:
+            self.activity_log.extend(log_entry for log_entry, _ in entries)
+            # A burst bigger than the widget holds would be trimmed straight away
+            shown = entries[-self.LOG_MAX_LINES:]
+            self.log_text.config(state=tk.NORMAL)
+            self.log_text.insert(tk.END, "".join(log_entry + "\n" for log_entry, _ in shown))
+            lines = int(self.log_text.index('end-1c').split('.')[0]) - 1
+            if lines > self.LOG_MAX_LINES:
+                self.log_text.delete("1.0", f"{lines - self.LOG_MAX_LINES + 1}.0")
+            self.log_text.see(tk.END)  # Scroll to bottom
+            self.log_text.config(state=tk.DISABLED)
+            
+            # Update status bar
+            self.status_var.set(entries[-1][1])
+        
+        if reschedule:
+            self.root.after(self.LOG_FLUSH_MS, self.flush_log)
+
+    def restore_backup_dialog(self):
+        """Let the user pick a backup of the current file and restore it to a new file"""
+        file_path = self.file_path.get().strip()
+        snapshots = self.backup_store(file_path).snapshots() if file_path else []
+        if not snapshots:
+            messagebox.showinfo("Restore Backup", "No backups found for this file.")
+            return
+        
+        dialog = tk.Toplevel(self.root)
+        dialog.title("Restore Backup")
+        listbox = tk.Listbox(dialog, width=50, height=15)
+        listbox.pack(fill=tk.BOTH, expand=True, padx=10, pady=10)
+        for snapshot in reversed(snapshots):
+            created = datetime.fromisoformat(snapshot['created']).strftime("%Y-%m-%d %H:%M:%S")
+            listbox.insert(tk.END, f"{created}  ({snapshot['size'] // 1024} KB)")
+        
+        def restore():
+            selection = listbox.curselection()
+            if not selection:
+                return
+            snapshot = list(reversed(snapshots))[selection[0]]
+            target_path = filedialog.asksaveasfilename(
+                parent=dialog, defaultextension=".xlsx",
+                initialfile=f"{os.path.splitext(snapshot['source'])[0]}_restored_{snapshot['id']}.xlsx",
+                filetypes=[("Excel files", "*.xlsx")]
+            )
+            if target_path:
+                self.backup_store(file_path).restore(snapshot['id'], target_path)
+                self.log_activity(f"Restored backup {snapshot['id']} to {os.path.basename(target_path)}")
+                dialog.destroy()
+        
+        ttk.Button(dialog, text="Restore As...", command=restore).pack(pady=(0, 10))
+
+    def periodic_compaction(self):
+        self.submit_job('compact', self.file_path.get().strip(), options={'create_backup': self.backup_var.get()})
+        self.root.after(self.JOURNAL_COMPACT_INTERVAL_MS, self.periodic_compaction)
+
+    def apply_journal_now(self):
+        self.submit_job('compact', self.file_path.get().strip(), options={'create_backup': self.backup_var.get()})
+
+    def on_closing(self):
+        if self.closing:
+            # Still waiting, e.g. for another user's lock on the workbook
+            if messagebox.askyesno("Close Now?", "Pending updates are still being saved. Close anyway?\n\n"
+                                   "Journaled updates are kept and applied the next time the app starts; "
+                                   "direct updates not saved yet are lost."):
+                self.save_metrics()
+                self.root.destroy()
+            return
+        # Let queued updates finish and apply the journal before the window closes
+        self.closing = True
+        self.status_var.set("Saving pending updates...")
+        self.submit_job('compact', self.file_path.get().strip(), options={'create_backup': self.backup_var.get()})
+        with self.jobs_ready:
+            self.jobs.append(None)
+            self.jobs_ready.notify()
+        self.closing_since = time.monotonic()
+        self.root.after(self.UI_POLL_MS, self.finish_closing)
+
+    def finish_closing(self):
+        """Close once the worker is done, keeping the window responsive meanwhile"""
+        if not self.worker.is_alive():
+            self.root.destroy()
+            return
+        if time.monotonic() - self.closing_since > self.CLOSE_NOTICE_SECONDS:
+            self.status_var.set("Saving pending updates (waiting for the workbook)... close again to quit now")
+        self.root.after(self.UI_POLL_MS, self.finish_closing)
+
+    def submit_job(self, kind, file_path=None, records=None, options=None, on_done=None, input_key=None):
+        """Queue work for the worker thread; on_done runs on the Tk thread with the outcome"""
+        job = {
+            'kind': kind,
+            'file_path': file_path,
+            'records': records or [],
+            'options': options or {},
+            'on_done': on_done,
+            'input_key': input_key
+        }
+        self.pending_jobs += 1
+        if input_key is not None:
+            self.inflight_inputs[input_key] = self.inflight_inputs.get(input_key, 0) + 1
+        self.update_worker_state()
+        with self.jobs_ready:
+            self.jobs.append(job)
+            self.jobs_ready.notify()
+
+    def next_jobs(self):
+        """Block until work is queued; return the next job plus any it can be merged with.
+        
+        Consecutive update submissions for the same file and options are
+        coalesced so they share one workbook load and save. Returns None
+        when the worker should stop.
+        """
+        with self.jobs_ready:
+            while not self.jobs:
+                self.jobs_ready.wait()
+            job = self.jobs.popleft()
+            if job is None:
+                return None
+            batch = [job]
+            # Aborting is per submission, so those jobs are never merged
+            if job['kind'] == 'update' and not job['options'].get('abort_on_error'):
+                while (self.jobs and self.jobs[0] is not None and self.jobs[0]['kind'] == 'update'
+                       and self.jobs[0]['file_path'] == job['file_path']
+                       and self.jobs[0]['options'] == job['options']):
+                    batch.append(self.jobs.popleft())
+            return batch
+
+    def worker_loop(self):
+        while True:
+            batch = self.next_jobs()
+            if batch is None:
+                self.save_metrics()
+                return
+            try:
+                outcomes = self.run_jobs(batch)
+            except Exception as e:
+                outcomes = [e] * len(batch)
+            for job, outcome in zip(batch, outcomes):
+                self.ui_calls.put((self.finish_job, (job, outcome)))
+
+    def drain_ui_calls(self):
+        """Run callbacks queued by the worker thread, on the Tk thread"""
+        while True:
+            try:
+                func, args = self.ui_calls.get_nowait()
+            except queue.Empty:
+                break
+            func(*args)
+        self.root.after(self.UI_POLL_MS, self.drain_ui_calls)
+
+    def run_jobs(self, batch):
+        """Do the work of one or more coalesced jobs on the worker thread"""
+        job = batch[0]
+        options = job['options']
+        if job['kind'] == 'compact':
+            self.compact_all_journals(options['create_backup'], job['file_path'])
+            return [None] * len(batch)
+        
+        if job['kind'] == 'journal':
+            return [self.submit_to_journal(job['file_path'], job['records'], **options)]
+        
+        if job['kind'] == 'import':
+            return [importer.import_file(self, job['file_path'], options['source_path'],
+                                         create_backup=options['create_backup'],
+                                         abort_on_error=options['abort_on_error'])]
+        
+        records = [data for queued in batch for data in queued['records']]
+        if len(batch) > 1:
+            self.log_activity(f"Combining {len(batch)} submissions ({len(records)} records) into one save")
+        results, saved = self.update_excel_batch(job['file_path'], records, **options)
+        
+        # Hand each submission its own slice of the results, renumbered from 1
+        outcomes = []
+        offset = 0
+        for queued in batch:
+            own = [dict(result, index=result['index'] - offset)
+                   for result in results[offset:offset + len(queued['records'])]]
+            outcomes.append((own, saved))
+            offset += len(queued['records'])
+        return outcomes
+
+    def finish_job(self, job, outcome):
+        """Runs on the Tk thread once the worker has finished a job"""
+        self.pending_jobs -= 1
+        if job['input_key'] is not None:
+            self.inflight_inputs[job['input_key']] -= 1
+            if not self.inflight_inputs[job['input_key']]:
+                del self.inflight_inputs[job['input_key']]
+        self.update_worker_state()
+        if isinstance(outcome, Exception):
+            error_msg = f"Processing failed: {str(outcome)}"
+            self.log_activity(error_msg)
+            messagebox.showerror("Error", error_msg)
+        elif job['on_done'] is not None:
+            job['on_done'](job, outcome)
+
+    def update_worker_state(self):
+        if self.pending_jobs:
+            self.worker_state_var.set(f"Working ({self.pending_jobs} queued)")
+            self.busy_bar.start(15)
+        else:
+            self.worker_state_var.set("Idle")
+            self.busy_bar.stop()
 
     def process_input(self):
         """Handle button click event"""
@@ -345,32 +1450,118 @@ Inspection: 3"""
             self.log_activity(f"Error: File not found: {file_path}")
             return
         
-        try:
+        # Values are added, not overwritten, so a second click would count them twice
+        input_key = (os.path.abspath(file_path), text)
+        if input_key in self.inflight_inputs:
+            if not messagebox.askyesno(
+                "Already Processing",
+                "This exact input is still being processed.\n"
+                "Values are added to the sheet, so submitting again will count them twice.\n"
+                "Submit it again?"
+            ):
+                return
+        
+        records = self.parse_batch_input(text)
+        if self.journal_var.get():
+            options = {'abort_on_error': self.abort_batch_var.get(), 'create_backup': self.backup_var.get()}
+            self.submit_job('journal', file_path, records, options, self.report_journal, input_key)
+            return
+        
+        options = {'create_backup': self.backup_var.get()}
+        if len(records) > 1:
+            self.log_activity(f"Processing batch of {len(records)} records")
+            options['abort_on_error'] = self.abort_batch_var.get()
+            self.submit_job('update', file_path, records, options, self.report_batch, input_key)
+        else:
             data = self.parse_input(text)
             self.log_activity(f"Processing input: {', '.join(f'{k}={v}' for k, v in data.items())}")
-            
-            updated_cells = self.update_excel(
-                file_path, 
-                data,
-                create_backup=self.backup_var.get()
-            )
-            
-            if updated_cells:
-                msg = f"Success! Updated {len(updated_cells)} cells"
-                for cell in updated_cells:
-                    msg += f"\n- {cell}"
-                self.log_activity(msg)
-                messagebox.showinfo("Success", msg)
+            self.submit_job('update', file_path, [data], options, self.report_single, input_key)
+
+    def report_single(self, job, outcome):
+        """Report the result of a single-record update"""
+        results, _ = outcome
+        updated_cells = results[0]['updated_cells']
+        if updated_cells:
+            msg = f"Success! Updated {len(updated_cells)} cells"
+            for cell in updated_cells:
+                msg += f"\n- {cell}"
+            self.log_activity(msg)
+            messagebox.showinfo("Success", msg)
+        else:
+            msg = "No cells updated. Check input parameters."
+            self.log_activity(msg)
+            messagebox.showinfo("Information", msg)
+
+    def report_journal(self, job, results):
+        """Report which records were accepted into the journal"""
+        queued = sum(len(result['updated_cells']) for result in results)
+        failed = [result for result in results if not result['ok']]
+        msg = f"Queued {queued} updates from {len(job['records'])} records"
+        for result in failed:
+            msg += f"\n- Record {result['index']} FAILED: {'; '.join(result['errors'])}"
+        self.log_activity(msg)
+        if failed:
+            messagebox.showwarning("Journal Result", msg)
+
+    def report_import(self, job, outcome):
+        """Report how a bulk import was summed and applied"""
+        bulk, results, saved = outcome
+        failed = [result for result in results if not result['ok']]
+        total_cells = sum(len(result['updated_cells']) for result in results)
+        source = os.path.basename(job['options']['source_path'])
+        if saved:
+            msg = f"Imported {source}: {bulk.summary()}; {total_cells} cells updated"
+        elif results:
+            msg = f"Import of {source} aborted, no changes saved: {bulk.summary()}"
+        else:
+            msg = f"Nothing to import from {source}: {bulk.summary()}"
+        for result in failed[:importer.MAX_REPORTED_ERRORS]:
+            trade = result['data'].get("Trade", "?")
+            location = result['data'].get("Location", "?")
+            msg += f"\n- {trade}/{location} FAILED: {'; '.join(result['errors'])}"
+        if len(failed) > importer.MAX_REPORTED_ERRORS:
+            msg += f"\n- ...and {len(failed) - importer.MAX_REPORTED_ERRORS} more trade/location pairs failed"
+        for error in bulk.errors:
+            msg += f"\n- {error}"
+        self.log_activity(msg)
+        
+        if saved and not failed and not bulk.rows_skipped:
+            messagebox.showinfo("Import Complete", msg)
+        else:
+            messagebox.showwarning("Import Result", msg)
+
+    def report_batch(self, job, outcome):
+        """Report the result of each record of a multi-record batch"""
+        results, saved = outcome
+        records = job['records']
+        succeeded = sum(1 for result in results if result['ok'])
+        total_cells = sum(len(result['updated_cells']) for result in results)
+        if saved:
+            msg = f"Batch complete: {succeeded}/{len(records)} records applied, {total_cells} cells updated"
+        elif not succeeded:
+            msg = f"Batch failed: none of the {len(records)} records could be applied, no changes saved"
+        else:
+            msg = f"Batch aborted: record {results[-1]['index']} failed, no changes saved"
+        for result in results:
+            trade = result['data'].get("Trade", "?")
+            location = result['data'].get("Location", "?")
+            if result['ok']:
+                msg += f"\n- Record {result['index']} ({trade}/{location}): {len(result['updated_cells'])} cells"
             else:
-                msg = "No cells updated. Check input parameters."
-                self.log_activity(msg)
-                messagebox.showinfo("Information", msg)
-        except Exception as e:
-            error_msg = f"Processing failed: {str(e)}"
-            self.log_activity(error_msg)
-            messagebox.showerror("Error", error_msg)
+                msg += f"\n- Record {result['index']} ({trade}/{location}) FAILED: {'; '.join(result['errors'])}"
+        self.log_activity(msg)
+        
+        if saved and succeeded == len(records):
+            messagebox.showinfo("Success", msg)
+        else:
+            messagebox.showwarning("Batch Result", msg)
 
 if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Auto Excel Updater")
+    parser.add_argument('--log-file', help="Also keep a rotating activity log at this path")
+    parser.add_argument('--aliases', help="JSON file of trade, location and header aliases")
+    args = parser.parse_args()
     root = tk.Tk()
-    app = ExcelUpdaterApp(root)
+    app = ExcelUpdaterApp(root, log_file=args.log_file,
+                          aliases=load_aliases(args.aliases) if args.aliases else None)
     root.mainloop()
\ No newline at end of file
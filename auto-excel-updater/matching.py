@@ -0,0 +1,183 @@
+"""Name matching for trades, locations and headers.
+
+Names are reduced to a match key (lower case, separators as spaces, other
+punctuation dropped) and indexed by whole key and by token, with the tokens
+also kept sorted for prefix search. A query is tried in stages: exact key,
+all tokens, token prefixes, then substring. The first stage with any hit
+decides. A single hit is the match; several are reported as ambiguous
+instead of settling on the first, so 'Jaipur' finds Jaipur rather than
+Jaipur Rural, while 'Jai' names both.
+
+Aliases map other spellings onto a name, e.g. in an aliases file:
+
+    {
+      "trades": {"SC-A": "Sculptor Set - A"},
+      "locations": {"Bhubaneswar": "Bhuv.", "Greater Noida": "G.Noida"},
+      "headers": {"Sent": "Dispatched Kits", "Kits Ready": "Ready Kits"}
+    }
+
+Headers are indexed under their own names, so two bands that read alike
+(Dispatched Kits, Pending Dispatches) stay apart and a query naming both
+is ambiguous. A header keyword ('inspection') is an alias only for the one
+header mentioning it; when several do, it names none of them.
+"""
+import bisect
+import json
+import re
+from functools import lru_cache
+
+NOISE_WORDS = re.compile(r'\b(kits?|quantity|total|count)\b')
+SEPARATORS = re.compile(r'[-/_(),&+]')
+PUNCTUATION = re.compile(r'[^\w\s]')
+SPACES = re.compile(r'\s+')
+# A header mentioning one of these is also known by the name, however it is worded
+HEADER_KEYWORDS = (('inspect', 'inspection'), ('dispatch', 'dispatch'))
+ALIAS_KINDS = ('trades', 'locations', 'headers')
+
+
+class AmbiguousMatch(ValueError):
+    """A query matched several names equally well"""
+
+    def __init__(self, kind, query, names):
+        self.names = names
+        super().__init__(f"{kind} '{query}' is ambiguous, matches: {', '.join(names)}")
+
+
+@lru_cache(maxsize=4096)
+def match_key(name):
+    key = SEPARATORS.sub(' ', str(name).lower())
+    return SPACES.sub(' ', PUNCTUATION.sub('', key)).strip()
+
+
+@lru_cache(maxsize=4096)
+def normalize_header(header):
+    """Normalize header names for flexible matching"""
+    header = str(header).lower().strip()
+    # Remove common prefixes/suffixes
+    header = NOISE_WORDS.sub('', header)
+    # Remove special characters and extra spaces
+    header = PUNCTUATION.sub('', header)
+    return SPACES.sub(' ', header).strip()
+
+
+def keyword_aliases(header_names):
+    """{keyword name: header} for each HEADER_KEYWORDS keyword found in exactly one header"""
+    aliases = {}
+    for keyword, name in HEADER_KEYWORDS:
+        mentioning = [header for header in header_names if keyword in normalize_header(header)]
+        if len(mentioning) == 1:
+            aliases[name] = mentioning[0]
+    return aliases
+
+
+def load_aliases(path):
+    """Read an aliases file, returning {'trades': {...}, 'locations': {...}, 'headers': {...}}"""
+    with open(path, 'r', encoding='utf-8') as f:
+        saved = json.load(f)
+    unknown = set(saved) - set(ALIAS_KINDS)
+    if unknown:
+        raise ValueError(f"Unknown alias sections in {path}: {', '.join(sorted(unknown))}")
+    return {kind: dict(saved.get(kind, {})) for kind in ALIAS_KINDS}
+
+
+class NameIndex:
+    """Staged lookup of a query among (value, name) entries; see the module docstring"""
+
+    def __init__(self, kind, entries, aliases=None, key=match_key):
+        self.kind = kind
+        self.key = key
+        self.values = []
+        self.names = []
+        self.compact = []  # Keys without spaces, for the substring stage
+        self.exact = {}
+        self.tokens = {}
+        for value, name in entries:
+            position = len(self.values)
+            name_key = key(name)
+            self.values.append(value)
+            self.names.append(str(name).strip())
+            self.compact.append(name_key.replace(' ', ''))
+            self.exact.setdefault(name_key, []).append(position)
+            for token in name_key.split():
+                self.tokens.setdefault(token, set()).add(position)
+        self.sorted_tokens = sorted(self.tokens)
+        self.aliases = {key(alias): key(name) for alias, name in (aliases or {}).items()}
+
+    def prefixed(self, prefix):
+        """Positions of names with a token starting with prefix"""
+        positions = set()
+        i = bisect.bisect_left(self.sorted_tokens, prefix)
+        while i < len(self.sorted_tokens) and self.sorted_tokens[i].startswith(prefix):
+            positions |= self.tokens[self.sorted_tokens[i]]
+            i += 1
+        return positions
+
+    def candidates(self, query):
+        """Positions matched by the first stage that has any"""
+        query_key = self.key(query)
+        query_key = self.aliases.get(query_key, query_key)
+        if not query_key:
+            return []
+        if query_key in self.exact:
+            return self.exact[query_key]
+
+        tokens = query_key.split()
+        for lookup in (self.tokens.get, self.prefixed):
+            hits = None
+            for token in tokens:
+                found = lookup(token) or set()
+                hits = set(found) if hits is None else hits & found
+                if not hits:
+                    break
+            if hits:
+                return sorted(hits)
+
+        compact = query_key.replace(' ', '')
+        return [position for position, name in enumerate(self.compact) if compact in name]
+
+    def find(self, query):
+        """Value of the one name matching query, or None; raises AmbiguousMatch for several"""
+        hits = self.candidates(query)
+        if not hits:
+            return None
+        if len(hits) > 1:
+            raise AmbiguousMatch(self.kind, query, [self.names[position] for position in hits])
+        return self.values[hits[0]]
+
+
+class Matcher:
+    """Builds and caches the name indexes of a detected sheet structure"""
+
+    def __init__(self, aliases=None):
+        aliases = aliases or {}
+        self.trade_aliases = aliases.get('trades', {})
+        self.location_aliases = aliases.get('locations', {})
+        self.header_aliases = aliases.get('headers', {})
+
+    def indexes(self, structure):
+        # Built on first use; dropped whenever the structure's trade rows are re-read
+        return structure.setdefault('match_index', {})
+
+    def trade_index(self, structure):
+        indexes = self.indexes(structure)
+        if 'trades' not in indexes:
+            indexes['trades'] = NameIndex("Trade", structure['trade_rows'], self.trade_aliases)
+        return indexes['trades']
+
+    def header_index(self, structure):
+        indexes = self.indexes(structure)
+        if 'headers' not in indexes:
+            entries = [(header_key, header_key) for header_key in structure['headers']]
+            # The aliases file wins over a keyword
+            aliases = dict(keyword_aliases(structure['headers']), **self.header_aliases)
+            indexes['headers'] = NameIndex("Header", entries, aliases, key=normalize_header)
+        return indexes['headers']
+
+    def location_index(self, structure, header_key):
+        indexes = self.indexes(structure)
+        key = ('locations', header_key)
+        if key not in indexes:
+            entries = [(sub_header['col'], sub_header['name'])
+                       for sub_header in structure['headers'][header_key]['sub_headers']]
+            indexes[key] = NameIndex("Location", entries, self.location_aliases)
+        return indexes[key]
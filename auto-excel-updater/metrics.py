@@ -0,0 +1,194 @@
+"""Cumulative phase timings for a master workbook.
+
+Every timed phase of an update (backup, structure lookup, load, cell
+lookups, writes, save) is counted into a histogram with ten logarithmic
+buckets per decade of milliseconds. Histograms can be merged across runs and
+stay small however many updates are recorded, and give p50/p95 to within a
+bucket (about 26%). The summary is written as JSON next to the workbook.
+
+Several users may share that file, so save() doesn't overwrite it with this
+process's view: it re-reads the file and adds only the samples recorded
+here since the last save. The read, merge and replace happen under a lock
+file next to the metrics file, so two processes saving at once don't drop
+each other's samples; a save that can't get the lock keeps its samples for
+the next one. Saving costs a read and a write of the file, so callers save
+every so often and on exit rather than after every update.
+"""
+import json
+import math
+import os
+import tempfile
+import threading
+import time
+from datetime import datetime
+
+from workbook_lock import WorkbookLock
+
+BUCKETS_PER_DECADE = 10
+MIN_MS = 0.001  # Everything faster lands in bucket 0
+
+
+def bucket_for(ms):
+    if ms <= MIN_MS:
+        return 0
+    return int(math.log10(ms / MIN_MS) * BUCKETS_PER_DECADE)
+
+
+def bucket_upper_ms(bucket):
+    return MIN_MS * 10 ** ((bucket + 1) / BUCKETS_PER_DECADE)
+
+
+class PhaseHistogram:
+    def __init__(self, saved=None):
+        saved = saved or {}
+        self.count = saved.get('count', 0)
+        self.total_ms = saved.get('total_ms', 0.0)
+        self.max_ms = saved.get('max_ms', 0.0)
+        self.buckets = {int(bucket): count for bucket, count in saved.get('buckets', {}).items()}
+
+    def add(self, ms):
+        self.count += 1
+        self.total_ms += ms
+        self.max_ms = max(self.max_ms, ms)
+        bucket = bucket_for(ms)
+        self.buckets[bucket] = self.buckets.get(bucket, 0) + 1
+
+    def merge(self, other):
+        self.count += other.count
+        self.total_ms += other.total_ms
+        self.max_ms = max(self.max_ms, other.max_ms)
+        for bucket, count in other.buckets.items():
+            self.buckets[bucket] = self.buckets.get(bucket, 0) + count
+
+    def percentile(self, fraction):
+        """Upper bound of the bucket holding the given fraction of samples"""
+        if not self.count:
+            return None
+        wanted = math.ceil(self.count * fraction)
+        seen = 0
+        for bucket in sorted(self.buckets):
+            seen += self.buckets[bucket]
+            if seen >= wanted:
+                return round(min(bucket_upper_ms(bucket), self.max_ms), 3)
+        return round(self.max_ms, 3)
+
+    def to_dict(self):
+        return {
+            'count': self.count,
+            'total_ms': round(self.total_ms, 3),
+            'mean_ms': round(self.total_ms / self.count, 3) if self.count else None,
+            'p50_ms': self.percentile(0.5),
+            'p95_ms': self.percentile(0.95),
+            'max_ms': round(self.max_ms, 3),
+            'buckets': {str(bucket): count for bucket, count in sorted(self.buckets.items())}
+        }
+
+
+class WorkbookMetrics:
+    LOCK_TIMEOUT = 5  # Seconds to wait for another process's save
+
+    def __init__(self, path):
+        self.path = path
+        self.submissions = 0
+        self.workbook_bytes = None
+        self.max_workbook_bytes = None
+        self.phases = {}
+        # Samples recorded since the last save, added to the file's on the next one
+        self.unsaved_submissions = 0
+        self.unsaved_phases = {}
+        self.last_saved = time.monotonic()
+        # Submissions on different threads record into the same histograms
+        self.lock = threading.Lock()
+        self._load()
+
+    def _load(self):
+        """Continue the histograms of earlier runs; a damaged file starts over"""
+        try:
+            with open(self.path, 'r', encoding='utf-8') as f:
+                saved = json.load(f)
+        except (OSError, ValueError):
+            return
+        self.submissions = saved.get('submissions', 0)
+        self.workbook_bytes = saved.get('workbook_bytes', self.workbook_bytes)
+        self.max_workbook_bytes = saved.get('max_workbook_bytes', self.max_workbook_bytes)
+        self.phases = {phase: PhaseHistogram(data) for phase, data in saved.get('phases', {}).items()}
+
+    def record_submission(self, timings, workbook_bytes=None):
+        """Add one submission's (phase, seconds) samples"""
+        with self.lock:
+            self.submissions += 1
+            self.unsaved_submissions += 1
+            for phase, seconds in timings:
+                self.phases.setdefault(phase, PhaseHistogram()).add(seconds * 1000)
+                self.unsaved_phases.setdefault(phase, PhaseHistogram()).add(seconds * 1000)
+            if workbook_bytes is not None:
+                self.workbook_bytes = workbook_bytes
+                self.max_workbook_bytes = max(self.max_workbook_bytes or 0, workbook_bytes)
+
+    def save_due(self, interval):
+        """Whether there is something to save and interval seconds passed since the last save"""
+        return self.unsaved_submissions and time.monotonic() - self.last_saved >= interval
+
+    def cache_hit_rate(self):
+        hits = self.phases['structure_hit'].count if 'structure_hit' in self.phases else 0
+        misses = self.phases['structure_miss'].count if 'structure_miss' in self.phases else 0
+        return round(hits / (hits + misses), 3) if hits + misses else None
+
+    def summary(self):
+        with self.lock:
+            return self._summary()
+
+    def _summary(self):
+        return {
+            'updated': datetime.now().isoformat(timespec='seconds'),
+            'submissions': self.submissions,
+            'structure_cache_hit_rate': self.cache_hit_rate(),
+            'workbook_bytes': self.workbook_bytes,
+            'max_workbook_bytes': self.max_workbook_bytes,
+            'bucket_scheme': {'min_ms': MIN_MS, 'buckets_per_decade': BUCKETS_PER_DECADE},
+            'phases': {phase: histogram.to_dict() for phase, histogram in self.phases.items()}
+        }
+
+    def save(self):
+        """Add the samples recorded since the last save to the file's.
+
+        Raises LockTimeout if another process holds the metrics lock too long.
+        """
+        with self.lock:
+            if not self.unsaved_submissions:
+                return
+            # A save that fails, lock wait included, is retried with the same samples after the next interval
+            self.last_saved = time.monotonic()
+            file_lock = WorkbookLock(self.path + '.lock')
+            file_lock.acquire(self.LOCK_TIMEOUT)
+            try:
+                self._merge_and_write()
+            finally:
+                file_lock.release()
+
+    def _merge_and_write(self):
+        """Re-read the file, add the unsaved samples and replace it; call holding both locks"""
+        # Start from what other users have saved meanwhile
+        workbook_bytes = self.workbook_bytes
+        max_workbook_bytes = self.max_workbook_bytes
+        self.submissions = 0
+        self.phases = {}
+        self._load()
+        self.submissions += self.unsaved_submissions
+        for phase, histogram in self.unsaved_phases.items():
+            self.phases.setdefault(phase, PhaseHistogram()).merge(histogram)
+        self.workbook_bytes = workbook_bytes
+        self.max_workbook_bytes = max(self.max_workbook_bytes or 0, max_workbook_bytes or 0) or None
+
+        directory = os.path.dirname(os.path.abspath(self.path))
+        fd, temp_path = tempfile.mkstemp(suffix='.json', dir=directory)
+        try:
+            with os.fdopen(fd, 'w', encoding='utf-8') as f:
+                json.dump(self._summary(), f, indent=2)
+            os.replace(temp_path, self.path)
+        except BaseException:
+            if os.path.exists(temp_path):
+                os.remove(temp_path)
+            raise
+        self.unsaved_submissions = 0
+        self.unsaved_phases = {}
@@ -0,0 +1,263 @@
+"""In-memory trade x (header, location) snapshot of a master sheet for queries.
+
+The sheet is streamed once in read-only mode into one float column per
+(header, location) cell range, using the layout detect_excel_structure
+found. Column totals are kept alongside, so whole-sheet aggregates cost one
+pass over the columns, and written cells are applied in place instead of
+re-reading the workbook. numpy is used for the matrix when it is installed;
+otherwise each column is an array('d').
+
+Trade, header and location filters are resolved through the same name
+indexes as updates, so a name means the same cells in both and one that
+matches several names raises AmbiguousMatch instead of summing them all.
+"""
+import csv
+import json
+import operator
+import re
+from array import array
+
+import openpyxl
+
+from matching import NameIndex
+
+try:
+    import numpy as np
+except ImportError:
+    np = None
+
+GROUP_BY = ('trade', 'header', 'location')
+# Summary rows in the trade column; leaving them out keeps sums from counting twice
+TOTAL_ROW = re.compile(r'(grand\s+|sub\s*-?\s*)?totals?', re.IGNORECASE)
+
+
+def to_number(value):
+    """Cell value as a float; empty and non-numeric cells count as 0"""
+    if value is None or isinstance(value, bool):
+        return 0.0
+    if isinstance(value, (int, float)):
+        return float(value)
+    try:
+        return float(str(value).replace(',', ''))
+    except ValueError:
+        return 0.0
+
+
+class SheetSnapshot:
+    def __init__(self, structure, matcher):
+        self.structure = structure
+        self.matcher = matcher
+        self.identity = None
+        self.stale = False
+        self.filter_cache = {}
+
+        trade_rows = [(row, str(name).strip()) for row, name in structure['trade_rows']]
+        self.total_rows = {row for row, name in trade_rows if TOTAL_ROW.fullmatch(name)}
+        trade_rows = [(row, name) for row, name in trade_rows if row not in self.total_rows]
+        self.trades = [name for _, name in trade_rows]
+        self.row_pos = {row: i for i, (row, _) in enumerate(trade_rows)}
+        # One column per location under every header band, in sheet order
+        self.columns = []
+        for header_key, info in structure['headers'].items():
+            for sub_header in info['sub_headers']:
+                self.columns.append({
+                    'header_key': header_key,
+                    'header': str(info['original_name']).strip(),
+                    'location': str(sub_header['name']).strip(),
+                    'col': sub_header['col']
+                })
+        self.columns.sort(key=lambda column: column['col'])
+        self.col_pos = {column['col']: j for j, column in enumerate(self.columns)}
+        # Locations by name across every band, for a location filter without a header
+        self.location_index = NameIndex("Location", [(name, name) for name in
+                                                     dict.fromkeys(column['location'] for column in self.columns)],
+                                        matcher.location_aliases)
+        self.data = None
+        self.col_totals = None
+
+    def load(self, file_path, sheet_name, trade_start_row):
+        """Stream the sheet's values into the columns"""
+        width = len(self.columns)
+        values = [array('d', bytes(8 * len(self.trades))) for _ in range(width)]
+        cols = [column['col'] - 1 for column in self.columns]
+
+        wb = openpyxl.load_workbook(file_path, read_only=True, data_only=True)
+        try:
+            sheet = wb[sheet_name]
+            for row_idx, row in enumerate(sheet.iter_rows(min_row=trade_start_row, values_only=True),
+                                          start=trade_start_row):
+                i = self.row_pos.get(row_idx)
+                if i is None:
+                    continue
+                length = len(row)
+                for j, col in enumerate(cols):
+                    if col < length:
+                        values[j][i] = to_number(row[col])
+        finally:
+            wb.close()
+
+        if np is not None:
+            self.data = np.array(values, dtype=float).T if width else np.zeros((len(self.trades), 0))
+            self.col_totals = self.data.sum(axis=0)
+        else:
+            self.data = values
+            self.col_totals = array('d', (sum(column) for column in values))
+
+    def set_cell(self, row, col, value):
+        """Apply a written cell; cells outside the snapshot mark it for a rebuild"""
+        if row in self.total_rows:
+            return
+        i = self.row_pos.get(row)
+        j = self.col_pos.get(col)
+        if i is None or j is None:
+            self.stale = True
+            return
+        value = to_number(value)
+        if np is not None:
+            old = self.data[i, j]
+            self.data[i, j] = value
+        else:
+            old = self.data[j][i]
+            self.data[j][i] = value
+        self.col_totals[j] += value - old
+
+    def match_rows(self, trade):
+        """Row positions of the trade matching trade as updates match it, or None for all.
+
+        Raises ValueError when no trade matches, AmbiguousMatch when several do.
+        """
+        if not trade:
+            return None
+        key = ('trade', trade)
+        if key not in self.filter_cache:
+            row = self.matcher.trade_index(self.structure).find(trade)
+            if row is None:
+                raise ValueError(f"Trade '{trade}' not found")
+            # A total row matches no data rows
+            self.filter_cache[key] = [self.row_pos[row]] if row in self.row_pos else []
+        return self.filter_cache[key]
+
+    def match_columns(self, header, location):
+        """Column positions of a header and a location, matched as updates match them"""
+        key = ('columns', header or '', location or '')
+        if key not in self.filter_cache:
+            header_key = None
+            if header:
+                header_key = self.matcher.header_index(self.structure).find(header)
+                if header_key is None:
+                    raise ValueError(f"No header found matching '{header}'")
+            if location and header_key is not None:
+                # The location as it is named under that header
+                col = self.matcher.location_index(self.structure, header_key).find(location)
+                if col is None:
+                    raise ValueError(f"Location '{location}' not found under '{header_key}'")
+                matched = [self.col_pos[col]]
+            else:
+                name = None
+                if location:
+                    name = self.location_index.find(location)
+                    if name is None:
+                        raise ValueError(f"Location '{location}' not found")
+                matched = [
+                    j for j, column in enumerate(self.columns)
+                    if (header_key is None or column['header_key'] == header_key)
+                    and (name is None or column['location'] == name)
+                ]
+            self.filter_cache[key] = matched
+        return self.filter_cache[key]
+
+    def column_sums(self, rows, cols):
+        if rows is None:
+            return [self.col_totals[j] for j in cols]
+        if np is not None:
+            return list(self.data[np.ix_(rows, cols)].sum(axis=0))
+        return [sum(map(self.data[j].__getitem__, rows)) for j in cols]
+
+    def row_sums(self, rows, cols):
+        if np is not None:
+            selected = self.data[:, cols] if rows is None else self.data[np.ix_(rows, cols)]
+            return list(selected.sum(axis=1))
+        if rows is None:
+            totals = [0.0] * len(self.trades)
+            for j in cols:
+                totals = list(map(operator.add, totals, self.data[j]))
+            return totals
+        return [sum(self.data[j][i] for j in cols) for i in rows]
+
+    def query(self, by=None, trade=None, header=None, location=None):
+        """Sum the matching cells, grouped by trade, header or location.
+
+        Returns a list of {by: key, 'total': value} rows in sheet order, or a
+        single {'total': value} row when by is None.
+        """
+        rows = self.match_rows(trade)
+        cols = self.match_columns(header, location)
+        if by is None:
+            return [{'total': float(sum(self.column_sums(rows, cols)))}]
+        if by not in GROUP_BY:
+            raise ValueError(f"Can't group by '{by}', use one of: {', '.join(GROUP_BY)}")
+
+        if by == 'trade':
+            positions = range(len(self.trades)) if rows is None else rows
+            return [{'trade': self.trades[i], 'total': float(total)}
+                    for i, total in zip(positions, self.row_sums(rows, cols))]
+
+        groups = {}
+        for j, total in zip(cols, self.column_sums(rows, cols)):
+            name = self.columns[j][by]
+            groups[name] = groups.get(name, 0.0) + float(total)
+        return [{by: name, 'total': total} for name, total in groups.items()]
+
+    def query_deltas(self, entries, by=None, trade=None, header=None, location=None):
+        """Like query(), but sums journal deltas (e.g. those since a date) instead of cell values"""
+        rows = self.match_rows(trade)
+        rows = None if rows is None else set(rows)
+        cols = set(self.match_columns(header, location))
+        if by is not None and by not in GROUP_BY:
+            raise ValueError(f"Can't group by '{by}', use one of: {', '.join(GROUP_BY)}")
+
+        groups = {}
+        for entry in entries:
+            i = self.row_pos.get(entry['cell'][0])
+            j = self.col_pos.get(entry['cell'][1])
+            if i is None or j not in cols or (rows is not None and i not in rows):
+                continue
+            if by is None:
+                name = None
+            elif by == 'trade':
+                name = self.trades[i]
+            else:
+                name = self.columns[j][by]
+            groups[name] = groups.get(name, 0.0) + entry['delta']
+
+        if by is None:
+            return [{'total': groups.get(None, 0.0)}]
+        return [{by: name, 'total': total} for name, total in groups.items()]
+
+    def cells(self):
+        """Every non-zero cell as a trade/header/location/value row"""
+        for j, column in enumerate(self.columns):
+            for i, trade in enumerate(self.trades):
+                value = self.data[i, j] if np is not None else self.data[j][i]
+                if value:
+                    yield {
+                        'trade': trade,
+                        'header': column['header'],
+                        'location': column['location'],
+                        'value': float(value)
+                    }
+
+
+def export_rows(rows, path):
+    """Write query rows to a .csv file, or JSON for any other extension"""
+    rows = list(rows)
+    if path.lower().endswith('.csv'):
+        fields = list(rows[0].keys()) if rows else ['total']
+        with open(path, 'w', newline='', encoding='utf-8') as f:
+            writer = csv.DictWriter(f, fieldnames=fields)
+            writer.writeheader()
+            writer.writerows(rows)
+    else:
+        with open(path, 'w', encoding='utf-8') as f:
+            json.dump(rows, f, indent=2)
+    return len(rows)
@@ -0,0 +1,74 @@
+"""Query totals from a master workbook without opening Excel.
+
+Examples:
+    python report.py Master.xlsx --trade SC-A --header dispatched --by location
+    python report.py Master.xlsx --header inspection --by location --since week
+    python report.py Master.xlsx --by trade --export totals.csv
+    python report.py Master.xlsx --all-cells cells.json
+
+--since sums journaled updates (journal mode and the ingestion daemon) made
+from that date on; updates written straight to the workbook carry no date.
+"""
+import argparse
+from datetime import date, timedelta
+
+from main import ExcelUpdater
+from query import GROUP_BY, export_rows
+
+
+def resolve_since(text):
+    """Accept 'today', 'week' (since Monday) or an ISO date/timestamp"""
+    if text is None:
+        return None
+    if text == 'today':
+        return date.today().isoformat()
+    if text == 'week':
+        today = date.today()
+        return (today - timedelta(days=today.weekday())).isoformat()
+    return text
+
+
+def format_total(value):
+    return f"{value:,.0f}" if float(value).is_integer() else f"{value:,.2f}"
+
+
+def print_rows(rows, by):
+    if by is None:
+        print(f"Total: {format_total(rows[0]['total'])}")
+        return
+    width = max([len(str(row[by])) for row in rows] + [len(by)])
+    for row in rows:
+        print(f"{str(row[by]):<{width}}  {format_total(row['total']):>14}")
+    print(f"{'Total':<{width}}  {format_total(sum(row['total'] for row in rows)):>14}")
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Query totals from a master workbook")
+    parser.add_argument('file_path', help="Excel workbook to read")
+    parser.add_argument('--by', choices=GROUP_BY, help="Group totals by trade, header or location")
+    parser.add_argument('--trade', help="Only this trade, matched like update keys")
+    parser.add_argument('--header', help="Only this data type, matched like update keys (e.g. dispatched)")
+    parser.add_argument('--location', help="Only this location, matched like update keys")
+    parser.add_argument('--since', help="Sum journaled updates since: today, week or an ISO date")
+    parser.add_argument('--export', help="Also write the result rows to a .csv or .json file")
+    parser.add_argument('--all-cells', help="Write every non-zero cell to a .csv or .json file")
+    args = parser.parse_args()
+
+    updater = ExcelUpdater()
+    try:
+        rows = updater.query(args.file_path, args.by, args.trade, args.header, args.location,
+                             resolve_since(args.since))
+    except ValueError as e:
+        # Unknown or ambiguous names, reported as updates report them
+        parser.exit(1, f"{e}\n")
+    print_rows(rows, args.by)
+    if args.export:
+        count = export_rows(rows, args.export)
+        print(f"Wrote {count} rows to {args.export}")
+    if args.all_cells:
+        count = export_rows(updater.get_snapshot(args.file_path).cells(), args.all_cells)
+        print(f"Wrote {count} cells to {args.all_cells}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,256 @@
+"""Route update records to several master workbooks and update them in parallel.
+
+A routing file names the target workbooks, which records each one takes
+and the trade abbreviations to expand:
+
+    {
+      "trade_map": {"SC-A": "Sculptor Set - A", "EL": "Electrician"},
+      "aliases": "aliases.json",
+      "sheet": "Master Sheet",
+      "routes": [
+        {"workbook": "north.xlsx", "match": {"Location": ["Jaipur", "G.Noida", "Hapur"]}},
+        {"workbook": "east.xlsx", "match": {"Region": ["East"]}},
+        {"workbook": "all_india.xlsx", "sheet": "Summary"}
+      ]
+    }
+
+A record goes to every route whose match it satisfies (values compare
+without regard to case, and a Trade matches as written or expanded); a
+route without a match takes every record.
+Match keys other than Trade and Location (like Region above) only steer
+routing and are removed before the record is applied. "aliases" is an
+aliases file (see matching.py) or the aliases themselves. Paths are
+relative to the routing file.
+
+Each workbook is handed to one worker process, which loads, updates and
+saves it (one sheet after another when a workbook has several routes), so
+independent workbooks are updated in parallel. The per-workbook results
+come back as one combined report.
+
+Usage:
+    python router.py routes.json records.txt
+    python router.py routes.json day.csv --workers 4 --report day_report.json
+"""
+import argparse
+import json
+import os
+import time
+from collections import OrderedDict
+from concurrent.futures import ProcessPoolExecutor, as_completed
+
+import importer
+from main import ExcelUpdater
+from matching import load_aliases
+
+RECORD_KEYS = ("Trade", "Location")
+
+
+class Route:
+    def __init__(self, workbook, sheet, match=None):
+        self.workbook = workbook
+        self.sheet = sheet
+        # key -> set of accepted values, lowercased
+        self.match = {key: {str(value).strip().lower() for value in values}
+                      for key, values in (match or {}).items()}
+
+    def accepts(self, *forms):
+        """Whether a record, given in one or more forms (as written, abbreviations expanded), matches"""
+        for key, values in self.match.items():
+            if not any(str(form.get(key, "")).strip().lower() in values for form in forms):
+                return False
+        return True
+
+
+class Router:
+    def __init__(self, routes, trade_map=None, aliases=None):
+        self.routes = routes
+        self.aliases = aliases
+        # The routing file's abbreviations extend the built-in ones
+        self.trade_map = dict(ExcelUpdater.TRADE_ABBREVIATIONS, **(trade_map or {}))
+        # Keys that only steer routing and are not data types
+        self.routing_keys = {key for route in routes for key in route.match if key not in RECORD_KEYS}
+
+    @classmethod
+    def from_config(cls, path):
+        """Load a routing file; workbook paths are relative to it"""
+        with open(path, 'r', encoding='utf-8') as f:
+            config = json.load(f)
+        base = os.path.dirname(os.path.abspath(path))
+        default_sheet = config.get('sheet')
+        routes = []
+        for entry in config.get('routes', []):
+            if 'workbook' not in entry:
+                raise ValueError(f"Route without a workbook in {os.path.basename(path)}: {entry}")
+            match = entry.get('match', {})
+            for key, values in match.items():
+                if isinstance(values, str):
+                    match[key] = [values]
+            routes.append(Route(os.path.join(base, entry['workbook']), entry.get('sheet', default_sheet), match))
+        if not routes:
+            raise ValueError(f"No routes in {os.path.basename(path)}")
+        aliases = config.get('aliases')
+        if isinstance(aliases, str):
+            aliases = load_aliases(os.path.join(base, aliases))
+        return cls(routes, config.get('trade_map'), aliases)
+
+    def route(self, records):
+        """Split records into per-workbook, per-sheet batches.
+
+        Returns (batches, unrouted) where batches maps workbook path to an
+        OrderedDict of sheet -> records, in routing file order.
+        """
+        batches = OrderedDict()
+        unrouted = []
+        for record in records:
+            trade = record.get("Trade", "")
+            expanded = dict(record, Trade=self.trade_map.get(trade, trade))
+            # A route may name the trade either way
+            targets = [route for route in self.routes if route.accepts(record, expanded)]
+            if not targets:
+                unrouted.append(dict(record))
+                continue
+            applied = {key: value for key, value in expanded.items() if key not in self.routing_keys}
+            for route in targets:
+                sheets = batches.setdefault(os.path.abspath(route.workbook), OrderedDict())
+                sheets.setdefault(route.sheet, []).append(applied)
+        return batches, unrouted
+
+
+def update_workbook(workbook, sheet_batches, trade_map, aliases=None, create_backup=True, abort_on_error=False):
+    """Apply one workbook's batches; runs in a worker process, which owns the file meanwhile"""
+    lines = []
+    start = time.perf_counter()
+    outcome = {'workbook': workbook, 'sheets': [], 'log': lines, 'error': None}
+    try:
+        for sheet, records in sheet_batches.items():
+            updater = ExcelUpdater(log=lines.append, sheet_name=sheet, trade_map=trade_map, aliases=aliases)
+            results, saved = updater.update_excel_batch(workbook, records, create_backup, abort_on_error)
+            updater.save_metrics()
+            outcome['sheets'].append({'sheet': updater.sheet_name, 'results': results, 'saved': saved})
+    except Exception as e:
+        outcome['error'] = f"{type(e).__name__}: {str(e)}"
+        lines.append(f"Update of {os.path.basename(workbook)} failed: {outcome['error']}")
+    outcome['seconds'] = round(time.perf_counter() - start, 3)
+    return outcome
+
+
+def run_routed(router, records, workers=None, create_backup=True, abort_on_error=False, log=None):
+    """Route records and update every target workbook, in parallel when there are several.
+
+    Returns the combined report (see combine_report).
+    """
+    batches, unrouted = router.route(records)
+    if log is not None:
+        log(f"Routing {len(records)} records to {len(batches)} workbooks"
+            + (f", {len(unrouted)} matched no route" if unrouted else ""))
+
+    start = time.perf_counter()
+    outcomes = []
+    if len(batches) == 1 or workers == 1:
+        # Not worth starting processes for
+        for workbook, sheet_batches in batches.items():
+            outcomes.append(update_workbook(workbook, sheet_batches, router.trade_map, router.aliases,
+                                            create_backup, abort_on_error))
+            if log is not None:
+                log_outcome(outcomes[-1], log)
+    elif batches:
+        workers = min(workers or os.cpu_count() or 1, len(batches))
+        with ProcessPoolExecutor(max_workers=workers) as pool:
+            futures = [pool.submit(update_workbook, workbook, sheet_batches, router.trade_map, router.aliases,
+                                   create_backup, abort_on_error)
+                       for workbook, sheet_batches in batches.items()]
+            for future in as_completed(futures):
+                outcomes.append(future.result())
+                if log is not None:
+                    log_outcome(outcomes[-1], log)
+    # Report workbooks in routing file order, not completion order
+    order = {workbook: i for i, workbook in enumerate(batches)}
+    outcomes.sort(key=lambda outcome: order[outcome['workbook']])
+    return combine_report(outcomes, unrouted, time.perf_counter() - start)
+
+
+def log_outcome(outcome, log):
+    name = os.path.basename(outcome['workbook'])
+    for line in outcome['log']:
+        log(f"[{name}] {line}")
+
+
+def combine_report(outcomes, unrouted, seconds):
+    """One report over all workbooks: per-workbook counts plus overall totals"""
+    workbooks = []
+    for outcome in outcomes:
+        results = [result for sheet in outcome['sheets'] for result in sheet['results']]
+        workbooks.append({
+            'workbook': outcome['workbook'],
+            'sheets': [sheet['sheet'] for sheet in outcome['sheets']],
+            'saved': outcome['error'] is None and all(sheet['saved'] for sheet in outcome['sheets']),
+            'records': len(results),
+            'records_ok': sum(1 for result in results if result['ok']),
+            'cells_updated': sum(len(result['updated_cells']) for result in results),
+            'failures': [{'trade': result['data'].get("Trade"), 'location': result['data'].get("Location"),
+                          'errors': result['errors']} for result in results if not result['ok']],
+            'error': outcome['error'],
+            'seconds': outcome['seconds']
+        })
+    return {
+        'workbooks': workbooks,
+        'workbooks_saved': sum(1 for workbook in workbooks if workbook['saved']),
+        'records_ok': sum(workbook['records_ok'] for workbook in workbooks),
+        'cells_updated': sum(workbook['cells_updated'] for workbook in workbooks),
+        'unrouted': unrouted,
+        'seconds': round(seconds, 3)
+    }
+
+
+def format_report(report):
+    lines = [f"{report['workbooks_saved']}/{len(report['workbooks'])} workbooks saved, "
+             f"{report['cells_updated']} cells updated in {report['seconds']:.1f} s"]
+    for workbook in report['workbooks']:
+        name = os.path.basename(workbook['workbook'])
+        if workbook['error']:
+            # Sheets listed were finished before the failure
+            status = f"FAILED ({workbook['error']})"
+        else:
+            status = "saved" if workbook['saved'] else "not saved"
+        lines.append(f"- {name} ({', '.join(workbook['sheets']) or 'no sheets'}): {status}, {workbook['records_ok']}/"
+                     f"{workbook['records']} records, {workbook['cells_updated']} cells, {workbook['seconds']:.1f} s")
+        for failure in workbook['failures']:
+            lines.append(f"    {failure['trade']}/{failure['location']}: {'; '.join(failure['errors'])}")
+    for record in report['unrouted']:
+        lines.append(f"- No route for {record.get('Trade', '?')}/{record.get('Location', '?')}")
+    return "\n".join(lines)
+
+
+def load_records(path, sheet_name=None):
+    """Records from a blank-line separated text file, or summed from a CSV/JSONL/xlsx export"""
+    if path.lower().endswith('.txt'):
+        with open(path, 'r', encoding='utf-8') as f:
+            return ExcelUpdater().parse_batch_input(f.read())
+    return importer.aggregate_file(path, sheet_name=sheet_name, log=print).records()
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Update several master workbooks from one set of records")
+    parser.add_argument('config', help="Routing file (JSON)")
+    parser.add_argument('records', help="Records: blank-line separated .txt, or a .csv/.jsonl/.xlsx export")
+    parser.add_argument('--source-sheet', help="Sheet to read from an xlsx records file (default: first)")
+    parser.add_argument('--workers', type=int, help="Worker processes (default: one per CPU)")
+    parser.add_argument('--no-backup', action='store_true', help="Don't back up the workbooks first")
+    parser.add_argument('--abort-on-error', action='store_true',
+                        help="Don't save a workbook if any of its records fails")
+    parser.add_argument('--report', help="Also write the combined report to this JSON file")
+    parser.add_argument('--quiet', action='store_true', help="Only print the combined report")
+    args = parser.parse_args()
+
+    router = Router.from_config(args.config)
+    records = load_records(args.records, args.source_sheet)
+    report = run_routed(router, records, args.workers, not args.no_backup, args.abort_on_error,
+                        None if args.quiet else print)
+    print(format_report(report))
+    if args.report:
+        with open(args.report, 'w', encoding='utf-8') as f:
+            json.dump(report, f, indent=2)
+
+
+if __name__ == "__main__":
+    main()
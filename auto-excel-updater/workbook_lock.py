@@ -0,0 +1,216 @@
+"""Advisory lock file for a workbook shared between several machines.
+
+The lock is a small JSON file created with O_EXCL next to the workbook and
+names its holder (user, host, pid). While it is held a heartbeat thread
+touches it every few seconds. A waiter treats the lock as stale when its
+modification time hasn't moved for STALE_SECONDS of the waiter's own clock,
+so clock differences between machines on a network share don't matter,
+or straight away when the holder is a dead process on the same host.
+
+Breaking a stale lock and taking the path can't be done in one step, so a
+holder stalled past STALE_SECONDS can still lose its lock. The heartbeat
+only touches a lock file carrying its own token, and holders call
+still_held() before replacing the workbook.
+"""
+import getpass
+import json
+import os
+import random
+import socket
+import threading
+import time
+import uuid
+from datetime import datetime
+
+
+class LockTimeout(Exception):
+    """The lock could not be acquired before the timeout"""
+
+
+class LockLost(Exception):
+    """The lock was broken as stale and possibly taken by someone else while held"""
+
+
+def process_alive(pid):
+    if os.name == 'nt':
+        # os.kill would terminate the process on Windows; rely on the heartbeat
+        return True
+    try:
+        os.kill(pid, 0)
+    except ProcessLookupError:
+        return False
+    except PermissionError:
+        return True
+    return True
+
+
+def describe_holder(info):
+    if not info:
+        return "another process"
+    return f"{info.get('user', '?')} on {info.get('host', '?')} since {info.get('acquired', '?')}"
+
+
+class WorkbookLock:
+    HEARTBEAT_SECONDS = 5
+    STALE_SECONDS = 30  # No heartbeat for this long means the holder is gone
+    POLL_SECONDS = 0.2
+    MAX_POLL_SECONDS = 2.0
+
+    def __init__(self, path):
+        self.path = path
+        self.token = None
+        self.stop_heartbeat = threading.Event()
+        self.heartbeat = None
+
+    def read_holder(self):
+        """Return (info, mtime) of the current lock file, or (None, None) if unlocked"""
+        try:
+            mtime = os.stat(self.path).st_mtime_ns
+        except FileNotFoundError:
+            return None, None
+        try:
+            with open(self.path, 'r', encoding='utf-8') as f:
+                return json.load(f), mtime
+        except FileNotFoundError:
+            return None, None
+        except (OSError, ValueError):
+            # Half written or unreadable; still counts as held until it goes stale
+            return {}, mtime
+
+    def try_create(self):
+        token = uuid.uuid4().hex
+        info = {
+            'token': token,
+            'user': getpass.getuser(),
+            'host': socket.gethostname(),
+            'pid': os.getpid(),
+            'acquired': datetime.now().isoformat(timespec='seconds')
+        }
+        try:
+            fd = os.open(self.path, os.O_CREAT | os.O_EXCL | os.O_WRONLY)
+        except FileExistsError:
+            return False
+        with os.fdopen(fd, 'w', encoding='utf-8') as f:
+            json.dump(info, f)
+            f.flush()
+            os.fsync(f.fileno())
+        self.token = token
+        return True
+
+    def break_stale(self, info, mtime):
+        """Move a stale lock aside, putting it back if it was replaced meanwhile"""
+        # Only break the very lock that was judged stale, heartbeat included
+        if self.read_holder() != (info, mtime):
+            return
+        aside = f"{self.path}.stale-{uuid.uuid4().hex}"
+        try:
+            os.rename(self.path, aside)
+        except OSError:
+            return
+        try:
+            with open(aside, 'r', encoding='utf-8') as f:
+                moved = json.load(f)
+        except (OSError, ValueError):
+            moved = {}
+        if moved.get('token') != info.get('token'):
+            # Someone else broke the stale lock and took it first; give theirs back.
+            # link fails if a third process took the path meanwhile: the lock we
+            # moved is then lost, and its holder finds out through still_held()
+            try:
+                os.link(aside, self.path)
+            except OSError:
+                pass
+        try:
+            os.remove(aside)
+        except OSError:
+            pass
+
+    def acquire(self, timeout, on_wait=None):
+        """Wait up to timeout seconds for the lock.
+
+        on_wait(holder description) is called once when the lock is busy.
+        Raises LockTimeout naming the holder if the wait runs out.
+        """
+        deadline = time.monotonic() + timeout
+        delay = self.POLL_SECONDS
+        watched = None  # (token, mtime, local time first seen) of the lock we're waiting on
+        reported = False
+        while True:
+            if self.try_create():
+                self.stop_heartbeat.clear()
+                self.heartbeat = threading.Thread(target=self.heartbeat_loop, daemon=True)
+                self.heartbeat.start()
+                return
+
+            info, mtime = self.read_holder()
+            if info is None:
+                # Released between our attempt and the read; try again right away
+                continue
+            now = time.monotonic()
+            key = (info.get('token'), mtime)
+            if watched is None or watched[:2] != key:
+                watched = key + (now,)
+            dead_holder = (info.get('host') == socket.gethostname() and 'pid' in info
+                           and not process_alive(info['pid']))
+            if dead_holder or now - watched[2] > self.STALE_SECONDS:
+                self.break_stale(info, mtime)
+                continue
+            if not reported and on_wait is not None:
+                on_wait(describe_holder(info))
+                reported = True
+
+            if time.monotonic() >= deadline:
+                raise LockTimeout(f"{os.path.basename(self.path)} is held by {describe_holder(info)}")
+            # Jitter keeps several waiters from retrying in lockstep
+            time.sleep(delay * random.uniform(0.5, 1.5))
+            delay = min(delay * 1.5, self.MAX_POLL_SECONDS)
+
+    def check_token(self, touch=False):
+        """True if the lock file is ours, False if it is gone or someone else's.
+
+        With touch, refreshes the heartbeat of exactly the file that was
+        checked. Other read errors (a network share hiccup) are raised.
+        """
+        try:
+            with open(self.path, 'r', encoding='utf-8') as f:
+                try:
+                    info = json.load(f)
+                except ValueError:
+                    return False
+                if not isinstance(info, dict) or info.get('token') != self.token:
+                    return False
+                if touch:
+                    os.utime(f.fileno() if os.utime in os.supports_fd else self.path)
+        except FileNotFoundError:
+            return False
+        return True
+
+    def still_held(self):
+        """Whether this process still holds the lock; an unreadable lock file counts as lost"""
+        try:
+            return self.token is not None and self.check_token()
+        except OSError:
+            return False
+
+    def heartbeat_loop(self):
+        while not self.stop_heartbeat.wait(self.HEARTBEAT_SECONDS):
+            try:
+                if not self.check_token(touch=True):
+                    # Broken as stale; whatever is at the path now isn't ours to keep alive
+                    return
+            except OSError:
+                pass
+
+    def release(self):
+        self.stop_heartbeat.set()
+        if self.heartbeat is not None:
+            self.heartbeat.join()
+            self.heartbeat = None
+        info, _ = self.read_holder()
+        # Only remove the file if it is still ours (it may have been broken as stale)
+        if info and info.get('token') == self.token:
+            try:
+                os.remove(self.path)
+            except OSError:
+                pass
+        self.token = None
@@ -0,0 +1,316 @@
+"""Fast-path writer that patches numeric cells directly inside an xlsx file.
+
+Only the worksheet XML part holding the target cells (and workbook.xml, to ask
+Excel to recalculate on open) is rewritten. Every other zip member is copied
+over as raw compressed bytes, so save time depends on the number of changed
+cells and the size of one sheet part rather than on the whole workbook.
+
+Anything unusual (missing cells, text or formula cells, zip64 or encrypted
+archives) raises PatchNotSupported so the caller can fall back to openpyxl.
+"""
+import os
+import re
+import shutil
+import struct
+import tempfile
+import zipfile
+import zlib
+import posixpath
+import xml.etree.ElementTree as ET
+
+LOCAL_HEADER_SIG = b'PK\x03\x04'
+CENTRAL_HEADER_SIG = b'PK\x01\x02'
+END_OF_DIR_SIG = b'PK\x05\x06'
+DATA_DESCRIPTOR_SIG = b'PK\x07\x08'
+
+NS_MAIN = 'http://schemas.openxmlformats.org/spreadsheetml/2006/main'
+NS_REL = 'http://schemas.openxmlformats.org/officeDocument/2006/relationships'
+NS_PKG_REL = 'http://schemas.openxmlformats.org/package/2006/relationships'
+
+# Workbook children that come after calcPr in the schema's sequence
+CALC_PR_FOLLOWERS = (b'oleSize', b'customWorkbookViews', b'pivotCaches', b'smartTagPr', b'smartTagTypes',
+                     b'webPublishing', b'fileRecoveryPr', b'webPublishObjects', b'extLst')
+
+
+class PatchNotSupported(Exception):
+    """The workbook can't be patched in place; use the full openpyxl save instead"""
+
+
+def column_letter(col):
+    """Convert a 1-based column index to its letter (1 -> A, 28 -> AB)"""
+    letters = ''
+    while col > 0:
+        col, remainder = divmod(col - 1, 26)
+        letters = chr(65 + remainder) + letters
+    return letters
+
+
+def format_number(value):
+    """Write numbers the way Excel stores them: no trailing .0 on integers"""
+    if isinstance(value, float) and value.is_integer():
+        return str(int(value))
+    return repr(value)
+
+
+def parse_number(text):
+    try:
+        return int(text)
+    except ValueError:
+        return float(text)
+
+
+def find_sheet_part(zf, sheet_name):
+    """Return the zip member name of the worksheet called sheet_name"""
+    workbook = ET.fromstring(zf.read('xl/workbook.xml'))
+    rel_id = None
+    for sheet in workbook.iter(f'{{{NS_MAIN}}}sheet'):
+        if sheet.get('name') == sheet_name:
+            rel_id = sheet.get(f'{{{NS_REL}}}id')
+            break
+    if rel_id is None:
+        raise PatchNotSupported(f"Sheet '{sheet_name}' not found")
+
+    rels = ET.fromstring(zf.read('xl/_rels/workbook.xml.rels'))
+    for rel in rels.iter(f'{{{NS_PKG_REL}}}Relationship'):
+        if rel.get('Id') == rel_id:
+            target = rel.get('Target')
+            if target.startswith('/'):
+                return target.lstrip('/')
+            return posixpath.normpath(posixpath.join('xl', target))
+    raise PatchNotSupported(f"Relationship {rel_id} for '{sheet_name}' not found")
+
+
+def patch_sheet_xml(xml, deltas):
+    """Add deltas to the numeric cells of a worksheet part in a single pass.
+
+    deltas maps a cell reference such as "BK5" to the amount to add. Returns
+    the new XML and a dict of ref -> (old value, new value).
+    """
+    refs = '|'.join(re.escape(ref) for ref in deltas)
+    cell_start = re.compile(rf'<c\b[^>]*?\br="({refs})"[^>]*?(/?)>'.encode())
+    value_pattern = re.compile(rb'<v>([^<]*)</v>')
+    type_pattern = re.compile(rb'\bt="([^"]*)"')
+
+    pieces = []
+    changes = {}
+    position = 0
+    for match in cell_start.finditer(xml):
+        ref = match.group(1).decode()
+        if ref in changes:
+            raise PatchNotSupported(f"Cell {ref} appears more than once")
+        start_tag = match.group(0)
+        self_closing = match.group(2) == b'/'
+
+        if self_closing:
+            end = match.end()
+            body = b''
+        else:
+            end = xml.find(b'</c>', match.end())
+            if end < 0:
+                raise PatchNotSupported(f"Cell {ref} is not closed")
+            body = xml[match.end():end]
+            end += len(b'</c>')
+
+        cell_type = type_pattern.search(start_tag)
+        if cell_type and cell_type.group(1) != b'n':
+            raise PatchNotSupported(f"Cell {ref} holds non-numeric data")
+        if b'<f' in body:
+            raise PatchNotSupported(f"Cell {ref} holds a formula")
+
+        value = value_pattern.search(body)
+        old_value = parse_number(value.group(1).decode()) if value else None
+        new_value = deltas[ref] if old_value is None else old_value + deltas[ref]
+        changes[ref] = (old_value, new_value)
+
+        # Keep every attribute except the type, which stays numeric by default
+        attributes = type_pattern.sub(b'', start_tag[:-2] if self_closing else start_tag[:-1])
+        new_cell = attributes.rstrip() + b'><v>' + format_number(new_value).encode() + b'</v></c>'
+        pieces.append(xml[position:match.start()])
+        pieces.append(new_cell)
+        position = end
+
+    missing = set(deltas) - set(changes)
+    if missing:
+        raise PatchNotSupported(f"Cells not present in sheet XML: {', '.join(sorted(missing))}")
+
+    pieces.append(xml[position:])
+    return b''.join(pieces), changes
+
+
+def request_full_calc(xml):
+    """Set fullCalcOnLoad so Excel recalculates formulas that use patched cells.
+
+    Returns the new workbook.xml, or None when it already asks for a full
+    recalculation. A workbook without <calcPr> gets one in schema order.
+    """
+    root = re.search(rb'<(?:([A-Za-z_][\w.-]*):)?workbook\b', xml)
+    if root is None:
+        raise PatchNotSupported("workbook.xml has no workbook element")
+    prefix = root.group(1) + b':' if root.group(1) else b''
+
+    match = re.search(rb'<' + re.escape(prefix) + rb'calcPr\b[^>]*?/?>', xml)
+    if match is None:
+        # calcPr comes after sheets/definedNames and before everything in CALC_PR_FOLLOWERS
+        following = re.search(rb'<' + re.escape(prefix) + rb'(?:' + b'|'.join(CALC_PR_FOLLOWERS) + rb')\b|</'
+                              + re.escape(prefix) + rb'workbook>', xml)
+        if following is None:
+            raise PatchNotSupported("workbook.xml has no place for calcPr")
+        tag = b'<' + prefix + b'calcPr fullCalcOnLoad="1"/>'
+        return xml[:following.start()] + tag + xml[following.start():]
+
+    tag = match.group(0)
+    current = re.search(rb'\sfullCalcOnLoad="([^"]*)"', tag)
+    if current is not None:
+        if current.group(1) in (b'1', b'true'):
+            return None
+        new_tag = tag[:current.start(1)] + b'1' + tag[current.end(1):]
+    else:
+        closing = b'/>' if tag.endswith(b'/>') else b'>'
+        new_tag = tag[:-len(closing)].rstrip() + b' fullCalcOnLoad="1"' + closing
+    return xml[:match.start()] + new_tag + xml[match.end():]
+
+
+def read_end_of_directory(f, file_size):
+    """Locate the central directory, returning (offset, size, entry count, comment)"""
+    tail_size = min(file_size, 65536 + 22)
+    f.seek(file_size - tail_size)
+    tail = f.read(tail_size)
+    index = tail.rfind(END_OF_DIR_SIG)
+    if index < 0:
+        raise PatchNotSupported("Not a zip file")
+    (_, disk, cd_disk, disk_entries, entries, cd_size, cd_offset,
+     comment_len) = struct.unpack('<4s4H2LH', tail[index:index + 22])
+    if disk != 0 or cd_disk != 0 or disk_entries != entries:
+        raise PatchNotSupported("Multi-disk archives are not supported")
+    if entries == 0xFFFF or cd_size == 0xFFFFFFFF or cd_offset == 0xFFFFFFFF:
+        raise PatchNotSupported("Zip64 archives are not supported")
+    comment = tail[index + 22:index + 22 + comment_len]
+    return cd_offset, cd_size, entries, comment
+
+
+def rewrite_zip(src_path, dest_path, replacements):
+    """Copy a zip member-by-member, replacing the content of some members.
+
+    Unchanged members are copied as raw compressed bytes; replaced members
+    are deflated and their headers updated.
+    """
+    with open(src_path, 'rb') as src, open(dest_path, 'wb') as dest:
+        file_size = os.fstat(src.fileno()).st_size
+        cd_offset, cd_size, entries, comment = read_end_of_directory(src, file_size)
+        src.seek(cd_offset)
+        central = src.read(cd_size)
+
+        new_central = []
+        position = 0
+        for _ in range(entries):
+            if central[position:position + 4] != CENTRAL_HEADER_SIG:
+                raise PatchNotSupported("Corrupt central directory")
+            header = bytearray(central[position:position + 46])
+            name_len, extra_len, comment_len = struct.unpack('<3H', header[28:34])
+            entry_end = position + 46 + name_len + extra_len + comment_len
+            name_bytes = central[position + 46:position + 46 + name_len]
+            entry_tail = central[position + 46:entry_end]
+            position = entry_end
+
+            flags = struct.unpack('<H', header[8:10])[0]
+            compress_size, file_size_field = struct.unpack('<2L', header[20:28])
+            local_offset = struct.unpack('<L', header[42:46])[0]
+            if flags & 0x1:
+                raise PatchNotSupported("Encrypted archives are not supported")
+            if 0xFFFFFFFF in (compress_size, file_size_field, local_offset):
+                raise PatchNotSupported("Zip64 archives are not supported")
+
+            src.seek(local_offset)
+            local = bytearray(src.read(30))
+            if local[:4] != LOCAL_HEADER_SIG:
+                raise PatchNotSupported("Corrupt local file header")
+            local_name_len, local_extra_len = struct.unpack('<2H', local[26:30])
+            local_rest = src.read(local_name_len + local_extra_len)
+
+            new_offset = dest.tell()
+            name = name_bytes.decode('utf-8' if flags & 0x800 else 'cp437')
+            if name in replacements:
+                data = replacements[name]
+                compressor = zlib.compressobj(6, zlib.DEFLATED, -15)
+                compressed = compressor.compress(data) + compressor.flush()
+                crc = zlib.crc32(data)
+                new_flags = flags & ~0x8  # sizes are known up front, no data descriptor
+                struct.pack_into('<2H', local, 6, new_flags, zipfile.ZIP_DEFLATED)
+                struct.pack_into('<3L', local, 14, crc, len(compressed), len(data))
+                dest.write(local)
+                dest.write(local_rest)
+                dest.write(compressed)
+                struct.pack_into('<2H', header, 8, new_flags, zipfile.ZIP_DEFLATED)
+                struct.pack_into('<3L', header, 16, crc, len(compressed), len(data))
+            else:
+                dest.write(local)
+                dest.write(local_rest)
+                remaining = compress_size
+                while remaining:
+                    chunk = src.read(min(remaining, 1024 * 1024))
+                    if not chunk:
+                        raise PatchNotSupported("Truncated zip member")
+                    dest.write(chunk)
+                    remaining -= len(chunk)
+                if flags & 0x8:
+                    descriptor = src.read(16)
+                    length = 16 if descriptor[:4] == DATA_DESCRIPTOR_SIG else 12
+                    dest.write(descriptor[:length])
+
+            struct.pack_into('<L', header, 42, new_offset)
+            new_central.append(bytes(header) + entry_tail)
+
+        new_cd_offset = dest.tell()
+        central_bytes = b''.join(new_central)
+        dest.write(central_bytes)
+        dest.write(struct.pack('<4s4H2LH', END_OF_DIR_SIG, 0, 0, entries, entries,
+                               len(central_bytes), new_cd_offset, len(comment)))
+        dest.write(comment)
+
+
+def patch_cells(file_path, sheet_name, deltas, before_replace=None):
+    """Add deltas to numeric cells of sheet_name, rewriting only what changed.
+
+    deltas maps (row, col) to the amount to add. Returns a dict of
+    (row, col) -> (old value, new value). The file is replaced atomically;
+    before_replace(stat) gets the new file's os.stat just before that.
+    """
+    if not deltas:
+        return {}
+    by_ref = {f"{column_letter(col)}{row}": (row, col) for row, col in deltas}
+
+    before = os.stat(file_path)
+    try:
+        with zipfile.ZipFile(file_path) as zf:
+            sheet_part = find_sheet_part(zf, sheet_name)
+            sheet_xml = zf.read(sheet_part)
+            workbook_xml = zf.read('xl/workbook.xml')
+    except (zipfile.BadZipFile, KeyError) as e:
+        raise PatchNotSupported(str(e))
+
+    new_sheet_xml, ref_changes = patch_sheet_xml(
+        sheet_xml, {ref: deltas[cell] for ref, cell in by_ref.items()}
+    )
+    replacements = {sheet_part: new_sheet_xml}
+    new_workbook_xml = request_full_calc(workbook_xml)
+    if new_workbook_xml is not None:
+        replacements['xl/workbook.xml'] = new_workbook_xml
+
+    directory = os.path.dirname(os.path.abspath(file_path))
+    fd, temp_path = tempfile.mkstemp(suffix='.xlsx', dir=directory)
+    os.close(fd)
+    try:
+        rewrite_zip(file_path, temp_path, replacements)
+        shutil.copymode(file_path, temp_path)
+        after = os.stat(file_path)
+        if (after.st_mtime_ns, after.st_size) != (before.st_mtime_ns, before.st_size):
+            # Someone saved the workbook meanwhile; let the caller reload instead
+            raise PatchNotSupported("Workbook changed while it was being patched")
+        if before_replace is not None:
+            before_replace(os.stat(temp_path))
+        os.replace(temp_path, file_path)
+    except BaseException:
+        os.remove(temp_path)
+        raise
+
+    return {by_ref[ref]: change for ref, change in ref_changes.items()}
@@ -0,0 +1,201 @@
+"""Throughput benchmark for the copy engine, with folders standing in for drives.
+
+For each file-size mix and drive count it generates a source tree, copies
+it the way a job does (folder walk, fan-out, small-file batches) and reports
+wall time, aggregate and per-drive MB/s, CPU time, read/write-type syscalls
+and context switches. The drives are fresh temporary folders under --root
+(point it at a tmpfs or loop-mounted FAT image to take the system disk out
+of the picture), or folders on real drives given with --target. --throttle
+caps each stand-in drive's write rate to act like a slow stick.
+
+    python bench.py --mix small,mixed,large --drives 1,2,4 --size 256
+    python bench.py --root /mnt/fat-loop --throttle 15 --verify --json
+
+Sources are dropped from the page cache before each run so they are read
+from disk as in a real copy; --warm keeps them cached to measure the
+engine alone. Syscalls are the read and write-type ones the kernel counts
+in /proc/self/io (copy_file_range and sendfile included), Linux only.
+"""
+import argparse
+import json
+import os
+import random
+import resource
+import shutil
+import tempfile
+import time
+
+import sources
+from copy_engine import FanOutCopier, METHODS, advise, format_size
+
+MIB = 1024 * 1024
+# File sizes of each mix, as (smallest, largest, share of the bytes)
+MIXES = {
+    'large': [(64 * MIB, 64 * MIB, 1.0)],
+    'mixed': [(8 * MIB, 32 * MIB, 0.5), (256 * 1024, MIB, 0.25), (4 * 1024, 64 * 1024, 0.25)],
+    'small': [(1024, 64 * 1024, 1.0)],
+}
+FILES_PER_FOLDER = 100
+
+
+class ThrottledCopier(FanOutCopier):
+    """A copier whose drives take no more than throttle bytes/s each"""
+
+    def __init__(self, targets, throttle, **options):
+        super().__init__(targets, **options)
+        self.throttle = throttle
+
+    def write_chunk(self, target, current, chunk):
+        super().write_chunk(target, current, chunk)
+        # Hold the writer until what it has written fits the rate
+        ahead = target.bytes_written / self.throttle - (time.monotonic() - target.started)
+        if ahead > 0:
+            time.sleep(ahead)
+
+
+def make_source(folder, mix, total_bytes, seed=0):
+    """Write a tree of random files with the mix's sizes; returns (file count, bytes)"""
+    rng = random.Random(seed)
+    count = 0
+    written = 0
+    for smallest, largest, share in MIXES[mix]:
+        budget = int(total_bytes * share)
+        while budget > 0:
+            size = min(rng.randint(smallest, largest), budget)
+            directory = os.path.join(folder, f"d{count // FILES_PER_FOLDER:04d}")
+            if count % FILES_PER_FOLDER == 0:
+                os.makedirs(directory, exist_ok=True)
+            with open(os.path.join(directory, f"f{count:06d}.bin"), 'wb') as f:
+                f.write(rng.randbytes(size))
+            count += 1
+            written += size
+            budget -= size
+    return count, written
+
+
+def drop_cached(folder):
+    """Evict the source tree from the page cache; needs no privileges for clean pages"""
+    if hasattr(os, 'sync'):
+        os.sync()
+    for directory, _, names in os.walk(folder):
+        for name in names:
+            fd = os.open(os.path.join(directory, name), os.O_RDONLY)
+            try:
+                advise(fd, 0, 0, 'POSIX_FADV_DONTNEED')
+            finally:
+                os.close(fd)
+
+
+def syscalls():
+    """Read and write-type syscalls made by this process so far, or None off Linux"""
+    try:
+        with open('/proc/self/io', 'r') as f:
+            counts = dict(line.split(': ') for line in f.read().splitlines())
+        return int(counts['syscr']) + int(counts['syscw'])
+    except (OSError, KeyError, ValueError):
+        return None
+
+
+def run_once(source, targets, args):
+    options = dict(method=args.method, verify=args.verify, sync=args.sync, chunk_size=args.chunk_size)
+    if args.throttle:
+        copier = ThrottledCopier(targets, args.throttle * 1e6, **options)
+    else:
+        copier = FanOutCopier(targets, **options)
+    if not args.warm:
+        drop_cached(source)
+    usage = resource.getrusage(resource.RUSAGE_SELF)
+    calls = syscalls()
+    begun = time.monotonic()
+    entries = sources.list_ahead(sources.iter_sources([source]), on_entry=lambda entry: copier.expect(entry.size or 0))
+    copier.start()
+    try:
+        copier.copy_many(entries)
+    finally:
+        entries.close()
+        summaries = copier.finish()
+    seconds = time.monotonic() - begun
+    after = resource.getrusage(resource.RUSAGE_SELF)
+    calls_after = syscalls()
+    written = sum(summary['bytes_written'] for summary in summaries)
+    return {
+        'seconds': round(seconds, 3),
+        'aggregate_mb_per_s': round(written / seconds / 1e6, 2),
+        'per_target_mb_per_s': [summary['mb_per_s'] for summary in summaries],
+        'methods': sorted({summary['method'] for summary in summaries}),
+        'cpu_user': round(after.ru_utime - usage.ru_utime, 3),
+        'cpu_system': round(after.ru_stime - usage.ru_stime, 3),
+        'syscalls': calls_after - calls if calls is not None and calls_after is not None else None,
+        'context_switches': (after.ru_nvcsw - usage.ru_nvcsw) + (after.ru_nivcsw - usage.ru_nivcsw),
+        'files_failed': sum(summary['files_failed'] for summary in summaries),
+    }
+
+
+def drive_folders(args, count, work):
+    """count fresh folders to act as drives, on the given targets or under the scratch root"""
+    if args.target:
+        return [os.path.join(target, f"ironclad-bench-{os.getpid()}") for target in args.target[:count]]
+    return [os.path.join(work, f"drive{n}") for n in range(count)]
+
+
+def print_row(result):
+    per_target = ", ".join(f"{rate}" for rate in result['per_target_mb_per_s'])
+    print(f"{result['mix']:>6} {result['drives']:>3} drive(s)  {result['seconds']:8.2f} s  "
+          f"{result['aggregate_mb_per_s']:8.1f} MB/s total  [{per_target}]  "
+          f"cpu {result['cpu_user']:.2f}u {result['cpu_system']:.2f}s  "
+          f"syscalls {result['syscalls']}  ctx {result['context_switches']}"
+          + (f"  FAILED {result['files_failed']}" if result['files_failed'] else ""))
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark the copy engine against stand-in drives")
+    parser.add_argument('--mix', default='small,mixed,large', help=f"Comma separated, of: {', '.join(MIXES)}")
+    parser.add_argument('--drives', default='1,2,4', help="Comma separated drive counts")
+    parser.add_argument('--size', type=int, default=256, help="MB of source data per mix")
+    parser.add_argument('--root', help="Where to put the source and stand-in drives (default: the temp folder)")
+    parser.add_argument('--target', action='append',
+                        help="A real drive to write to instead; repeat for more (a scratch folder is used on each)")
+    parser.add_argument('--throttle', type=float, help="Cap each drive at this many MB/s")
+    parser.add_argument('--method', default='auto', choices=METHODS)
+    parser.add_argument('--chunk-size', type=int, help="Bytes per chunk")
+    parser.add_argument('--verify', action='store_true')
+    parser.add_argument('--sync', action='store_true', help="Sync mode (each run starts from empty drives)")
+    parser.add_argument('--warm', action='store_true', help="Leave the sources in the page cache")
+    parser.add_argument('--json', action='store_true', help="Print one JSON line per run")
+    args = parser.parse_args()
+
+    mixes = args.mix.split(',')
+    counts = [int(count) for count in args.drives.split(',')]
+    unknown = [mix for mix in mixes if mix not in MIXES]
+    if unknown:
+        parser.error(f"unknown mix: {', '.join(unknown)}")
+    if args.target and max(counts) > len(args.target):
+        parser.error(f"{max(counts)} drives asked for but only {len(args.target)} --target given")
+
+    work = tempfile.mkdtemp(prefix='ironclad-bench-', dir=args.root)
+    try:
+        for mix in mixes:
+            source = os.path.join(work, 'source', mix)
+            files, size = make_source(source, mix, args.size * MIB)
+            if not args.json:
+                print(f"{mix}: {files} files, {format_size(size)}")
+            for count in counts:
+                targets = drive_folders(args, count, work)
+                for target in targets:
+                    os.makedirs(target)
+                try:
+                    result = {'mix': mix, 'drives': count, 'files': files, 'bytes': size, **run_once(source, targets, args)}
+                finally:
+                    for target in targets:
+                        shutil.rmtree(target, ignore_errors=True)
+                if args.json:
+                    print(json.dumps(result), flush=True)
+                else:
+                    print_row(result)
+            shutil.rmtree(source, ignore_errors=True)
+    finally:
+        shutil.rmtree(work, ignore_errors=True)
+
+
+if __name__ == "__main__":
+    main()
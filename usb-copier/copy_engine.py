@@ -0,0 +1,1176 @@
+"""Copy a set of files onto many drives at once, reading each source file only once.
+
+The reader thread reads a source file in large chunks and hands every chunk
+to one writer thread per target drive. All writers share the same chunk, and
+the chunk is released once the last of them has written it. The reader can
+only run a few chunks ahead of the slowest drive, so memory stays bounded
+however many drives there are, and a batch takes as long as the slowest
+stick rather than the sum of all of them.
+
+How chunks travel from the source to the drives depends on the method:
+    copy_file_range  Linux: the kernel copies each range from the page cache
+                     to the drive with no copy through Python. A writer falls
+                     back to sendfile, then to pread, when its filesystem
+                     refuses.
+    sendfile         Linux: as above, starting at sendfile
+    mmap             the source is mapped and writers write slices of the map
+    buffer           the reader fills buffers from a small reusable pool
+'auto' picks copy_file_range where the os module has it, otherwise buffer.
+The source is read with sequential readahead, and its pages are dropped
+from the page cache once every drive has written them. Each drive can have
+its own write size (the bytes per write or copy call).
+
+With verify on, the reader hashes every chunk as it goes, so the source is
+hashed once whatever the number of drives. A file's hash is the hash of its
+chunk hashes, so a range of it can be checked on its own. Each writer fsyncs
+a finished file, drops it from the page cache and reads it back to compare
+hashes, all drives in parallel. A mismatch rewrites the file from the
+source and checks again, up to VERIFY_RETRIES times.
+
+Files are written under a temporary name and renamed into place once they
+are complete and synced, so a drive pulled mid-copy never holds a truncated
+file under the real name. With sync on, each drive keeps a manifest (see
+manifest.py) of what it holds: a file whose copy is current is skipped
+without reading the source, a copy whose source was only touched gets the
+new time, and a large file that was interrupted carries on from its last
+checkpointed chunk that still reads back correctly.
+
+schedule() orders a batch largest file first, so the long copies start
+early and the tail is made of small files. While copying, a monitor thread
+measures each drive's write rate, from the device's own counters where
+sysfs has them so the page cache doesn't flatter it, and progress() reports
+rate, share done and ETA per drive. At most hub_writers drives on one USB
+hub write at a time; a free slot goes to the drive with the most left to
+write.
+
+Many small files cost more in per-file overhead than in bytes, above all on
+FAT sticks. copy_many() starts readahead on the next few small sources
+while the current one is sent, writers remember the directories they have
+made, and small files are written, closed and set aside in batches: one
+sync of the drive's filesystem (syncfs on Linux) makes a whole batch
+durable before its files are checked and renamed, instead of an fsync each.
+
+A drive that disappears, keeps failing, or has work in hand but writes
+nothing for stall_seconds is dropped; the others carry on.
+"""
+import ctypes
+import errno
+import hashlib
+import mmap
+import os
+import queue
+import sys
+import threading
+import time
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import contextmanager
+
+import drive_info
+from manifest import Manifest
+
+OPEN, DATA, CLOSE, ABORT, STOP, MKDIR = range(6)
+PART_SUFFIX = '.ironclad-part'  # Temporary name of a file until it is complete
+METHODS = ('auto', 'copy_file_range', 'sendfile', 'mmap', 'buffer')
+# Order a writer falls back through when the kernel refuses a zero-copy call
+KERNEL_FALLBACKS = ('copy_file_range', 'sendfile', 'pread')
+# Errors that mean the drive itself is unusable, not just this file
+DRIVE_ERRNOS = {getattr(errno, name) for name in ('EIO', 'ENODEV', 'ENXIO', 'EROFS', 'ENOSPC')
+                if hasattr(errno, name)}
+# Errors that mean a zero-copy call isn't supported between these two files
+UNSUPPORTED_ERRNOS = {getattr(errno, name) for name in ('EXDEV', 'ENOSYS', 'EINVAL', 'EOPNOTSUPP', 'ENOTSUP')
+                      if hasattr(errno, name)}
+
+
+def load_syncfs():
+    if not sys.platform.startswith('linux'):
+        return None
+    try:
+        return ctypes.CDLL(None, use_errno=True).syncfs
+    except (OSError, AttributeError):
+        return None
+
+
+SYNCFS = load_syncfs()
+
+
+def sync_files(root, paths):
+    """Make closed files under root durable: one syncfs() for the drive where Linux has it, else an fsync each"""
+    if SYNCFS is not None:
+        fd = os.open(root, os.O_RDONLY)
+        try:
+            if SYNCFS(fd) != 0:
+                error = ctypes.get_errno()
+                raise OSError(error, os.strerror(error))
+        finally:
+            os.close(fd)
+        return
+    for path in paths:
+        fd = os.open(path, os.O_RDWR | getattr(os, 'O_BINARY', 0))
+        try:
+            os.fsync(fd)
+        finally:
+            os.close(fd)
+
+
+def default_method():
+    if sys.platform.startswith('linux') and hasattr(os, 'copy_file_range'):
+        return 'copy_file_range'
+    return 'buffer'
+
+
+def advise(fd, offset, length, advice_name):
+    """posix_fadvise where the platform has it; a hint, so failures are ignored"""
+    advice = getattr(os, advice_name, None)
+    if advice is None or not hasattr(os, 'posix_fadvise'):
+        return
+    try:
+        os.posix_fadvise(fd, offset, length, advice)
+    except OSError:
+        pass
+
+
+def read_into(fd, buffer):
+    """Read from fd's position into buffer, returning the byte count"""
+    if hasattr(os, 'readv'):
+        return os.readv(fd, [buffer])
+    data = os.read(fd, len(buffer))
+    buffer[:len(data)] = data
+    return len(data)
+
+
+def read_full(fd, buffer):
+    """Fill buffer from fd, short only at the end of the file; returns the byte count"""
+    view = memoryview(buffer)
+    filled = 0
+    try:
+        while filled < len(buffer):
+            length = read_into(fd, view[filled:])
+            if not length:
+                break
+            filled += length
+    finally:
+        view.release()
+    return filled
+
+
+def chunk_digests(fd, hash_name, buffer, limit=None, on_read=None):
+    """Yield the hash of each buffer-sized chunk of fd from its position, at most limit of them"""
+    view = memoryview(buffer)
+    try:
+        while limit is None or limit > 0:
+            length = read_full(fd, buffer)
+            if not length:
+                break
+            if on_read is not None:
+                on_read(length)
+            yield hashlib.new(hash_name, view[:length]).digest()
+            if length < len(buffer):
+                break
+            if limit is not None:
+                limit -= 1
+    finally:
+        view.release()
+
+
+def file_digest(path, hash_name, buffer, on_read=None, drop_cache=False):
+    """Hash of a file as the copier computes it: the hash of its chunk hashes.
+
+    drop_cache reads what is stored on the drive rather than what is cached
+    in memory, where the platform allows it (the file must be synced).
+    """
+    fd = os.open(path, os.O_RDONLY | getattr(os, 'O_BINARY', 0))
+    try:
+        if drop_cache:
+            advise(fd, 0, 0, 'POSIX_FADV_DONTNEED')
+        advise(fd, 0, 0, 'POSIX_FADV_SEQUENTIAL')
+        return hashlib.new(hash_name, b"".join(chunk_digests(fd, hash_name, buffer, on_read=on_read))).digest()
+    finally:
+        os.close(fd)
+
+
+def format_size(size):
+    return f"{size // (1024 * 1024)} MiB" if size >= 1024 * 1024 else f"{size // 1024} KiB"
+
+
+class HubSlots:
+    """Lets at most limit drives per hub write at once; a freed slot goes to the
+    waiting drive with the most left to write"""
+
+    WAIT = 0.5  # Seconds between checks for a waiter's drive having been dropped
+
+    def __init__(self, limit, remaining):
+        self.limit = limit
+        self.remaining = remaining  # target -> bytes it has left
+        self.cond = threading.Condition()
+        self.writing = {}  # hub -> targets holding a slot
+        self.waiting = {}  # hub -> targets wanting one
+
+    def acquire(self, target):
+        if not self.limit or target.hub is None:
+            return
+        with self.cond:
+            writing = self.writing.setdefault(target.hub, set())
+            waiting = self.waiting.setdefault(target.hub, set())
+            waiting.add(target)
+            try:
+                while target.dead is None:
+                    if len(writing) < self.limit and target is self.first(waiting):
+                        writing.add(target)
+                        return
+                    self.cond.wait(self.WAIT)
+            finally:
+                waiting.discard(target)
+
+    def first(self, waiting):
+        return max((target for target in waiting if target.dead is None), key=self.remaining, default=None)
+
+    def release(self, target):
+        if not self.limit or target.hub is None:
+            return
+        with self.cond:
+            # Also called for a dropped drive whose writer may still be stuck holding the slot
+            self.writing.get(target.hub, set()).discard(target)
+            self.cond.notify_all()
+
+
+class SourceFile:
+    """An open source file, closed once every writer that got it is done with it"""
+
+    def __init__(self, path, method):
+        self.path = path
+        self.fd = os.open(path, os.O_RDONLY | getattr(os, 'O_BINARY', 0))
+        self.stat = os.fstat(self.fd)
+        self.map = None
+        if method == 'mmap' and self.stat.st_size:
+            self.map = mmap.mmap(self.fd, 0, access=mmap.ACCESS_READ)
+        self.refs = 0
+        self.lock = threading.Lock()
+        advise(self.fd, 0, 0, 'POSIX_FADV_SEQUENTIAL')
+
+    def acquire(self, count):
+        with self.lock:
+            self.refs += count
+
+    def release(self):
+        with self.lock:
+            self.refs -= 1
+            if self.refs > 0:
+                return
+        if self.map is not None:
+            self.map.close()
+        os.close(self.fd)
+
+
+class Chunk:
+    """One piece of a source file, shared by every writer it is sent to"""
+
+    def __init__(self, source, offset, length, data=None, on_release=None):
+        self.source = source
+        self.offset = offset
+        self.length = length
+        self.data = data  # memoryview of the bytes, or None when writers copy in the kernel
+        self.digest = None  # Hash of the bytes, when hashing
+        self.on_release = on_release
+        self.refs = 0
+        self.lock = threading.Lock()
+
+    def release(self):
+        with self.lock:
+            self.refs -= 1
+            if self.refs > 0:
+                return
+        if self.data is not None:
+            self.data.release()
+        # Every drive has this range now, so the page cache needn't keep it
+        advise(self.source.fd, self.offset, self.length, 'POSIX_FADV_DONTNEED')
+        if self.on_release is not None:
+            self.on_release()
+        self.source.release()
+
+
+class TargetState:
+    """Progress and outcome of one target drive"""
+
+    def __init__(self, root, write_size):
+        self.root = root
+        self.write_size = write_size
+        self.method = None
+        self.queue = None
+        self.thread = None
+        self.dead = None  # Reason the drive was dropped
+        self.manifest = None  # Sync mode only
+        self.files_ok = 0
+        self.files_failed = 0
+        self.files_skipped = 0  # Already current on the drive, counted in files_ok too
+        self.files_resumed = 0
+        self.files_verified = 0
+        self.files_rewritten = 0  # Rewrites after a failed verification
+        self.bytes_written = 0
+        self.readback = None  # Buffer for verification reads, allocated on first use
+        self.started = None
+        self.finished = None
+        self.device = None  # sysfs block device, when there is one
+        self.hub = None
+        self.bytes_done = 0  # Of the batch: written, skipped as current, or given up on
+        self.bytes_checked = 0  # Read back for verification
+        self.rate = None  # Measured write rate, bytes/s
+        self.busy_since = None  # When the writer started on the I/O it is doing now
+        self.last_progress = None
+        self.failures_in_row = 0
+        self.batch = []  # Small files written and closed, waiting for one sync together
+        self.batch_bytes = 0
+        self.directories = set()  # Made on the drive already
+
+    def summary(self):
+        seconds = (self.finished or time.monotonic()) - (self.started or time.monotonic())
+        return {
+            'target': self.root,
+            'hub': self.hub,
+            'method': self.method,
+            'files_ok': self.files_ok,
+            'files_failed': self.files_failed,
+            'files_skipped': self.files_skipped,
+            'files_resumed': self.files_resumed,
+            'files_verified': self.files_verified,
+            'files_rewritten': self.files_rewritten,
+            'bytes_written': self.bytes_written,
+            'seconds': round(seconds, 3),
+            'mb_per_s': round(self.bytes_written / seconds / 1e6, 2) if seconds > 0 else None,
+            'dropped': self.dead
+        }
+
+
+class FanOutCopier:
+    CHUNK_SIZE = 8 * 1024 * 1024
+    QUEUE_CHUNKS = 8  # Chunks a writer may fall behind the reader
+    PUT_TIMEOUT = 0.5  # Seconds between checks for a dropped drive while the reader waits
+    HASH_NAME = 'blake2b'
+    VERIFY_RETRIES = 2  # Rewrites of a file that fails verification before giving up
+    CHECKPOINT_BYTES = 64 * 1024 * 1024  # Sync mode: bytes of a large file between resume points
+    HUB_WRITERS = 4  # Drives on one USB hub writing at once
+    STALL_SECONDS = 60
+    MAX_FAILURES_IN_ROW = 3  # Failed files in a row before a drive is dropped
+    MONITOR_INTERVAL = 1.0
+    RATE_SMOOTHING = 0.3  # Weight of the newest sample in the write rate
+    SMALL_FILE_BYTES = 1024 * 1024  # Files up to this size are synced in batches
+    BATCH_FILES = 64
+    BATCH_BYTES = 32 * 1024 * 1024
+    BATCH_SECONDS = 1.0  # Longest a written small file waits for the rest of its batch
+    LOOKAHEAD = 8  # Small sources whose readahead starts before their turn
+
+    def __init__(self, targets, chunk_size=None, queue_chunks=None, on_file_done=None, log=None,
+                 method='auto', write_sizes=None, verify=False, hash_name=None, sync=False,
+                 hub_writers=None, stall_seconds=None):
+        """targets are directory paths (drive roots); on_file_done(target, relative_path, error)
+        is called from the writer threads once per file and target, error None on success.
+        write_sizes maps a target to its bytes per write call (default: the chunk size).
+        With sync, files each target's manifest shows as current are skipped there.
+        hub_writers=0 lets every drive on a hub write at once."""
+        if method not in METHODS:
+            raise ValueError(f"Unknown copy method '{method}', use one of: {', '.join(METHODS)}")
+        self.verify = verify
+        self.sync = sync
+        self.hashing = verify or sync
+        self.hash_name = hash_name or self.HASH_NAME
+        hashlib.new(self.hash_name)  # Fail now on an unknown hash, not in the middle of a batch
+        self.method = default_method() if method == 'auto' else method
+        self.chunk_size = chunk_size or self.CHUNK_SIZE
+        self.queue_chunks = queue_chunks or self.QUEUE_CHUNKS
+        self.on_file_done = on_file_done
+        self.log = log
+        write_sizes = write_sizes or {}
+        self.targets = [TargetState(root, write_sizes.get(root) or self.chunk_size) for root in targets]
+        # Files on a dropped drive are counted from the reader thread as well
+        self.count_lock = threading.Lock()
+        # Reusable read buffers; waiting for a free one is what holds the reader back
+        self.buffers = None
+        if self.method == 'buffer':
+            self.buffers = queue.Queue()
+            for _ in range(self.queue_chunks + 1):
+                self.buffers.put(bytearray(self.chunk_size))
+        self.planner = None  # Threads reading back interrupted copies on several drives at once
+        self.total_bytes = 0  # Of the batch, per drive; set by schedule()
+        self.slots = HubSlots(self.HUB_WRITERS if hub_writers is None else hub_writers, self.remaining)
+        self.stall_seconds = stall_seconds or self.STALL_SECONDS
+        self.stopping = threading.Event()
+        self.monitor_thread = None
+
+    def log_message(self, message):
+        if self.log is not None:
+            self.log(message)
+
+    def start(self):
+        self.log_message(f"Copy path: {self.describe_method()}, {format_size(self.chunk_size)} chunks"
+                         + (f", verifying with {self.hash_name}" if self.verify else "")
+                         + (", syncing against each drive's manifest" if self.sync else ""))
+        for target in self.targets:
+            if self.sync:
+                try:
+                    target.manifest = Manifest(target.root, self.hash_name, self.chunk_size)
+                except OSError as e:
+                    self.drop(target, f"can't read its manifest ({e})")
+            target.device = drive_info.block_device(target.root)
+            target.hub = drive_info.hub_of(target.device) if target.device else None
+            target.method = self.method
+            target.queue = queue.Queue(maxsize=self.queue_chunks)
+            target.started = target.last_progress = time.monotonic()
+            target.thread = threading.Thread(target=self.writer_loop, args=(target,), daemon=True)
+            target.thread.start()
+        hubs = {}
+        for target in self.targets:
+            if target.hub is not None:
+                hubs[target.hub] = hubs.get(target.hub, 0) + 1
+        if hubs and self.slots.limit:
+            self.log_message(f"USB hubs: {', '.join(f'{hub} ({count} drives)' for hub, count in hubs.items())}; "
+                             f"at most {self.slots.limit} writing at once on each")
+        self.monitor_thread = threading.Thread(target=self.monitor, daemon=True)
+        self.monitor_thread.start()
+
+    def describe_method(self):
+        if self.method in KERNEL_FALLBACKS:
+            fallbacks = KERNEL_FALLBACKS[KERNEL_FALLBACKS.index(self.method) + 1:]
+            return f"{self.method} (falls back to {', '.join(fallbacks)})"
+        return self.method
+
+    def live_targets(self):
+        return [target for target in self.targets if target.dead is None]
+
+    def send(self, target, item):
+        """Queue an item for a writer, giving up if the drive is dropped meanwhile"""
+        while target.dead is None:
+            try:
+                target.queue.put(item, timeout=self.PUT_TIMEOUT)
+                return True
+            except queue.Full:
+                continue
+        return False
+
+    def plan(self, source_path, relative_path):
+        """What each target needs of a source: {target: (offset to write from, hashes of the chunks before it)}.
+
+        In sync mode, targets already holding a current copy are counted as
+        done here and left out.
+        """
+        if not self.sync:
+            return {target: (0, []) for target in self.targets}
+        stat = os.stat(source_path)
+        plans = {}
+        resumable = []
+        source_digest = None
+        for target in self.targets:
+            manifest = target.manifest
+            if target.dead is not None or manifest is None:
+                plans[target] = (0, [])
+                continue
+            entry = manifest.finished(relative_path)
+            if entry is not None and entry.get('size') == stat.st_size and self.stored_intact(target, relative_path, entry):
+                if entry.get('mtime_ns') == stat.st_mtime_ns:
+                    self.skip(target, relative_path, stat.st_size)
+                    continue
+                if entry.get('hash'):
+                    # Touched but maybe not changed: one read of the source settles it for every drive
+                    if source_digest is None:
+                        try:
+                            source_digest = file_digest(source_path, self.hash_name, bytearray(self.chunk_size))
+                        except OSError:
+                            source_digest = b""
+                    if entry['hash'] == source_digest.hex() and self.touch(target, relative_path, stat, source_digest):
+                        self.skip(target, relative_path, stat.st_size)
+                        continue
+            chunks = manifest.partial(relative_path, stat)
+            if chunks:
+                resumable.append((target, chunks))
+            else:
+                plans[target] = (0, [])
+
+        if len(resumable) > 1:
+            if self.planner is None:
+                self.planner = ThreadPoolExecutor(max_workers=len(self.targets))
+            points = list(self.planner.map(lambda item: self.resume_point(item[0], relative_path, item[1]),
+                                           resumable))
+        else:
+            points = [self.resume_point(target, relative_path, chunks) for target, chunks in resumable]
+        for (target, _), point in zip(resumable, points):
+            plans[target] = point
+        return plans
+
+    def stored_intact(self, target, relative_path, entry):
+        """Whether the copy on the drive is still the one the manifest recorded"""
+        try:
+            stored = os.stat(os.path.join(target.root, relative_path))
+        except OSError:
+            return False
+        return (stored.st_size, stored.st_mtime_ns) == (entry.get('stored_size'), entry.get('stored_mtime_ns'))
+
+    def touch(self, target, relative_path, stat, digest):
+        """Give an unchanged copy its source's new time instead of copying it again"""
+        path = os.path.join(target.root, relative_path)
+        try:
+            os.utime(path, ns=(stat.st_atime_ns, stat.st_mtime_ns))
+            target.manifest.record_file(relative_path, stat, digest, os.stat(path))
+        except OSError:
+            return False
+        return True
+
+    def resume_point(self, target, relative_path, chunks):
+        """(offset, chunk hashes) of the checkpointed start of an interrupted copy that still reads back intact"""
+        digests = []
+        try:
+            fd = os.open(os.path.join(target.root, relative_path) + PART_SUFFIX, os.O_RDONLY | getattr(os, 'O_BINARY', 0))
+        except OSError:
+            return 0, []
+        try:
+            stored = chunk_digests(fd, self.hash_name, bytearray(self.chunk_size), len(chunks))
+            for recorded, digest in zip(chunks, stored):
+                if digest.hex() != recorded:
+                    break
+                digests.append(digest)
+            stored.close()
+        except OSError:
+            pass
+        finally:
+            os.close(fd)
+        return len(digests) * self.chunk_size, digests
+
+    def skip(self, target, relative_path, size):
+        with self.count_lock:
+            target.files_skipped += 1
+            target.bytes_done += size
+        self.file_done(target, relative_path, None)
+
+    def read_chunks(self, source, start=0):
+        """Yield the source's chunks from offset start, their data filled according to the copy method"""
+        offset = start
+        size = source.stat.st_size
+        if start and source.map is None and self.method not in KERNEL_FALLBACKS:
+            os.lseek(source.fd, start, os.SEEK_SET)
+        while True:
+            if self.method in KERNEL_FALLBACKS:
+                # Writers copy straight from the file; just size the range and start readahead
+                length = min(self.chunk_size, max(size - offset, 0))
+                if not length:
+                    return
+                advise(source.fd, offset, length, 'POSIX_FADV_WILLNEED')
+                yield Chunk(source, offset, length)
+            elif source.map is not None:
+                length = min(self.chunk_size, size - offset)
+                if length <= 0:
+                    return
+                yield Chunk(source, offset, length, memoryview(source.map)[offset:offset + length])
+            else:
+                buffer = self.take_buffer() if self.buffers is not None else bytearray(self.chunk_size)
+                try:
+                    # Whole chunks, so chunk hashes line up with the ones read back later
+                    length = read_full(source.fd, buffer)
+                except OSError:
+                    length = None
+                    raise
+                finally:
+                    if not length and self.buffers is not None:
+                        self.buffers.put(buffer)
+                if not length:
+                    return
+                on_release = (lambda buffer=buffer: self.buffers.put(buffer)) if self.buffers is not None else None
+                yield Chunk(source, offset, length, memoryview(buffer)[:length], on_release)
+            offset += length
+
+    def take_buffer(self):
+        while True:
+            try:
+                return self.buffers.get(timeout=self.PUT_TIMEOUT)
+            except queue.Empty:
+                # A writer stuck in a write call on a dropped drive may never give its buffers back
+                if any(target.dead is not None and target.thread.is_alive() for target in self.targets):
+                    return bytearray(self.chunk_size)
+
+    def copy(self, source_path, relative_path, size=0):
+        """Read source_path once and write it to relative_path under every live target that needs it.
+
+        size is what the file counts for in the batch size, and is counted as
+        done on each target if the file can't be read.
+        """
+        try:
+            plans = self.plan(source_path, relative_path)
+        except OSError as e:
+            return self.cannot_read(relative_path, e, self.targets, size)
+        if not plans:
+            return True  # Current everywhere
+        try:
+            source = SourceFile(source_path, self.method)
+        except (OSError, ValueError) as e:
+            return self.cannot_read(relative_path, e, plans, size)
+
+        # Read from the earliest point any target needs; targets further on skip what they have
+        start = min(offset for offset, _ in plans.values())
+        prefix = next(digests for offset, digests in plans.values() if offset == start)
+        receivers = []
+        # The reader holds one reference until it has sent every chunk
+        source.acquire(1)
+        for target, (offset, _) in plans.items():
+            source.acquire(1)
+            if self.send(target, (OPEN, (relative_path, source, offset))):
+                receivers.append(target)
+            else:
+                source.release()
+                # Dropped drives still count the file, as failed
+                self.file_done(target, relative_path, OSError(target.dead))
+        hasher = None
+        if self.hashing:
+            hasher = hashlib.new(self.hash_name)
+            hasher.update(b"".join(prefix))
+        try:
+            for chunk in self.read_chunks(source, start):
+                if hasher is not None:
+                    # Kernel copies never bring the data into Python, so read it here once
+                    chunk.digest = hashlib.new(self.hash_name, chunk.data if chunk.data is not None
+                                               else os.pread(source.fd, chunk.length, chunk.offset)).digest()
+                    hasher.update(chunk.digest)
+                targets = [target for target in receivers if target.dead is None]
+                source.acquire(1)
+                chunk.refs = len(targets) + 1
+                for target in targets:
+                    if not self.send(target, (DATA, chunk)):
+                        chunk.release()
+                chunk.release()
+        except OSError as e:
+            self.log_message(f"✗ Read error in '{relative_path}': {e}")
+            self.broadcast((ABORT, e), receivers)
+            return False
+        finally:
+            source.release()
+        self.broadcast((CLOSE, hasher.digest() if hasher is not None else None), receivers)
+        return True
+
+    def cannot_read(self, relative_path, error, targets, size):
+        self.log_message(f"✗ Cannot read '{relative_path}': {error}")
+        for target in targets:
+            # As in complete_file: what won't be written counts as done, so progress still reaches the end
+            with self.count_lock:
+                target.bytes_done += size
+            self.file_done(target, relative_path, error)
+        return False
+
+    def broadcast(self, item, targets):
+        for target in targets:
+            if target.dead is None:
+                self.send(target, item)
+
+    def finish(self):
+        """Wait for the writers to drain and return one summary per target"""
+        for target in self.targets:
+            self.post_stop(target)
+        for target in self.targets:
+            # Only a writer stuck in a write call on a dropped drive takes long here
+            target.thread.join(None if target.dead is None else self.stall_seconds)
+            if target.thread.is_alive():
+                self.log_message(f"✗ {target.root} is still not responding; leaving it behind")
+        self.stopping.set()
+        self.monitor_thread.join()
+        if self.planner is not None:
+            self.planner.shutdown()
+        return [target.summary() for target in self.targets]
+
+    def post_stop(self, target):
+        deadline = time.monotonic() + self.stall_seconds
+        while True:
+            try:
+                target.queue.put((STOP, None), timeout=self.PUT_TIMEOUT)
+                return
+            except queue.Full:
+                # Live writers always drain; a dropped one may be stuck for good
+                if target.dead is not None and time.monotonic() > deadline:
+                    return
+
+    def schedule(self, files):
+        """Order (source path, relative path) pairs largest first, noting the batch size for progress().
+
+        Returns (source path, relative path, size) entries for copy_many().
+        """
+        sized = []
+        for source_path, relative_path in files:
+            try:
+                size = os.stat(source_path).st_size
+            except OSError:
+                size = 0  # copy() reports it
+            sized.append((source_path, relative_path, size))
+        sized.sort(key=lambda item: item[2], reverse=True)
+        self.total_bytes = sum(size for _, _, size in sized)
+        return sized
+
+    def expect(self, size):
+        """Add a file found after the copy started (e.g. while walking a folder) to the batch size"""
+        self.total_bytes += size
+
+    def remaining(self, target):
+        return max(self.total_bytes - target.bytes_done, 0)
+
+    def progress(self):
+        """Per target: bytes done of the batch, write rate (bytes/s), ETA (s) and whether it holds the others up"""
+        rows = []
+        for target in self.targets:
+            remaining = self.remaining(target)
+            rows.append({
+                'target': target.root,
+                'hub': target.hub,
+                'bytes_done': target.bytes_done,
+                'total_bytes': self.total_bytes,
+                'percent': 100.0 * target.bytes_done / self.total_bytes if self.total_bytes else None,
+                'rate': target.rate,
+                'eta': remaining / target.rate if target.rate and target.dead is None else None,
+                # A full queue means the reader is waiting on this drive
+                'bottleneck': target.dead is None and target.queue is not None and target.queue.full(),
+                'finished': target.finished is not None,
+                'dropped': target.dead
+            })
+        return rows
+
+    def monitor(self):
+        """Measure each drive's write rate and drop drives that have work in hand but make no progress"""
+        samples = {}
+        while not self.stopping.wait(self.MONITOR_INTERVAL):
+            now = time.monotonic()
+            for target in self.live_targets():
+                device = drive_info.io_bytes(target.device) if target.device else None
+                sample = (now, target.bytes_written, device, target.bytes_written + target.bytes_checked)
+                previous = samples.get(target)
+                samples[target] = sample
+                if previous is None:
+                    continue
+                then, written_then, device_then, moved_then = previous
+                if device is not None and device_then is not None:
+                    # What reached the stick, rather than what the page cache took
+                    rate = (device[1] - device_then[1]) / (now - then)
+                    moved = device != device_then
+                else:
+                    rate = (target.bytes_written - written_then) / (now - then)
+                    moved = False
+                if target.finished is None:
+                    target.rate = rate if target.rate is None else (
+                        self.RATE_SMOOTHING * rate + (1 - self.RATE_SMOOTHING) * target.rate)
+                if moved or sample[3] != moved_then:
+                    target.last_progress = now
+                busy_since = target.busy_since
+                if busy_since is not None and now - max(busy_since, target.last_progress) > self.stall_seconds:
+                    self.drop(target, f"stalled, no progress for {self.stall_seconds:.0f} s")
+
+    def run(self, files):
+        """Copy (source path, relative path) pairs to every target; returns the target summaries"""
+        entries = self.schedule(files)
+        self.start()
+        self.copy_many(entries)
+        return self.finish()
+
+    def copy_many(self, entries, on_start=None):
+        """Copy (source path, relative path, size) entries in order; size None makes an empty directory.
+        on_start(entry) is called as each file's copy begins.
+
+        Readahead starts on the next few small sources while one is being
+        sent, so their opens and reads overlap instead of queueing up.
+        """
+        entries = iter(entries)
+        ahead = deque()
+        while True:
+            while len(ahead) < self.LOOKAHEAD:
+                entry = next(entries, None)
+                if entry is None:
+                    break
+                ahead.append(entry)
+                self.prefetch(entry)
+            if not ahead:
+                return
+            if not self.live_targets():
+                self.log_message("✗ Every target drive has been dropped, stopping")
+                return
+            source_path, relative_path, size = ahead.popleft()
+            if size is None:
+                self.broadcast((MKDIR, relative_path), self.targets)
+            else:
+                if on_start is not None:
+                    on_start((source_path, relative_path, size))
+                self.copy(source_path, relative_path, size)
+
+    def prefetch(self, entry):
+        source_path, _, size = entry
+        if not size or size > self.SMALL_FILE_BYTES or not hasattr(os, 'posix_fadvise'):
+            return
+        try:
+            fd = os.open(source_path, os.O_RDONLY)
+        except OSError:
+            return  # copy() reports it
+        try:
+            advise(fd, 0, size, 'POSIX_FADV_WILLNEED')
+        finally:
+            os.close(fd)
+
+    def file_done(self, target, relative_path, error):
+        with self.count_lock:
+            if error is None:
+                target.files_ok += 1
+            else:
+                target.files_failed += 1
+        if self.on_file_done is not None:
+            self.on_file_done(target.root, relative_path, error)
+
+    def drop(self, target, reason):
+        if target.dead is None:
+            target.dead = reason
+            self.log_message(f"✗ Dropping {target.root}: {reason}")
+            # Don't let other drives on its hub wait for a writer that may never come back
+            self.slots.release(target)
+
+    @contextmanager
+    def writing(self, target):
+        """Hold one of the hub's write slots, and let the monitor time the I/O done meanwhile"""
+        self.slots.acquire(target)
+        target.busy_since = time.monotonic()
+        try:
+            yield
+        finally:
+            target.busy_since = None
+            self.slots.release(target)
+
+    def writer_loop(self, target):
+        current = None  # DestFile being written
+        while True:
+            try:
+                kind, payload = target.queue.get(timeout=self.BATCH_SECONDS if target.batch else None)
+            except queue.Empty:
+                # The reader is busy elsewhere; don't keep finished files waiting on it
+                self.flush_batch(target)
+                continue
+            if kind == STOP:
+                self.flush_batch(target)
+                break
+            if kind == MKDIR:
+                if target.dead is None:
+                    with self.writing(target):
+                        try:
+                            self.make_directory(target, payload)
+                        except OSError as e:
+                            self.log_message(f"✗ Can't create folder '{payload}' on {target.root}: {e}")
+                            self.check_drive(target, e)
+                continue
+            if kind == OPEN:
+                relative_path, source, start = payload
+                if target.dead is not None:
+                    source.release()
+                    self.file_done(target, relative_path, OSError(target.dead))
+                    continue
+                current = DestFile(target.root, relative_path, source, start)
+                if start:
+                    target.files_resumed += 1
+                    target.bytes_done += start
+                    self.log_message(f"Resuming '{relative_path}' on {target.root} at {format_size(start)}")
+                with self.writing(target):
+                    self.guard(target, current, current.open, target.directories)
+            elif kind == DATA:
+                # Every chunk is released, even ones for a file already given up on or already on the drive
+                if current is not None and current.error is None and payload.offset >= current.start:
+                    with self.writing(target):
+                        self.guard(target, current, self.write_chunk, target, current, payload)
+                        if target.manifest is not None and payload.digest is not None and current.error is None:
+                            self.guard(target, current, self.checkpoint, target, current, payload)
+                payload.release()
+            elif current is not None:
+                if kind == ABORT:
+                    current.error = current.error or payload
+                else:
+                    current.digest = payload
+                self.finish_file(target, current)
+                current = None
+                continue
+
+            if target.dead is not None and current is not None:
+                # Dropped mid-file: the reader sends no more of it
+                current.error = current.error or OSError(target.dead)
+                self.finish_file(target, current)
+                current = None
+        if target.manifest is not None:
+            if target.dead is None:
+                try:
+                    target.manifest.close()
+                except OSError as e:
+                    self.log_message(f"✗ Can't save the manifest on {target.root}: {e}")
+            else:
+                target.manifest.abandon()
+        target.finished = time.monotonic()
+
+    def make_directory(self, target, relative_path):
+        path = os.path.join(target.root, relative_path)
+        if path not in target.directories:
+            os.makedirs(path, exist_ok=True)
+            target.directories.add(path)
+
+    def finish_file(self, target, current):
+        if current.error is None and not current.start and current.stat.st_size <= self.SMALL_FILE_BYTES:
+            # Small file: close it now, sync it later with the rest of its batch
+            with self.writing(target):
+                self.guard(target, current, current.park)
+            if current.error is None:
+                target.batch.append(current)
+                target.batch_bytes += current.stat.st_size
+                if len(target.batch) >= self.BATCH_FILES or target.batch_bytes >= self.BATCH_BYTES:
+                    self.flush_batch(target)
+                return
+        # Files are completed in the order they were written
+        self.flush_batch(target)
+        with self.writing(target):
+            self.settle_file(target, current)
+        self.complete_file(target, current)
+
+    def flush_batch(self, target):
+        """Make the waiting small files durable with one sync of the drive, then check and rename each"""
+        batch = target.batch
+        if not batch:
+            return
+        target.batch = []
+        target.batch_bytes = 0
+        with self.writing(target):
+            if target.dead is None:
+                try:
+                    sync_files(target.root, [dest_file.part_path for dest_file in batch])
+                except OSError as e:
+                    for dest_file in batch:
+                        dest_file.error = dest_file.error or e
+                    self.check_drive(target, e)
+                else:
+                    for dest_file in batch:
+                        dest_file.durable = True
+            for dest_file in batch:
+                if target.dead is not None:
+                    dest_file.error = dest_file.error or OSError(target.dead)
+                self.settle_file(target, dest_file)
+        for dest_file in batch:
+            self.complete_file(target, dest_file)
+
+    def settle_file(self, target, current):
+        """Verify, rename into place and record a written file; the caller holds a write slot"""
+        if self.verify and current.error is None and current.digest is not None:
+            self.guard(target, current, self.verify_file, target, current)
+        self.guard(target, current, current.close)
+        if target.manifest is not None and current.error is None and current.digest is not None:
+            try:
+                target.manifest.record_file(current.relative_path, current.stat, current.digest,
+                                            os.stat(current.path))
+            except OSError as e:
+                # The copy itself is fine; the next sync just checks it again
+                self.log_message(f"✗ Can't update the manifest on {target.root}: {e}")
+
+    def complete_file(self, target, current):
+        current.source.release()
+        if current.error is None:
+            target.failures_in_row = 0
+        else:
+            # What won't be written counts as done, so progress still reaches the end
+            target.bytes_done += max(current.stat.st_size - current.written, 0)
+            target.failures_in_row += 1
+            if target.failures_in_row >= self.MAX_FAILURES_IN_ROW:
+                self.drop(target, f"{target.failures_in_row} files in a row failed (last: {current.error})")
+        self.file_done(target, current.relative_path, current.error)
+
+    def checkpoint(self, target, current, chunk):
+        """Every CHECKPOINT_BYTES of a large file, sync it and note its chunks so far in the manifest"""
+        current.pending.append(chunk.digest)
+        if (current.written - current.checkpointed < self.CHECKPOINT_BYTES
+                or current.written >= current.stat.st_size):
+            return
+        os.fsync(current.out.fileno())
+        try:
+            target.manifest.record_chunks(current.relative_path, current.stat,
+                                          current.checkpointed // self.chunk_size, current.pending)
+        except OSError as e:
+            self.log_message(f"✗ Can't update the manifest on {target.root}: {e}")
+            return
+        current.pending = []
+        current.checkpointed = current.written
+        current.keep_partial = True
+
+    def write_chunk(self, target, current, chunk):
+        if chunk.data is not None:
+            current.write(chunk.data, target.write_size)
+        else:
+            end = chunk.offset + chunk.length
+            written_before = current.written
+            while True:
+                # Carry on from wherever an earlier, refused method stopped
+                offset = chunk.offset + current.written - written_before
+                try:
+                    current.copy_range(target.method, offset, end - offset, target.write_size)
+                    break
+                except OSError as e:
+                    if e.errno not in UNSUPPORTED_ERRNOS or target.method == KERNEL_FALLBACKS[-1]:
+                        raise
+                    fallback = KERNEL_FALLBACKS[KERNEL_FALLBACKS.index(target.method) + 1]
+                    self.log_message(f"Copy path for {target.root}: {fallback} ({target.method} refused: {e})")
+                    target.method = fallback
+        target.bytes_written += chunk.length
+        target.bytes_done += chunk.length
+
+    def verify_file(self, target, current):
+        """Read the written file back and compare its hash, rewriting it on a mismatch"""
+        if target.readback is None:
+            target.readback = bytearray(self.chunk_size)
+
+        def on_read(length):
+            target.bytes_checked += length
+
+        for attempt in range(1, self.VERIFY_RETRIES + 2):
+            current.sync()
+            if current.read_digest(self.hash_name, target.readback, on_read) == current.digest:
+                target.files_verified += 1
+                return
+            if attempt > self.VERIFY_RETRIES:
+                current.keep_partial = False
+                raise OSError(f"verification failed after {self.VERIFY_RETRIES} rewrites")
+            self.log_message(f"✗ Verification mismatch for '{current.relative_path}' on {target.root}, "
+                             f"rewriting ({attempt}/{self.VERIFY_RETRIES})")
+            target.files_rewritten += 1
+            current.rewrite(target.write_size)
+
+    def guard(self, target, dest_file, action, *args):
+        """Run a file operation, recording an error and dropping the drive if it is gone"""
+        try:
+            action(*args)
+        except OSError as e:
+            dest_file.error = dest_file.error or e
+            self.check_drive(target, e)
+
+    def check_drive(self, target, error):
+        """Drop the drive if an error shows it is gone or failing"""
+        if not os.path.isdir(target.root):
+            self.drop(target, f"drive removed ({error})")
+        elif error.errno in DRIVE_ERRNOS:
+            self.drop(target, str(error))
+
+
+class DestFile:
+    """One file being written to one target"""
+
+    def __init__(self, root, relative_path, source, start=0):
+        self.relative_path = relative_path
+        self.source = source
+        self.stat = source.stat
+        self.path = os.path.join(root, relative_path)
+        self.part_path = self.path + PART_SUFFIX
+        self.start = start  # Bytes already on the drive from an interrupted copy
+        self.out = None
+        self.error = None
+        self.written = start
+        self.digest = None  # Source hash, when hashing
+        self.synced = False
+        self.durable = False  # Flushed to the drive by a sync of its whole batch
+        self.checkpointed = start
+        self.pending = []  # Hashes of the chunks written since the last checkpoint
+        self.keep_partial = start > 0  # Leave the temporary file for a later resume if this fails
+
+    def open(self, directories):
+        """directories: the target's set of folders already made, to save a makedirs per file"""
+        parent = os.path.dirname(self.path)
+        if parent and parent not in directories:
+            os.makedirs(parent, exist_ok=True)
+            directories.add(parent)
+        if self.start:
+            self.out = open(self.part_path, 'r+b', buffering=0)
+            self.out.truncate(self.start)
+            self.out.seek(self.start)
+        else:
+            self.out = open(self.part_path, 'wb', buffering=0)
+
+    def write(self, data, write_size):
+        for start in range(0, len(data), write_size):
+            view = data[start:start + write_size]
+            while view:
+                view = view[self.out.write(view):]
+        self.written += len(data)
+
+    def copy_range(self, method, offset, length, write_size):
+        """Copy a range of the source in the kernel (or with pread as the last resort)"""
+        out_fd = self.out.fileno()
+        end = offset + length
+        position = offset
+        while position < end:
+            count = min(write_size, end - position)
+            if method == 'copy_file_range':
+                done = os.copy_file_range(self.source.fd, out_fd, count, position)
+            elif method == 'sendfile':
+                done = os.sendfile(out_fd, self.source.fd, position, count)
+            else:
+                data = os.pread(self.source.fd, count, position)
+                done = len(data)
+                view = memoryview(data)
+                while view:
+                    view = view[os.write(out_fd, view):]
+            if not done:
+                break  # Source shrank; the size check at close reports it
+            position += done
+            self.written += done
+
+    def park(self):
+        """Close the file unsynced while it waits for its batch to be synced"""
+        self.out.close()
+        self.out = None
+
+    def sync(self):
+        """Make sure the data is on the stick before it counts as copied"""
+        if self.out is None:
+            size = os.stat(self.part_path).st_size  # Parked and made durable with its batch
+        else:
+            if not self.durable:
+                os.fsync(self.out.fileno())
+            size = os.fstat(self.out.fileno()).st_size
+        if size != self.written or size != self.stat.st_size:
+            raise OSError(f"size mismatch: source {self.stat.st_size} bytes, "
+                          f"read {self.written}, on drive {size}")
+        self.synced = True
+
+    def read_digest(self, hash_name, buffer, on_read=None):
+        """Hash the file as stored on the drive, not as cached in memory where that can be avoided"""
+        return file_digest(self.part_path, hash_name, buffer, on_read, drop_cache=True)
+
+    def rewrite(self, write_size):
+        """Write the whole file again straight from the source"""
+        if self.out is None:
+            self.out = open(self.part_path, 'r+b', buffering=0)
+        self.out.seek(0)
+        self.out.truncate()
+        self.written = 0
+        self.synced = False
+        self.durable = False
+        self.keep_partial = False
+        position = 0
+        while position < self.stat.st_size:
+            size = min(write_size, self.stat.st_size - position)
+            data = os.pread(self.source.fd, size, position) if hasattr(os, 'pread') else self.read_at(position, size)
+            if not data:
+                break
+            self.write(memoryview(data), write_size)
+            position += len(data)
+
+    def read_at(self, position, size):
+        os.lseek(self.source.fd, position, os.SEEK_SET)
+        return os.read(self.source.fd, size)
+
+    def close(self):
+        try:
+            if self.error is None and not self.synced:
+                self.sync()
+            if self.out is not None:
+                self.out.close()
+            if self.error is None:
+                os.utime(self.part_path, ns=(self.stat.st_atime_ns, self.stat.st_mtime_ns))
+                # Only a complete, synced file gets its real name
+                os.replace(self.part_path, self.path)
+        except OSError as e:
+            self.error = e
+            raise
+        finally:
+            if self.error is not None:
+                if self.out is not None and not self.out.closed:
+                    self.out.close()
+                if not self.keep_partial:
+                    try:
+                        os.remove(self.part_path)
+                    except OSError:
+                        pass
+            self.out = None
@@ -0,0 +1,47 @@
+"""Where a target drive sits: its block device and the USB hub it is plugged into.
+
+Read from Linux sysfs. Elsewhere, and for targets that aren't on a block
+device (tmpfs, network shares), every function returns None and the copier
+falls back to counting its own writes.
+"""
+import os
+import re
+
+SECTOR = 512
+# A USB device's sysfs name: bus-port[.port...], e.g. 2-1.3 is port 3 of the hub on port 1 of bus 2
+USB_PORT = re.compile(r'\d+-\d+(\.\d+)*')
+USB_BUS = re.compile(r'usb\d+')
+
+
+def block_device(path):
+    """sysfs directory of the block device (or partition) holding path, or None"""
+    try:
+        dev = os.stat(path).st_dev
+    except OSError:
+        return None
+    link = f"/sys/dev/block/{os.major(dev)}:{os.minor(dev)}"
+    if not os.path.exists(link):
+        return None
+    return os.path.realpath(link)
+
+
+def io_bytes(device):
+    """(bytes read, bytes written) by the device since boot, or None if unreadable"""
+    try:
+        with open(os.path.join(device, 'stat'), 'r') as f:
+            fields = f.read().split()
+        return int(fields[2]) * SECTOR, int(fields[6]) * SECTOR
+    except (OSError, ValueError, IndexError):
+        return None
+
+
+def hub_of(device):
+    """Name of the hub (or root hub) a USB device hangs off, or None when it isn't on USB"""
+    parts = device.split(os.sep)
+    ports = [part for part in parts if USB_PORT.fullmatch(part)]
+    if ports:
+        # .../usb2/2-1/2-1.3/2-1.3:1.0/host6/...: the stick is 2-1.3, on hub 2-1
+        port = ports[-1]
+        return port.rsplit('.', 1)[0] if '.' in port else 'usb' + port.split('-')[0]
+    buses = [part for part in parts if USB_BUS.fullmatch(part)]
+    return buses[-1] if buses else None
@@ -0,0 +1,128 @@
+"""Removable drives, and a watcher that reports them as they come and go.
+
+On Linux the mount table is read from /proc/self/mountinfo. The kernel
+flags that file (POLLPRI) whenever anything is mounted or unmounted, so the
+watcher sleeps until a drive actually appears or goes instead of rescanning.
+A mount counts as a removable drive when its disk has the sysfs removable
+flag or sits on USB (USB disks often call themselves fixed). Elsewhere
+psutil's partition list is polled and filtered on its 'removable'/'cdrom'
+options.
+"""
+import os
+import re
+import select
+import threading
+from collections import namedtuple
+
+import drive_info
+
+MOUNTINFO = '/proc/self/mountinfo'
+# mountinfo writes spaces, tabs, newlines and backslashes in paths as octal escapes
+ESCAPE = re.compile(r'\\([0-7]{3})')
+
+Drive = namedtuple('Drive', 'device mountpoint fstype')
+
+
+def unescape(field):
+    return ESCAPE.sub(lambda match: chr(int(match.group(1), 8)), field)
+
+
+def is_removable(device):
+    """device is a block device's sysfs directory, a partition or a whole disk"""
+    disk = os.path.dirname(device) if os.path.exists(os.path.join(device, 'partition')) else device
+    try:
+        with open(os.path.join(disk, 'removable'), 'r') as f:
+            if f.read().strip() == '1':
+                return True
+    except OSError:
+        pass
+    return drive_info.hub_of(device) is not None
+
+
+def mounted_drives():
+    """Removable drives in the Linux mount table, one per device"""
+    drives = []
+    seen = set()
+    with open(MOUNTINFO, 'r') as f:
+        for line in f:
+            fields = line.split()
+            try:
+                separator = fields.index('-', 6)
+            except ValueError:
+                continue
+            device_number, root, mountpoint = fields[2], fields[3], unescape(fields[4])
+            fstype, source = fields[separator + 1], unescape(fields[separator + 2])
+            # Bind mounts show a subdirectory as root; major 0 is tmpfs, proc and the like
+            if root != '/' or mountpoint == '/' or device_number in seen or device_number.startswith('0:'):
+                continue
+            device = f"/sys/dev/block/{device_number}"
+            if os.path.exists(device) and is_removable(os.path.realpath(device)):
+                seen.add(device_number)
+                drives.append(Drive(source, mountpoint, fstype))
+    return drives
+
+
+def partition_drives():
+    import psutil
+    return [Drive(p.device, p.mountpoint, p.fstype) for p in psutil.disk_partitions()
+            if 'removable' in p.opts or 'cdrom' in p.opts]
+
+
+def removable_drives():
+    if os.path.exists(MOUNTINFO):
+        return mounted_drives()
+    return partition_drives()
+
+
+class DriveWatcher:
+    """Calls on_change(added, removed, drives) from its own thread whenever the removable drives change"""
+
+    POLL_SECONDS = 2.0  # Rescan interval without mount events, and a safety net with them
+
+    def __init__(self, on_change):
+        self.on_change = on_change
+        self.drives = {}  # Mount point -> Drive
+        self.stopping = threading.Event()
+        self.thread = None
+        self.mounts = None
+        self.poller = None
+
+    def start(self):
+        """Take the drives present now as the starting point and watch for changes from there"""
+        self.drives = {drive.mountpoint: drive for drive in removable_drives()}
+        if os.path.exists(MOUNTINFO) and hasattr(select, 'poll'):
+            self.mounts = open(MOUNTINFO, 'r')
+            self.poller = select.poll()
+            self.poller.register(self.mounts, select.POLLPRI | select.POLLERR)
+        self.thread = threading.Thread(target=self.run, daemon=True)
+        self.thread.start()
+
+    def stop(self):
+        self.stopping.set()
+
+    def wait(self):
+        if self.poller is None:
+            self.stopping.wait(self.POLL_SECONDS)
+        else:
+            self.poller.poll(self.POLL_SECONDS * 1000)
+
+    def run(self):
+        try:
+            while not self.stopping.is_set():
+                self.wait()
+                if not self.stopping.is_set():
+                    self.rescan()
+        finally:
+            if self.mounts is not None:
+                self.mounts.close()
+
+    def rescan(self):
+        try:
+            current = {drive.mountpoint: drive for drive in removable_drives()}
+        except OSError:
+            return
+        added = [drive for mountpoint, drive in current.items() if self.drives.get(mountpoint) != drive]
+        removed = [drive for mountpoint, drive in self.drives.items() if current.get(mountpoint) != drive]
+        self.drives = current
+        if added or removed:
+            self.on_change(added, removed, list(current.values()))
@@ -0,0 +1,141 @@
+"""Copy jobs read from a file and run without the window.
+
+A job file is JSON:
+    {"sources": ["/data/film.mp4", "/data/handouts"],
+     "targets": ["/media/stick1", "/media/stick2"],
+     "verify": true,
+     "sync": false}
+and may also set "method", "chunk_size", "hub_writers", "stall_seconds" and
+"progress_interval" (seconds between progress events). Sources are copied
+as in the window: files to each drive's root, folders as trees under their
+own name.
+
+Progress goes out as JSON lines, one event per line, each with "event" and
+"time" (seconds since the job started):
+    start         sources, targets, verify, sync
+    log           message, as shown in the window's log
+    file_failed   target, path, error
+    progress      files_found, files_started, targets: one row per drive
+                  as FanOutCopier.progress() gives them
+    target_done   the drive's summary
+    done          files_ok, files_total, seconds
+    error         message, when the job can't start
+Successful files get no event of their own; a folder can hold 100k of them.
+"""
+import json
+import os
+import threading
+import time
+
+import sources
+from copy_engine import FanOutCopier, METHODS
+
+DEFAULTS = {
+    'verify': False,
+    'sync': False,
+    'method': 'auto',
+    'chunk_size': None,
+    'hub_writers': None,
+    'stall_seconds': None,
+    'progress_interval': 1.0,
+}
+
+
+def load_job(path):
+    """Read and check a job file; raises ValueError saying what is wrong with it"""
+    with open(path, 'r', encoding='utf-8') as f:
+        try:
+            job = json.load(f)
+        except ValueError as e:
+            raise ValueError(f"{path} is not valid JSON: {e}")
+    if not isinstance(job, dict):
+        raise ValueError(f"{path} must hold a JSON object")
+    unknown = set(job) - set(DEFAULTS) - {'sources', 'targets'}
+    if unknown:
+        raise ValueError(f"Unknown job settings: {', '.join(sorted(unknown))}")
+    for key in ('sources', 'targets'):
+        paths = job.get(key)
+        if not paths or not isinstance(paths, list) or not all(isinstance(p, str) for p in paths):
+            raise ValueError(f"'{key}' must be a non-empty list of paths")
+    for source in job['sources']:
+        if not os.path.exists(source):
+            raise ValueError(f"Source not found: {source}")
+    for target in job['targets']:
+        # A missing mount point would have the copy land on the computer's own disk
+        if not os.path.isdir(target):
+            raise ValueError(f"Target is not a mounted drive or folder: {target}")
+    if job.get('method', 'auto') not in METHODS:
+        raise ValueError(f"Unknown copy method '{job['method']}', use one of: {', '.join(METHODS)}")
+    return {**DEFAULTS, **job}
+
+
+class EventWriter:
+    """Writes events as JSON lines; called from the copier's threads"""
+
+    def __init__(self, stream):
+        self.stream = stream
+        self.lock = threading.Lock()
+        self.started = time.monotonic()
+
+    def __call__(self, event, **fields):
+        line = json.dumps({'event': event, 'time': round(time.monotonic() - self.started, 3), **fields},
+                          separators=(',', ':'), default=str)
+        with self.lock:
+            self.stream.write(line + "\n")
+            self.stream.flush()
+
+
+def run_job(job, emit):
+    """Copy a loaded job, reporting through emit(event, **fields); returns (files ok, files total) over all drives"""
+    listed = [0]  # Files found so far
+    unreadable = [0]  # Files and folders that couldn't be listed
+    started = [0]
+
+    def file_done(target, relative_path, error):
+        if error is not None:
+            emit('file_failed', target=target, path=relative_path, error=str(error))
+
+    def on_entry(entry):
+        if entry.size is not None:
+            listed[0] += 1
+        copier.expect(entry.size or 0)
+
+    def on_error(path, error):
+        unreadable[0] += 1
+        emit('file_failed', target=None, path=path, error=f"can't read it: {error}")
+
+    def on_start(entry):
+        started[0] += 1
+
+    def report():
+        emit('progress', files_found=listed[0], files_started=started[0], targets=copier.progress())
+
+    def reporter():
+        while not stopping.wait(job['progress_interval']):
+            report()
+
+    copier = FanOutCopier(job['targets'], chunk_size=job['chunk_size'], on_file_done=file_done,
+                          log=lambda message: emit('log', message=message), method=job['method'],
+                          verify=job['verify'], sync=job['sync'], hub_writers=job['hub_writers'],
+                          stall_seconds=job['stall_seconds'])
+    emit('start', sources=job['sources'], targets=job['targets'], verify=job['verify'], sync=job['sync'])
+    begun = time.monotonic()
+    stopping = threading.Event()
+    thread = threading.Thread(target=reporter, daemon=True)
+    entries = sources.list_ahead(sources.iter_sources(job['sources'], on_error=on_error), on_entry=on_entry)
+    copier.start()
+    thread.start()
+    try:
+        copier.copy_many(entries, on_start=on_start)
+    finally:
+        entries.close()
+        summaries = copier.finish()
+        stopping.set()
+        thread.join()
+    report()
+    for summary in summaries:
+        emit('target_done', **summary)
+    files_ok = sum(summary['files_ok'] for summary in summaries)
+    files_total = (listed[0] + unreadable[0]) * len(summaries)
+    emit('done', files_ok=files_ok, files_total=files_total, seconds=round(time.monotonic() - begun, 3))
+    return files_ok, files_total
@@ -1,24 +1,45 @@
 import tkinter as tk
 from tkinter import ttk, filedialog, messagebox
 import os
-import subprocess
 import threading
+import queue
+import logging
+import logging.handlers
+import argparse
+import sys
+import time
+from collections import deque
 from datetime import datetime
+from copy_engine import FanOutCopier
+import hotplug
+import jobs
+import sources
 
-try:
-    import psutil
-except ImportError:
-    messagebox.showerror(
-        "Dependency Missing",
-        "The 'psutil' library is required. Please install it by running:\npip install psutil"
-    )
-    exit()
+def format_duration(seconds):
+    seconds = int(seconds)
+    if seconds >= 3600:
+        return f"{seconds // 3600}:{seconds % 3600 // 60:02d}:{seconds % 60:02d}"
+    return f"{seconds // 60}:{seconds % 60:02d}"
+
+def describe_sources(paths):
+    folders = sum(1 for path in paths if os.path.isdir(path))
+    files = len(paths) - folders
+    parts = ([f"{files} file(s)"] if files else []) + ([f"{folders} folder(s)"] if folders else [])
+    return " and ".join(parts)
 
 class USBCopierApp:
-    def __init__(self, root):
+    LOG_MAX_LINES = 2000 # Log lines kept in memory and in the widget
+    LOG_FLUSH_MS = 200 # How often queued log messages are written to the widget
+    LOG_FILE_MAX_BYTES = 1024 * 1024
+    LOG_FILE_BACKUPS = 3
+    PROGRESS_POLL_MS = 500 # How often the per-drive table is refreshed during a copy
+    STATION_SETTLE_MS = 2000 # Drives plugged in within this long of each other are copied as one batch
+    STATUS_INTERVAL = 0.2 # Seconds between status line updates; folders can hold thousands of tiny files
+
+    def __init__(self, root, log_file=None):
         self.root = root
         self.root.title("Ironclad USB Drive Copier - created by Shaurya Gupta")
-        self.root.geometry("700x650")
+        self.root.geometry("700x760")
         self.root.minsize(600, 500)
         
         self.style = ttk.Style()
@@ -27,11 +48,39 @@ class USBCopierApp:
         # --- Variables ---
         self.source_files = []
         self.drive_vars = {}
+        self.drive_paths = {} # Drive label -> mount point to copy into
         self.copy_in_progress = False
         self.verify_copy = tk.BooleanVar(value=False) # Default to OFF for speed
+        self.sync_copy = tk.BooleanVar(value=False)
+        self.jobs = [] # (copier, mount point -> drive label) of running copies, for the per-drive table
+        self.polling = False
+        self.drive_controls = [] # Buttons of the drive list, rebuilt with it
+        self.station_mode = tk.BooleanVar(value=False)
+        self.station_job = None # (files, verify, sync) given to each drive plugged in while station mode is on
+        self.station_pending = [] # Drives plugged in, waiting for the batch to settle
+        self.station_running = 0
+        self.station_done = 0
+
+        # --- Logging: any thread queues messages, the Tk loop writes them in batches ---
+        self.log_history = deque(maxlen=self.LOG_MAX_LINES)
+        self.log_queue = queue.Queue()
+        self.file_logger = None
+        if log_file:
+            self.file_logger = logging.getLogger("usb_copier")
+            self.file_logger.setLevel(logging.INFO)
+            self.file_logger.propagate = False
+            handler = logging.handlers.RotatingFileHandler(
+                log_file, maxBytes=self.LOG_FILE_MAX_BYTES, backupCount=self.LOG_FILE_BACKUPS, encoding='utf-8'
+            )
+            handler.setFormatter(logging.Formatter("%(asctime)s %(message)s"))
+            self.file_logger.addHandler(handler)
 
         self.create_widgets()
         self.scan_drives()
+        self.root.after(self.LOG_FLUSH_MS, self.flush_log)
+        # Drives show up and disappear in the list as they are plugged in and out
+        self.watcher = hotplug.DriveWatcher(lambda *change: self.root.after(0, self.drives_changed, *change))
+        self.watcher.start()
         
         self.root.protocol("WM_DELETE_WINDOW", self.on_closing)
 
@@ -47,7 +96,7 @@ class USBCopierApp:
         title_label = ttk.Label(main_frame, text="Ironclad USB Drive Copier - Shaurya Gupta", font=("Arial", 16, "bold"))
         title_label.grid(row=0, column=0, columnspan=2, pady=(0, 20), sticky=tk.W)
 
-        files_frame = ttk.LabelFrame(main_frame, text="Source Files")
+        files_frame = ttk.LabelFrame(main_frame, text="Source Files and Folders")
         files_frame.grid(row=1, column=0, columnspan=2, sticky=(tk.W, tk.E), pady=5)
         files_frame.columnconfigure(0, weight=1)
         
@@ -63,6 +112,8 @@ class USBCopierApp:
         
         self.add_files_button = ttk.Button(file_buttons_frame, text="Add Files", command=self.add_files)
         self.add_files_button.pack(fill=tk.X, pady=2)
+        self.add_folder_button = ttk.Button(file_buttons_frame, text="Add Folder", command=self.add_folder)
+        self.add_folder_button.pack(fill=tk.X, pady=2)
         self.remove_files_button = ttk.Button(file_buttons_frame, text="Remove", command=self.remove_selected_files)
         self.remove_files_button.pack(fill=tk.X, pady=2)
 
@@ -80,6 +131,17 @@ class USBCopierApp:
         self.status_label = ttk.Label(progress_frame, text="Ready")
         self.status_label.grid(row=1, column=0, sticky=tk.W, padx=10, pady=(0, 5))
 
+        # One row per drive: which one is holding the batch up, and when each will be done
+        self.drive_table = ttk.Treeview(progress_frame, columns=("hub", "speed", "done", "eta", "status"), height=4)
+        for column, heading, width in (("#0", "Drive", 110), ("hub", "Hub", 70), ("speed", "Speed", 90),
+                                       ("done", "Done", 60), ("eta", "ETA", 70), ("status", "Status", 200)):
+            self.drive_table.heading(column, text=heading, anchor=tk.W)
+            self.drive_table.column(column, width=width, stretch=(column == "status"))
+        self.drive_table.grid(row=2, column=0, sticky=(tk.W, tk.E), padx=(10, 0), pady=(0, 5))
+        table_scrollbar = ttk.Scrollbar(progress_frame, orient=tk.VERTICAL, command=self.drive_table.yview)
+        table_scrollbar.grid(row=2, column=1, sticky=(tk.N, tk.S), padx=(0, 10), pady=(0, 5))
+        self.drive_table.config(yscrollcommand=table_scrollbar.set)
+
         log_frame = ttk.LabelFrame(main_frame, text="Log")
         log_frame.grid(row=4, column=0, columnspan=2, sticky=(tk.W, tk.E, tk.N, tk.S), pady=5)
         log_frame.columnconfigure(0, weight=1)
@@ -101,6 +163,19 @@ class USBCopierApp:
             variable=self.verify_copy
         )
         self.verify_checkbox.grid(row=0, column=0, sticky=tk.W, padx=5)
+        self.sync_checkbox = ttk.Checkbutton(
+            button_frame,
+            text="Sync: skip files already on the drive, resume interrupted ones",
+            variable=self.sync_copy
+        )
+        self.sync_checkbox.grid(row=1, column=0, sticky=tk.W, padx=5)
+        self.station_checkbox = ttk.Checkbutton(
+            button_frame,
+            text="Station mode: copy to every drive as soon as it is plugged in",
+            variable=self.station_mode,
+            command=self.toggle_station
+        )
+        self.station_checkbox.grid(row=2, column=0, sticky=tk.W, padx=5)
 
         action_buttons_frame = ttk.Frame(button_frame)
         action_buttons_frame.grid(row=0, column=1, sticky=tk.E)
@@ -114,7 +189,7 @@ class USBCopierApp:
         
         # List of controls to disable during copy
         self.controls_to_disable = [
-            self.add_files_button, self.remove_files_button, self.verify_checkbox, 
+            self.add_files_button, self.add_folder_button, self.remove_files_button, self.verify_checkbox, self.sync_checkbox,
             self.start_button
         ]
 
@@ -124,34 +199,62 @@ class USBCopierApp:
             for f in filenames:
                 if f not in self.source_files:
                     self.source_files.append(f)
-                    self.file_listbox.insert(tk.END, os.path.basename(f))
-                    self.log_message(f"Added file: {os.path.basename(f)}")
+                    name = sources.target_names(self.source_files)[-1]
+                    self.file_listbox.insert(tk.END, name)
+                    self.log_message(f"Added file: {os.path.basename(f)}"
+                                     + (f" (copied as '{name}')" if name != os.path.basename(f) else ""))
+
+    def add_folder(self):
+        folder = filedialog.askdirectory(title="Select a folder to copy", mustexist=True)
+        if folder and folder not in self.source_files:
+            self.source_files.append(folder)
+            # Copied as a whole tree, under its own name unless another source has it
+            original = os.path.basename(os.path.normpath(folder))
+            name = sources.target_names(self.source_files)[-1]
+            self.file_listbox.insert(tk.END, f"{name}/ (folder)")
+            self.log_message(f"Added folder: {original}" + (f" (copied as '{name}')" if name != original else ""))
 
     def remove_selected_files(self):
         selected_indices = self.file_listbox.curselection()
         # Iterate backwards to avoid index shifting issues when deleting
         for i in sorted(selected_indices, reverse=True):
-            self.log_message(f"Removed file: {os.path.basename(self.source_files[i])}")
+            self.log_message(f"Removed: {os.path.basename(os.path.normpath(self.source_files[i]))}")
             self.file_listbox.delete(i)
             del self.source_files[i]
+        self.refresh_source_names()
+
+    def refresh_source_names(self):
+        """Relabel the list: removing a source can give a numbered one its own name back"""
+        for index, (path, name) in enumerate(zip(self.source_files, sources.target_names(self.source_files))):
+            name = name or os.path.basename(os.path.normpath(path))
+            label = f"{name}/ (folder)" if os.path.isdir(path) else name
+            if self.file_listbox.get(index) != label:
+                self.file_listbox.delete(index)
+                self.file_listbox.insert(index, label)
 
     def scan_drives(self):
         self.log_message("Scanning for removable drives...")
+        self.show_drives(hotplug.removable_drives())
+
+    def show_drives(self, drives):
+        # Drives still plugged in keep their tick; new ones start ticked
+        selected = {drive: var.get() for drive, var in self.drive_vars.items()}
         for widget in self.drives_frame.winfo_children():
             widget.destroy()
         self.drive_vars.clear()
-        partitions = psutil.disk_partitions()
-        removable_drives = [p for p in partitions if 'removable' in p.opts or 'cdrom' in p.opts]
-        if not removable_drives:
+        self.drive_paths.clear()
+        self.drive_controls = []
+        if not drives:
             ttk.Label(self.drives_frame, text="No removable drives found.").grid(row=0, column=0, padx=10, pady=10)
         else:
             drive_selection_frame = ttk.Frame(self.drives_frame)
             drive_selection_frame.grid(row=0, column=0, sticky=tk.W, padx=10, pady=5)
             row, col = 0, 0
-            for p in removable_drives:
-                drive_letter = p.device.replace('\\', '')
-                self.drive_vars[drive_letter] = tk.BooleanVar(value=True)
-                chk = ttk.Checkbutton(drive_selection_frame, text=f"{drive_letter} ({p.fstype})", variable=self.drive_vars[drive_letter])
+            for drive in drives:
+                drive_letter = drive.device.replace('\\', '')
+                self.drive_vars[drive_letter] = tk.BooleanVar(value=selected.get(drive_letter, True))
+                self.drive_paths[drive_letter] = drive.mountpoint
+                chk = ttk.Checkbutton(drive_selection_frame, text=f"{drive_letter} ({drive.fstype})", variable=self.drive_vars[drive_letter])
                 chk.grid(row=row, column=col, sticky=tk.W, padx=5, pady=2)
                 col += 1
                 if col % 4 == 0: col = 0; row += 1
@@ -163,11 +266,26 @@ class USBCopierApp:
             self.deselect_all_button.pack(side=tk.LEFT, padx=5)
             self.refresh_drives_button = ttk.Button(self.drives_frame, text="Refresh Drives", command=self.scan_drives)
             self.refresh_drives_button.grid(row=0, column=1, rowspan=2, padx=10, sticky=tk.E)
-            self.controls_to_disable.extend([self.select_all_button, self.deselect_all_button, self.refresh_drives_button])
+            self.drive_controls = [self.select_all_button, self.deselect_all_button, self.refresh_drives_button]
+        if self.controls_busy():
+            self.toggle_controls(enable=False)
+
+    def drives_changed(self, added, removed, drives):
+        for drive in removed:
+            self.log_message(f"Drive removed: {drive.device} ({drive.mountpoint})")
+        for drive in added:
+            self.log_message(f"Drive plugged in: {drive.device} ({drive.mountpoint})")
+        self.show_drives(drives)
+        if self.station_job is not None and added:
+            self.station_pending.extend(drive.device.replace('\\', '') for drive in added)
+            self.root.after(self.STATION_SETTLE_MS, self.start_station_batch)
+
+    def controls_busy(self):
+        return self.copy_in_progress or self.station_job is not None or self.station_running > 0
 
     def toggle_controls(self, enable):
         state = tk.NORMAL if enable else tk.DISABLED
-        for control in self.controls_to_disable:
+        for control in self.controls_to_disable + self.drive_controls:
             control.config(state=state)
         # Also disable drive checkboxes
         for child in self.drives_frame.winfo_children():
@@ -177,75 +295,195 @@ class USBCopierApp:
                     grandchild.config(state=state)
             except tk.TclError:
                 pass
+        # Station mode can always be switched off, and switched on between copies
+        self.station_checkbox.config(state=tk.NORMAL if enable or self.station_job is not None else tk.DISABLED)
+
+    def toggle_station(self):
+        if self.station_mode.get():
+            if not self.source_files:
+                messagebox.showerror("Error", "Please add at least one source file or folder.")
+                self.station_mode.set(False)
+                return
+            self.station_job = (self.source_files.copy(), self.verify_copy.get(), self.sync_copy.get())
+            self.station_done = 0
+            self.toggle_controls(enable=False)
+            self.drive_table.delete(*self.drive_table.get_children())
+            self.log_message(f"Station mode ON: every drive plugged in from now on gets "
+                             f"{describe_sources(self.source_files)}. Drives already plugged in are left alone.")
+            self.status_label.config(text="Station mode: plug in drives")
+        else:
+            self.station_job = None
+            self.station_pending.clear()
+            self.log_message("Station mode OFF" + (", letting the running copies finish" if self.station_running else ""))
+            if not self.controls_busy():
+                self.toggle_controls(enable=True)
+                self.status_label.config(text="Ready")
+
+    def start_station_batch(self):
+        drives = [drive for drive in dict.fromkeys(self.station_pending) if drive in self.drive_paths]
+        self.station_pending.clear()
+        if not drives or self.station_job is None:
+            return
+        files, verify, sync = self.station_job
+        for drive in drives:
+            if self.drive_table.exists(drive):
+                self.drive_table.delete(drive)
+            self.drive_table.insert("", tk.END, iid=drive, text=drive, values=("", "", "0%", "", "Waiting"))
+        self.log_message(f"Station: copying {describe_sources(files)} to {', '.join(drives)}")
+        self.station_running += 1
+        self.launch_copy(files, drives, verify, sync, station=True)
 
     def start_copy(self):
         if not self.source_files: 
-            messagebox.showerror("Error", "Please add at least one source file.")
+            messagebox.showerror("Error", "Please add at least one source file or folder.")
             return
         selected_drives = [drive for drive, var in self.drive_vars.items() if var.get()]
         if not selected_drives: 
             messagebox.showerror("Error", "Please select at least one drive.")
             return
 
-        confirm = messagebox.askyesno("Confirm Copy", f"Copy {len(self.source_files)} file(s) to {len(selected_drives)} drive(s)?")
+        confirm = messagebox.askyesno("Confirm Copy", f"Copy {describe_sources(self.source_files)} to {len(selected_drives)} drive(s)?")
         
         if confirm:
             self.copy_in_progress = True
             self.toggle_controls(enable=False)
             
-            total_operations = len(self.source_files) * len(selected_drives)
-            self.progress_bar['maximum'] = total_operations
+            # Percent of the bytes to write, across the drives; folders are still being listed as it runs
+            self.progress_bar['maximum'] = 100
             self.progress_bar['value'] = 0
             
-            self.log_message(f"Starting copy of {total_operations} total file operations.")
+            self.drive_table.delete(*self.drive_table.get_children())
+            for drive in selected_drives:
+                self.drive_table.insert("", tk.END, iid=drive, text=drive, values=("", "", "0%", "", "Waiting"))
+
+            self.log_message(f"Starting copy of {describe_sources(self.source_files)} to {len(selected_drives)} drive(s).")
             if self.verify_copy.get():
-                self.log_message("NOTE: File verification is ON. This will be slower but safer.")
+                self.log_message("NOTE: File verification is ON: every copy is read back from the drive and "
+                                 "checked against the source's hash.")
+            if self.sync_copy.get():
+                self.log_message("NOTE: Sync is ON: files a drive already holds are skipped, and interrupted "
+                                 "large files carry on where they stopped.")
+            self.launch_copy(self.source_files.copy(), selected_drives, self.verify_copy.get(), self.sync_copy.get())
 
-            thread = threading.Thread(
-                target=self.copy_files_thread, 
-                args=(self.source_files.copy(), selected_drives, self.verify_copy.get())
-            )
-            thread.daemon = True
-            thread.start()
-
-    def copy_files_thread(self, source_files, drives, verify):
-        successful_ops = 0
-        for i, drive in enumerate(drives):
-            self.root.after(0, self.update_status, f"Preparing to copy to {drive}...")
-            target_drive_path = f"{drive}\\"
-            
-            for j, file_path in enumerate(source_files):
-                filename = os.path.basename(file_path)
-                source_dir = os.path.dirname(file_path)
-                
-                progress_text = f"Copying '{filename}' to {drive} ({j+1}/{len(source_files)})"
-                self.root.after(0, self.update_status, progress_text)
-                
-                try:
-                    cmd = ['robocopy', source_dir, target_drive_path, filename, '/R:1', '/W:2']
-                    if verify:
-                        cmd.append('/V') # Add verification flag if requested
-
-                    result = subprocess.run(cmd, capture_output=True, text=True, check=False, creationflags=subprocess.CREATE_NO_WINDOW)
-                    
-                    if result.returncode < 8:
-                        successful_ops += 1
-                    else:
-                        self.log_message(f"✗ FAILED to copy '{filename}' to {drive} (Code: {result.returncode})")
-                        self.log_message(f"  Details: {result.stdout.strip()} {result.stderr.strip()}")
-                
-                except Exception as e:
-                    self.log_message(f"✗ CRITICAL ERROR copying '{filename}' to {drive}: {e}")
-                
-                self.root.after(0, self.progress_bar.step)
-        
-        total_ops = len(source_files) * len(drives)
-        self.root.after(0, self.copy_complete, successful_ops, total_ops)
+    def launch_copy(self, source_files, drives, verify, sync, station=False):
+        # Each file is read once and written to every drive at the same time
+        targets = [self.drive_paths.get(drive, drive) for drive in drives]
+        drive_names = dict(zip(targets, drives))
+
+        def file_done(target, relative_path, error):
+            if error is not None:
+                self.log_message(f"✗ FAILED to copy '{relative_path}' to {drive_names[target]}: {error}")
+
+        copier = FanOutCopier(targets, on_file_done=file_done, log=self.log_message, verify=verify, sync=sync)
+        self.jobs.append((copier, drive_names))
+        if not self.polling:
+            self.polling = True
+            self.root.after(self.PROGRESS_POLL_MS, self.poll_progress)
+        thread = threading.Thread(target=self.copy_files_thread, args=(copier, drive_names, source_files, station))
+        thread.daemon = True
+        thread.start()
+
+    def copy_files_thread(self, copier, drive_names, source_files, station):
+        listed = [0] # Files found so far
+        unreadable = [0] # Files and folders that couldn't be listed
+        started = [0]
+        shown = [0.0]
+
+        def on_entry(entry):
+            if entry.size is not None:
+                listed[0] += 1
+            copier.expect(entry.size or 0)
+
+        def on_error(path, error):
+            unreadable[0] += 1
+            self.log_message(f"✗ Cannot read '{path}': {error}")
+
+        def on_start(entry):
+            started[0] += 1
+            now = time.monotonic()
+            if station or now - shown[0] < self.STATUS_INTERVAL:
+                return
+            shown[0] = now
+            live = len(copier.live_targets())
+            self.root.after(0, self.update_status, f"Copying '{entry[1]}' to {live} drive(s) "
+                                                   f"({started[0]}/{listed[0]} files found)")
+
+        # Single files first, largest first, then each folder's tree as it is walked
+        entries = sources.list_ahead(sources.iter_sources(source_files, on_error=on_error), on_entry=on_entry)
+        copier.start()
+        copier.copy_many(entries, on_start=on_start)
+        entries.close()
+        if not station:
+            self.root.after(0, self.update_status, "Finishing writes...")
+        summaries = copier.finish()
+
+        for summary in summaries:
+            drive = drive_names[summary['target']]
+            speed = f"{summary['mb_per_s']} MB/s" if summary['mb_per_s'] is not None else "n/a"
+            copied = f"{summary['files_ok'] - summary['files_skipped']} copied"
+            if copier.sync:
+                copied += f", {summary['files_skipped']} already up to date"
+                if summary['files_resumed']:
+                    copied += f", {summary['files_resumed']} resumed"
+            verified = f", {summary['files_verified']} verified" if copier.verify else ""
+            if summary['files_rewritten']:
+                verified += f" ({summary['files_rewritten']} rewritten after a mismatch)"
+            self.log_message(f"{drive}: {copied}{verified}, {summary['files_failed']} failed, "
+                             f"{speed} via {summary['method']}"
+                             + (f", dropped ({summary['dropped']})" if summary['dropped'] else ""))
+        if station:
+            # Every file was fsynced; this also gets directory updates onto the sticks before they are pulled
+            if hasattr(os, 'sync'):
+                os.sync()
+            self.root.after(0, self.station_batch_done, copier, drive_names, summaries, listed[0] + unreadable[0])
+        else:
+            successful_ops = sum(summary['files_ok'] for summary in summaries)
+            total_ops = (listed[0] + unreadable[0]) * len(drive_names)
+            self.root.after(0, self.copy_complete, copier, successful_ops, total_ops)
 
     def update_status(self, text):
         self.status_label.config(text=text)
 
-    def copy_complete(self, successful_ops, total_ops):
+    def poll_progress(self):
+        for copier, drive_names in self.jobs:
+            self.show_progress(copier, drive_names)
+        if self.jobs:
+            self.root.after(self.PROGRESS_POLL_MS, self.poll_progress)
+        else:
+            self.polling = False
+
+    def show_progress(self, copier, drive_names):
+        rows = copier.progress()
+        if self.copy_in_progress and rows:
+            # A dropped drive has nothing left to do
+            self.progress_bar['value'] = sum(100.0 if row['dropped'] else row['percent'] or 0.0
+                                             for row in rows) / len(rows)
+        for row in rows:
+            drive = drive_names.get(row['target'])
+            if drive is None or not self.drive_table.exists(drive):
+                continue
+            speed = f"{row['rate'] / 1e6:.1f} MB/s" if row['rate'] is not None else ""
+            done = f"{row['percent']:.0f}%" if row['percent'] is not None else ""
+            eta = format_duration(row['eta']) if row['eta'] is not None and not row['finished'] else ""
+            if row['dropped']:
+                status = f"Dropped: {row['dropped']}"
+            elif row['finished']:
+                status = "Done"
+            elif row['bottleneck']:
+                status = "Slowest, others wait for it"
+            else:
+                status = "Copying"
+            self.drive_table.item(drive, values=(row['hub'] or "", speed, done, eta, status))
+
+    def end_job(self, copier):
+        for job in self.jobs:
+            if job[0] is copier:
+                self.show_progress(*job)
+                self.jobs.remove(job)
+                break
+
+    def copy_complete(self, copier, successful_ops, total_ops):
+        self.end_job(copier)
         self.copy_in_progress = False
         self.toggle_controls(enable=True)
         self.status_label.config(text="Completed")
@@ -258,30 +496,100 @@ class USBCopierApp:
         else:
             messagebox.showinfo("Completed Successfully", message)
 
+    def station_batch_done(self, copier, drive_names, summaries, file_count):
+        self.end_job(copier)
+        self.station_running -= 1
+        for summary in summaries:
+            drive = drive_names[summary['target']]
+            if summary['files_ok'] == file_count:
+                self.station_done += 1
+                status = "Done, safe to remove"
+                self.log_message(f"✓ {drive}: all {file_count} file(s) copied, safe to remove")
+            else:
+                status = f"FAILED: {file_count - summary['files_ok']} of {file_count} file(s), safe to remove"
+                self.log_message(f"✗ {drive}: {file_count - summary['files_ok']} of {file_count} file(s) failed; "
+                                 f"safe to remove, but set it aside")
+            if self.drive_table.exists(drive):
+                self.drive_table.set(drive, "status", status)
+        if self.station_job is not None:
+            self.status_label.config(text=f"Station mode: {self.station_done} drive(s) done, "
+                                          f"{self.station_running} batch(es) copying")
+        elif not self.controls_busy():
+            self.toggle_controls(enable=True)
+            self.status_label.config(text="Ready")
+
     def log_message(self, message):
+        # Called from the copy thread too, so only queue here; flush_log touches the widget
         timestamp = datetime.now().strftime("%H:%M:%S")
-        self.log_text.insert(tk.END, f"[{timestamp}] {message}\n")
-        self.log_text.see(tk.END)
-        self.root.update_idletasks()
+        self.log_queue.put(f"[{timestamp}] {message}")
+        if self.file_logger is not None:
+            self.file_logger.info(message)
+
+    def flush_log(self, reschedule=True):
+        lines = []
+        while True:
+            try:
+                lines.append(self.log_queue.get_nowait())
+            except queue.Empty:
+                break
+        if lines:
+            self.log_history.extend(lines)
+            self.log_text.insert(tk.END, "".join(line + "\n" for line in lines[-self.LOG_MAX_LINES:]))
+            # Trim the oldest lines so long sessions don't slow the widget down
+            line_count = int(self.log_text.index('end-1c').split('.')[0]) - 1
+            if line_count > self.LOG_MAX_LINES:
+                self.log_text.delete("1.0", f"{line_count - self.LOG_MAX_LINES + 1}.0")
+            self.log_text.see(tk.END)
+        if reschedule:
+            self.root.after(self.LOG_FLUSH_MS, self.flush_log)
         
     def clear_log(self):
+        self.flush_log(reschedule=False)
+        self.log_history.clear()
         self.log_text.delete(1.0, tk.END)
         self.log_message("Log cleared.")
         
     def on_closing(self):
-        if self.copy_in_progress:
-            if messagebox.askyesno("Confirm Exit", "A copy operation is in progress. Are you sure you want to exit?"): 
-                self.root.destroy()
-        else:
-            self.root.destroy()
+        if self.copy_in_progress or self.station_running:
+            if not messagebox.askyesno("Confirm Exit", "A copy operation is in progress. Are you sure you want to exit?"): 
+                return
+        self.watcher.stop()
+        self.root.destroy()
             
     def toggle_all_drives(self, select):
         for var in self.drive_vars.values(): 
             var.set(select)
 
+def run_headless(job_path):
+    """Run a job file without the window, printing JSON progress events; returns the exit code"""
+    emit = jobs.EventWriter(sys.stdout)
+    try:
+        job = jobs.load_job(job_path)
+    except (OSError, ValueError) as e:
+        emit('error', message=str(e))
+        return 2
+    files_ok, files_total = jobs.run_job(job, emit)
+    return 0 if files_ok == files_total else 1
+
 def main():
+    parser = argparse.ArgumentParser(description="Ironclad USB Drive Copier")
+    parser.add_argument('--log-file', help="Also keep a rotating log at this path")
+    parser.add_argument('--job', metavar='FILE',
+                        help="Run the copy job in FILE without the window, printing JSON progress events "
+                             "(see jobs.py for the format)")
+    args = parser.parse_args()
+    if args.job:
+        sys.exit(run_headless(args.job))
+    try:
+        import psutil
+    except ImportError:
+        messagebox.showerror(
+            "Dependency Missing",
+            "The 'psutil' library is required. Please install it by running:\npip install psutil"
+        )
+        exit()
     root = tk.Tk()
-    app = USBCopierApp(root)
+    app = USBCopierApp(root, log_file=args.log_file)
     root.mainloop()
 
 if __name__ == "__main__":
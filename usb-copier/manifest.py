@@ -0,0 +1,182 @@
+"""On-drive record of what a sync has copied, so the next sync can skip it.
+
+The manifest is a JSON lines file at the drive root. Its first line names
+the hash and chunk size the hashes were made with; every other line is
+either a finished file:
+    {"path": ..., "size": ..., "mtime_ns": ..., "hash": ..., "stored_size": ..., "stored_mtime_ns": ...}
+or a checkpoint of a large file still being written under its temporary name:
+    {"path": ..., "partial": {"size": ..., "mtime_ns": ..., "start": 12, "chunks": [...]}}
+size and mtime_ns are the source's; stored_* are the copy's as the drive
+keeps them (FAT rounds times). A checkpoint lists the hashes of the chunks
+from "start" on, all of them already synced to the drive.
+
+Lines are only appended, so a drive pulled mid-write loses at most the last
+line, which is ignored on reading. A later line for a path replaces earlier
+ones, and the file is rewritten without the replaced lines once they pile
+up. Losing lines is safe: a file missing from the manifest is just copied
+again.
+"""
+import json
+import os
+import threading
+
+MANIFEST_NAME = '.ironclad-manifest.jsonl'
+VERSION = 1
+
+
+class Manifest:
+    COMPACT_RATIO = 2  # Rewrite once there are this many lines per live entry
+    COMPACT_MIN_LINES = 1000
+
+    def __init__(self, root, hash_name, chunk_size):
+        self.root = root
+        self.path = os.path.join(root, MANIFEST_NAME)
+        self.hash_name = hash_name
+        self.chunk_size = chunk_size
+        self.entries = {}  # Relative path -> finished file line
+        self.partials = {}  # Relative path -> {'size', 'mtime_ns', 'chunks': [hex digests]}
+        self.lines = 0
+        self.rewrite = True  # Until a header with our hash settings is read
+        self.out = None
+        # Appended to from the reader thread (touched files) and the target's writer
+        self.lock = threading.Lock()
+        self.load()
+
+    def load(self):
+        try:
+            f = open(self.path, 'r', encoding='utf-8', errors='replace')
+        except FileNotFoundError:
+            return
+        with f:
+            compatible = False
+            for line in f:
+                try:
+                    item = json.loads(line)
+                except ValueError:
+                    continue
+                if not isinstance(item, dict):
+                    continue
+                if 'manifest' in item:
+                    compatible = (item.get('hash_name') == self.hash_name
+                                  and item.get('chunk_size') == self.chunk_size)
+                    self.rewrite = not compatible
+                    continue
+                self.lines += 1
+                try:
+                    self.apply(item, compatible)
+                except (KeyError, TypeError, AttributeError):
+                    continue
+
+    def apply(self, item, compatible=True):
+        path = item['path']
+        partial = item.get('partial')
+        if partial is None:
+            if not compatible:
+                # Hashes made another way can't be compared; sizes and times still can
+                item.pop('hash', None)
+            self.entries[path] = item
+            self.partials.pop(path, None)
+            return
+        if not compatible:
+            return
+        start = partial['start']
+        current = self.partials.get(path)
+        if current is None or (current['size'], current['mtime_ns']) != (partial['size'], partial['mtime_ns']):
+            current = {'size': partial['size'], 'mtime_ns': partial['mtime_ns'], 'chunks': []}
+        if start > len(current['chunks']):
+            # A gap in the checkpoints; nothing after it can be trusted
+            self.partials.pop(path, None)
+            return
+        current['chunks'] = current['chunks'][:start] + list(partial['chunks'])
+        self.partials[path] = current
+
+    def finished(self, path):
+        return self.entries.get(path)
+
+    def partial(self, path, stat):
+        """Checkpointed chunk hashes of an interrupted copy of this very source, or None"""
+        current = self.partials.get(path)
+        if current is None or (current['size'], current['mtime_ns']) != (stat.st_size, stat.st_mtime_ns):
+            return None
+        return current['chunks']
+
+    def record_file(self, path, stat, digest, stored):
+        """A copy finished and renamed into place; stored is the copy's os.stat"""
+        self.append({
+            'path': path,
+            'size': stat.st_size,
+            'mtime_ns': stat.st_mtime_ns,
+            'hash': digest.hex(),
+            'stored_size': stored.st_size,
+            'stored_mtime_ns': stored.st_mtime_ns
+        })
+
+    def record_chunks(self, path, stat, start, digests):
+        """Chunks from index start on are synced to the drive under the temporary name"""
+        self.append({
+            'path': path,
+            'partial': {
+                'size': stat.st_size,
+                'mtime_ns': stat.st_mtime_ns,
+                'start': start,
+                'chunks': [digest.hex() for digest in digests]
+            }
+        })
+
+    def append(self, item):
+        with self.lock:
+            self.apply(dict(item))
+            if self.rewrite:
+                self.compact()  # Writes the new line along with the rest
+                return
+            if self.out is None:
+                self.out = open(self.path, 'a', encoding='utf-8')
+            # Flushed but not fsynced: a lost line only means a file is copied again
+            self.out.write(json.dumps(item, separators=(',', ':')) + "\n")
+            self.out.flush()
+            self.lines += 1
+
+    def header(self):
+        return {'manifest': VERSION, 'hash_name': self.hash_name, 'chunk_size': self.chunk_size}
+
+    def compact(self):
+        """Rewrite the manifest with one line per path, atomically"""
+        if self.out is not None:
+            self.out.close()
+            self.out = None
+        temp_path = self.path + '.tmp'
+        with open(temp_path, 'w', encoding='utf-8') as f:
+            f.write(json.dumps(self.header()) + "\n")
+            for item in self.entries.values():
+                f.write(json.dumps(item, separators=(',', ':')) + "\n")
+            for path, partial in self.partials.items():
+                item = {'path': path, 'partial': {'size': partial['size'], 'mtime_ns': partial['mtime_ns'],
+                                                  'start': 0, 'chunks': partial['chunks']}}
+                f.write(json.dumps(item, separators=(',', ':')) + "\n")
+            f.flush()
+            os.fsync(f.fileno())
+        os.replace(temp_path, self.path)
+        self.lines = len(self.entries) + len(self.partials)
+        self.rewrite = False
+
+    def close(self):
+        with self.lock:
+            live = len(self.entries) + len(self.partials)
+            if self.lines > max(self.COMPACT_MIN_LINES, self.COMPACT_RATIO * live):
+                self.compact()
+            if self.out is not None:
+                try:
+                    os.fsync(self.out.fileno())
+                finally:
+                    self.out.close()
+                    self.out = None
+
+    def abandon(self):
+        """Let go of a drive that is gone, without writing anything"""
+        with self.lock:
+            if self.out is not None:
+                try:
+                    self.out.close()
+                except OSError:
+                    pass
+                self.out = None
@@ -0,0 +1,154 @@
+"""What a copy job reads: single files, and whole folders walked as they are copied.
+
+Single files go to the drive root under their own name, largest first.
+A folder is copied as a tree under its own name, its structure kept, empty
+directories included. Two sources with the same name (folders from
+different parents, say) would be merged on the drive, so later ones get
+" (2)", " (3)"... as a file manager would name them.
+
+Folders are walked with os.scandir one directory at a time, on a
+background thread that stays at most LIST_AHEAD entries ahead of the copy,
+so a 100k-file tree starts copying as soon as its first directory is read,
+and memory doesn't grow with the tree.
+"""
+import os
+import queue
+import threading
+from collections import namedtuple
+
+LIST_AHEAD = 10000
+
+# size is None for an empty directory
+SourceEntry = namedtuple('SourceEntry', 'path relative_path size')
+
+
+def join_relative(prefix, name):
+    return f"{prefix}/{name}" if prefix else name
+
+
+def target_names(paths):
+    """Name each source path gets at the drive root, in order; repeats of a name are numbered.
+
+    Names compare without regard to case, as on FAT and exFAT drives. The
+    same path given twice gets None the second time and is copied once.
+    """
+    taken = set()
+    seen_paths = set()
+    names = []
+    for path in paths:
+        full_path = os.path.normcase(os.path.abspath(path))
+        if full_path in seen_paths:
+            names.append(None)
+            continue
+        seen_paths.add(full_path)
+        name = os.path.basename(os.path.normpath(path))
+        stem, extension = (name, "") if os.path.isdir(path) else os.path.splitext(name)
+        candidate = name
+        number = 2
+        while candidate.casefold() in taken:
+            candidate = f"{stem} ({number}){extension}"
+            number += 1
+        taken.add(candidate.casefold())
+        names.append(candidate)
+    return names
+
+
+def walk_tree(root, prefix, on_error=None):
+    """Yield an entry per file under root (and per empty directory), in name order, depth first"""
+    stack = [(root, prefix)]
+    while stack:
+        directory, relative = stack.pop()
+        subdirectories = []
+        files = []
+        empty = True
+        try:
+            with os.scandir(directory) as entries:
+                for entry in entries:
+                    empty = False
+                    try:
+                        if entry.is_dir(follow_symlinks=False):
+                            subdirectories.append((entry.path, join_relative(relative, entry.name)))
+                        elif entry.is_file():
+                            files.append(SourceEntry(entry.path, join_relative(relative, entry.name),
+                                                     entry.stat().st_size))
+                    except OSError as e:
+                        if on_error is not None:
+                            on_error(entry.path, e)
+        except OSError as e:
+            if on_error is not None:
+                on_error(directory, e)
+            continue
+        # scandir gives the file system's order; one directory at a time is cheap to sort
+        files.sort()
+        yield from files
+        if empty and relative:
+            yield SourceEntry(directory, relative, None)
+        subdirectories.sort(reverse=True)
+        stack.extend(subdirectories)
+
+
+def iter_sources(paths, on_error=None):
+    """Entries for a mix of file and folder paths: the files first, largest first, then each folder's tree"""
+    files = []
+    folders = []
+    for path, name in zip(paths, target_names(paths)):
+        if name is None:
+            continue
+        if os.path.isdir(path):
+            folders.append((path, name))
+            continue
+        try:
+            size = os.stat(path).st_size
+        except OSError:
+            size = 0  # The copy reports it
+        files.append(SourceEntry(path, name, size))
+    files.sort(key=lambda entry: entry.size, reverse=True)
+    yield from files
+    for folder, name in folders:
+        yield from walk_tree(folder, name, on_error)
+
+
+def list_ahead(entries, on_entry=None, limit=LIST_AHEAD):
+    """Iterate entries, producing them on a background thread up to limit ahead of the consumer.
+
+    on_entry(entry) is called from that thread as each entry is found.
+    """
+    found = queue.Queue(maxsize=limit)
+    stopping = threading.Event()
+    done = object()
+    failure = []
+
+    def offer(item):
+        while not stopping.is_set():
+            try:
+                found.put(item, timeout=0.5)
+                return True
+            except queue.Full:
+                continue
+        return False
+
+    def produce():
+        try:
+            for entry in entries:
+                if on_entry is not None:
+                    on_entry(entry)
+                if not offer(entry):
+                    return
+        except Exception as e:
+            failure.append(e)
+        finally:
+            offer(done)
+
+    thread = threading.Thread(target=produce, daemon=True)
+    thread.start()
+    try:
+        while True:
+            entry = found.get()
+            if entry is done:
+                break
+            yield entry
+    finally:
+        # The consumer may stop early, e.g. once every drive is gone
+        stopping.set()
+    if failure:
+        raise failure[0]